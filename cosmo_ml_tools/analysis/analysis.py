@@ -1,29 +1,68 @@
+import os
+from collections import deque
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, Optional
+import numpy as np
 from .base import AnalysisBase
-from getdist import loadMCSamples
+from .cache import load_samples
+from ..stats.convergence import gelman_rubin, split_rhat, ess
+from ..plots.plot import plot_fill_between, plot_colorcoded_y
     
 class Analysis(AnalysisBase):
     
-    def load(self):
-        self._chains=load_chains(self.chains,self.labels)
+    def __init__(self) -> None:
+        self._chains={}
+        self._labels=[]
+        self._filenames=[]
+        self._load_times={}
+    
+    def load(self,chains:list[str],labels:list[str]=None,root:str='',settings:Optional[dict]=None,params:Optional[list[str]]=None,
+             cache:bool=True,n_workers:Optional[int]=None,max_in_flight:Optional[int]=None,verbose:bool=False) -> None:
+        """
+        Load a given set of chains, in parallel (see `load_chains`). The loading time of each chain is stored in `load_times`.
+
+        Args:
+            chains (list[str]): root names of the chains.
+            labels (list[str], optional): labels of the chains. Defaults to None (the root names).
+            root (str, optional): folder prepended to the root names. Defaults to ''.
+            settings (dict, optional): getdist analysis settings. Defaults to None.
+            params (list[str], optional): parameters to load. Defaults to None (all parameters).
+            cache (bool, optional): use (and create) the binary sidecar caches. Defaults to True.
+            n_workers (int, optional): number of chains loaded at once. Defaults to None (one per chain, up to the number of CPUs).
+            max_in_flight (int, optional): maximum number of chains submitted to the pool and not yet collected. Defaults to None (n_workers).
+            verbose (bool, optional): print the loading time of each chain. Defaults to False.
+        """
+        labels=list(chains) if labels is None else list(labels)
+        self._labels=labels
+        self._filenames=[root+chain for chain in chains]
+        self._chains,self._load_times=load_chains(chains,labels,root=root,settings=settings,params=params,cache=cache,
+                                                  n_workers=n_workers,max_in_flight=max_in_flight,verbose=verbose,return_timings=True)
         
-    def add_chain(self, chain: str, label: str=None, root: str='',index:int=-1):
-        if label is None: 
-            label='chain0'
-            self._chains.update(load_chains([chain],[label],root=root))
-        else:
-            pass
+    def add_chain(self,chain:str,label:str=None,root:str='',index:int=-1,**kwargs) -> None:
+        """
+        Append a chain to the loaded chains, at the specified index (default last).
+
+        Args:
+            chain (str): root name of the chain.
+            label (str, optional): label of the chain. Defaults to None (chain{N}).
+            root (str, optional): folder prepended to the root name. Defaults to ''.
+            index (int, optional): position of the chain. Defaults to -1 (last).
+            **kwargs: passed to `load_chains`.
+        """
+        label=f'chain{self.N}' if label is None else label
+        samples,times=load_chains([chain],[label],root=root,return_timings=True,**kwargs)
+        index=self.N if index<0 else index
+        self._labels.insert(index,label)
+        self._filenames.insert(index,root+chain)
+        self._load_times.update(times)
+        self._chains.update(samples)
+        self._chains={lbl: self._chains[lbl] for lbl in self._labels}
 
     def computeEvidence(self,chain:str=None) -> None:
         pass
     
-    
-    def load(self,chains:list[str]) -> None:
-        pass   
-    
-    
-    def add_chain(chain:str,label:str,root:str,index:int=-1):
-        pass    
-    
     def plot_triangle(self,params:list[str]=None):
         pass
     
@@ -31,11 +70,94 @@ class Analysis(AnalysisBase):
     def plot_2D(self,params:list[str]):
         pass
     
-    def plot_posterior_y(self,x,f,theta):
-        pass
+    def plot_posterior_y(self,x:np.ndarray,f:Callable,theta:list[str],chains:list[str]=None,ax=None,colors:list[str]=None,
+                         chunk_size:int=10000,n_workers:Optional[int]=None,executor:str='thread',vectorized:bool=True,
+                         colorcode:bool=False,nsamples:int=75,seed:Optional[int]=None,**kwargs):
+        """
+        Plot the posterior distribution of a given function y = f(x,theta) from the (weighted) MCMC samples of theta,
+        evaluated in chunks over a pool of workers and streamed into the quantile bands of `plot_fill_between`.
+
+        Args:
+            x (np.ndarray): an array with x-values.
+            f (Callable): the function f(x,theta), where theta has shape (n_samples, len(theta)), returning an array of shape (n_samples, len(x))
+                (or f(x,theta_i) for a single sample if `vectorized` is False). It must be picklable if executor='process'.
+            theta (list[str]): names of the parameters passed to f, in that order.
+            chains (list[str], optional): labels of the chains to plot. Defaults to None (all the chains loaded).
+            ax (optional): a matplotlib axes instance. Defaults to None.
+            colors (list[str], optional): a color for each chain. Defaults to None.
+            chunk_size (int, optional): number of samples per chunk. Defaults to 10000.
+            n_workers (int, optional): number of workers. Defaults to None (serial evaluation).
+            executor (str, optional): 'thread' (e.g. for numpy or jax functions, which release the GIL) or 'process'. Defaults to 'thread'.
+            vectorized (bool, optional): whether f accepts a batch of samples. Defaults to True.
+            colorcode (bool, optional): also plot `nsamples` random samples of y, color-coded by -ln L (see `plot_colorcoded_y`). Defaults to False.
+            nsamples (int, optional): number of color-coded samples. Defaults to 75.
+            seed (int, optional): seed for the color-coded samples. Defaults to None.
+            **kwargs: passed to `plot_fill_between`.
+        """
+        if ax is None:
+            import matplotlib.pyplot as plt
+            _,ax=plt.subplots()
+        chains=list(self._chains) if chains is None else chains
+        color=kwargs.pop('color','gray')
+        for i,label in enumerate(chains):
+            samples=self._chains[label]
+            theta_samples=np.column_stack([samples[p] for p in theta])
+            blocks=posterior_y(x,f,theta_samples,samples.weights,chunk_size,n_workers,executor,vectorized)
+            plot_fill_between(x,blocks,label=label,ax=ax,color=colors[i] if colors is not None else color,**kwargs)
+            if colorcode:
+                rng=np.random.default_rng(seed)
+                idx=rng.choice(len(theta_samples),size=nsamples,p=samples.weights/samples.weights.sum())
+                ys=_eval_chunk(f,x,theta_samples[idx],vectorized)
+                plot_colorcoded_y(x,ys,samples.loglikes[idx],fig=ax.figure,nsamples=nsamples,seed=seed)
+        return ax
     
-    def _getGelmanRubin(self):
-        pass
+    def _getGelmanRubin(self,params:list[str]=None,method:str='classic',chunk_size:int=100000) -> dict:
+        """
+        Gelman-Rubin statistics of the chains loaded, for all the parameters at once.
+
+        Args:
+            params (list[str], optional): parameters to check. Defaults to None (all parameters).
+            method (str, optional): 'classic' for R-1 = var(chain means)/mean(chain variances), computed with streaming accumulators,
+                or 'rank' for the rank-normalized split R-hat (minus one) of Vehtari et al. (2021). Defaults to 'classic'.
+            chunk_size (int, optional): number of rows per chunk for the 'classic' method. Defaults to 100000.
+
+        Returns:
+            dict: R-1 for each parameter (as a dict), with the chain labels as keys. The 'classic' R-1 of samples made
+            of a single chain is NaN (with a warning).
+        """
+        if method not in ('classic','rank'):
+            raise ValueError(f'Unknown method {method}, choose between classic and rank')
+        results={}
+        for label,samples in self._chains.items():
+            names,chains,weights=_split_chains(samples,params)
+            if method=='classic':
+                if len(chains)<2:
+                    warnings.warn(f"The Gelman-Rubin R-1 of {label} needs at least 2 chains, got {len(chains)}. "
+                                  "Use method='rank' (split R-hat) for a single chain")
+                    R=np.full(len(names),np.nan)
+                else:
+                    R=gelman_rubin(chains,weights,chunk_size=chunk_size)
+            else:
+                R=split_rhat(chains,weights)-1
+            results[label]=dict(zip(names,R))
+        return results
+    
+    def getESS(self,params:list[str]=None,method:str='bulk') -> dict:
+        """
+        Effective sample size of the chains loaded, for all the parameters at once (see `stats.convergence.ess`).
+
+        Args:
+            params (list[str], optional): parameters to check. Defaults to None (all parameters).
+            method (str, optional): 'bulk', 'tail' or 'mean'. Defaults to 'bulk'.
+
+        Returns:
+            dict: the ESS for each parameter (as a dict), with the chain labels as keys.
+        """
+        results={}
+        for label,samples in self._chains.items():
+            names,chains,weights=_split_chains(samples,params)
+            results[label]=dict(zip(names,ess(chains,weights,method=method)))
+        return results
     
     def getInfo(self):
         pass
@@ -43,5 +165,119 @@ class Analysis(AnalysisBase):
     def set_aliases(self,aliases:dict) -> None:
         pass    
             
-def load_chains(chains: list, labels: list, root: str='') -> dict:
-    return {lbl: loadMCSamples(root+chain_fn) for lbl,chain_fn in zip(labels,chains)}
+def load_chains(chains: list, labels: list, root: str='', settings: Optional[dict]=None,
+                params: Optional[list[str]]=None, cache: bool=True, n_workers: Optional[int]=None,
+                max_in_flight: Optional[int]=None, verbose: bool=False, return_timings: bool=False):
+    """
+    Load a set of chains as getdist samples, through their binary sidecar caches (see `cache.load_samples`).
+    Parsing is CPU bound, so the chains are loaded concurrently over a pool of processes, with at most `max_in_flight`
+    chains submitted and not yet collected. The samples are the same as when loading them serially.
+
+    Args:
+        chains (list): root names of the chains.
+        labels (list): labels of the chains.
+        root (str, optional): folder prepended to the root names. Defaults to ''.
+        settings (dict, optional): getdist analysis settings. Defaults to None.
+        params (list[str], optional): parameters to load. Defaults to None (all parameters).
+        cache (bool, optional): use (and create) the sidecar caches. Defaults to True.
+        n_workers (int, optional): number of chains loaded at once. Defaults to None (one per chain, up to the number of CPUs).
+        max_in_flight (int, optional): maximum number of chains submitted to the pool and not yet collected. Defaults to None (n_workers).
+        verbose (bool, optional): print the loading time of each chain. Defaults to False.
+        return_timings (bool, optional): also return the loading time (in seconds) of each chain. Defaults to False.
+
+    Returns:
+        dict: the samples, with the labels as keys (in the same order as the chains), and the timings if return_timings.
+    """
+    n_workers=min(len(chains),os.cpu_count() or 1) if n_workers is None else n_workers
+    results={}
+    if n_workers<2:
+        for lbl,chain_fn in zip(labels,chains):
+            results[lbl]=_load_timed(root+chain_fn,settings,params,cache)
+            _report(lbl,results[lbl][1],verbose)
+    else:
+        max_in_flight=n_workers if max_in_flight is None else max(max_in_flight,1)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            pending={}
+            for lbl,chain_fn in zip(labels,chains):
+                pending[pool.submit(_load_timed,root+chain_fn,settings,params,cache)]=lbl
+                while len(pending)>=max_in_flight:
+                    done,_=wait(pending,return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _collect(results,pending.pop(future),future,verbose)
+            for future in wait(pending).done:
+                _collect(results,pending[future],future,verbose)
+    samples={lbl: results[lbl][0] for lbl in labels}
+    if return_timings:
+        return samples,{lbl: results[lbl][1] for lbl in labels}
+    return samples
+
+def _load_timed(root: str, settings: Optional[dict], params: Optional[list[str]], cache: bool) -> tuple:
+    """Load a chain (see `cache.load_samples`) and measure the time it takes"""
+    start=time.perf_counter()
+    samples=load_samples(root,settings,params,cache)
+    return samples,time.perf_counter()-start
+
+def _collect(results: dict, label: str, future, verbose: bool) -> None:
+    results[label]=future.result()
+    _report(label,results[label][1],verbose)
+
+def _report(label: str, seconds: float, verbose: bool) -> None:
+    if verbose:
+        print(f'{label}: loaded in {seconds:.2f} s')
+
+def _split_chains(samples, params: Optional[list[str]] = None) -> tuple[list,list,list]:
+    """Parameter names, and samples and weights of each of the individual chains combined in a getdist MCSamples"""
+    names=samples.getParamNames().list() if params is None else params
+    idx=[samples.index[p] for p in names]
+    offsets=samples.chain_offsets
+    chains=[samples.samples[offsets[i]:offsets[i+1],idx] for i in range(len(offsets)-1)]
+    weights=[samples.weights[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+    return names,chains,weights
+
+def posterior_y(x: np.ndarray, f: Callable, samples: np.ndarray, weights: Optional[np.ndarray] = None,
+                chunk_size: int = 10000, n_workers: Optional[int] = None, executor: str = 'thread',
+                vectorized: bool = True) -> Iterator[tuple]:
+    """
+    Evaluate y = f(x,theta) over (weighted) samples of theta, in chunks and in parallel.
+    At most 2 x n_workers chunks are in flight, so that the memory usage stays bounded when the results
+    are consumed on the fly (e.g. by `plot_fill_between` or `stats.quantiles.StreamingQuantiles`).
+
+    Args:
+        x (np.ndarray): an array with x-values.
+        f (Callable): the function f(x,theta), with theta of shape (chunk_size, n_params) if vectorized, else (n_params,).
+        samples (np.ndarray): samples of theta, with shape (n_samples, n_params).
+        weights (np.ndarray, optional): the weights of the samples. Defaults to None (equal weights).
+        chunk_size (int, optional): number of samples per chunk. Defaults to 10000.
+        n_workers (int, optional): number of workers. Defaults to None (serial evaluation).
+        executor (str, optional): 'thread' or 'process'. Defaults to 'thread'.
+        vectorized (bool, optional): whether f accepts a batch of samples. Defaults to True.
+
+    Yields:
+        tuple: the samples of y for a chunk, with shape (chunk_size, len(x)), and their weights.
+    """
+    weights=np.ones(len(samples)) if weights is None else np.asarray(weights)
+    starts=range(0,len(samples),chunk_size)
+    if not n_workers or n_workers<2:
+        for start in starts:
+            yield _eval_chunk(f,x,samples[start:start+chunk_size],vectorized),weights[start:start+chunk_size]
+        return
+    
+    if executor not in ('thread','process'):
+        raise ValueError(f'Unknown executor {executor}, choose between thread and process')
+    Pool=ThreadPoolExecutor if executor=='thread' else ProcessPoolExecutor
+    with Pool(max_workers=n_workers) as pool:
+        pending=deque()
+        for start in starts:
+            pending.append((start,pool.submit(_eval_chunk,f,x,samples[start:start+chunk_size],vectorized)))
+            if len(pending)>=2*n_workers:
+                start,future=pending.popleft()
+                yield future.result(),weights[start:start+chunk_size]
+        while pending:
+            start,future=pending.popleft()
+            yield future.result(),weights[start:start+chunk_size]
+
+def _eval_chunk(f: Callable, x: np.ndarray, theta: np.ndarray, vectorized: bool) -> np.ndarray:
+    """Evaluate f(x,theta) for a chunk of samples of theta"""
+    if vectorized:
+        return np.asarray(f(x,theta))
+    return np.array([f(x,t) for t in theta])
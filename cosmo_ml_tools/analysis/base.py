@@ -145,8 +145,8 @@ class AnalysisBase(ABC):
         ...    
     
     @abstractmethod
-    def _getGelmanRubin(self):
-        """Computee the Gelman-Rubin (R-1) statistics for the chains"""
+    def _getGelmanRubin(self,params:list[str]=None):
+        """Compute the Gelman-Rubin (R-1) statistics for the chains"""
         ...   
     
     @abstractmethod
@@ -164,11 +164,11 @@ class AnalysisBase(ABC):
         ...        
         
     @property
-    def GelmanRubin(self) -> list:
+    def GelmanRubin(self) -> dict:
         """
         Gelman Rubin (R-1) statistics for the chains loaded.
         """
-        self._getGelmanRubin(self)
+        return self._getGelmanRubin()
         
     @property
     def chains(self) -> dict:
@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from typing import Optional
+from getdist import loadMCSamples, MCSamples
+from getdist.chains import chainFiles
+
+_CACHE_VERSION = 1
+
+def load_samples(root: str, settings: Optional[dict] = None, params: Optional[list[str]] = None, cache: bool = True) -> MCSamples:
+    """
+    Load a set of chains as getdist samples, through a binary sidecar cache: the first time, the chains are parsed
+    with ``loadMCSamples`` and their columns (after burn-in removal) are saved as .npy files in ``{root}.npcache``,
+    next to the .paramnames file. Later loads read the memory-mapped columns instead of the text files,
+    as long as the chain files (mtime and size) and the analysis settings are unchanged.
+
+    Args:
+        root (str): root name of the chain files, as for ``loadMCSamples``.
+        settings (dict, optional): getdist analysis settings, e.g. {'ignore_rows': 0.3}. Defaults to None.
+        params (list[str], optional): parameters to load, the other columns are never read from the cache. Defaults to None (all parameters).
+        cache (bool, optional): use (and create) the sidecar cache. Defaults to True.
+
+    Returns:
+        MCSamples: the samples.
+    """
+    if not cache:
+        samples = loadMCSamples(root, settings=settings)
+        return samples if params is None else _subset(samples, params, settings)
+    manifest = read_manifest(root, settings)
+    if manifest is None:
+        samples = loadMCSamples(root, settings=settings)
+        write_cache(root, samples, settings)
+        if params is None:
+            return samples
+        manifest = read_manifest(root, settings)
+        if manifest is None:  # the cache could not be written
+            return _subset(samples, params, settings)
+    return _from_cache(root, manifest, params, settings)
+
+def load_columns(root: str, params: Optional[list[str]] = None, settings: Optional[dict] = None) -> Optional[dict]:
+    """
+    Memory-mapped columns of the sidecar cache of a set of chains (see `load_samples`).
+
+    Args:
+        root (str): root name of the chain files.
+        params (list[str], optional): parameters to read. Defaults to None (all parameters).
+        settings (dict, optional): getdist analysis settings used when creating the cache. Defaults to None.
+
+    Returns:
+        dict | None: the 'weights', 'loglikes' and parameters columns, or None if the cache is missing or outdated.
+    """
+    manifest = read_manifest(root, settings)
+    if manifest is None:
+        return None
+    names = [name.rstrip('*') for name in manifest['names']] if params is None else params
+    columns = ['weights', 'loglikes'] + names
+    return {col: _read_column(root, manifest, col) for col in columns}
+
+def read_manifest(root: str, settings: Optional[dict] = None) -> Optional[dict]:
+    """Read the manifest of the sidecar cache, returning None if it is missing or outdated"""
+    fname = os.path.join(_cache_dir(root), 'manifest.json')
+    if not os.path.exists(fname):
+        return None
+    with open(fname, 'r') as file:
+        manifest = json.load(file)
+    if (manifest.get('version') != _CACHE_VERSION or manifest['settings'] != _settings_key(settings)
+            or manifest['sources'] != _signature(root)):
+        return None
+    return manifest
+
+def write_cache(root: str, samples: MCSamples, settings: Optional[dict] = None) -> None:
+    """
+    Write the columns of a set of samples (as loaded with ``loadMCSamples``) to the sidecar cache.
+    The cache is silently skipped if the folder of the chains is not writable.
+    """
+    cache_dir = _cache_dir(root)
+    names = [p.name + ('*' if p.isDerived else '') for p in samples.paramNames.names]
+    manifest = {
+        'version': _CACHE_VERSION,
+        'settings': _settings_key(settings),
+        'sources': _signature(root),
+        'names': names,
+        'labels': [p.label for p in samples.paramNames.names],
+        'ranges': {name: [samples.ranges.getLower(name), samples.ranges.getUpper(name)] for name in samples.getParamNames().list()},
+        'chain_offsets': np.asarray(samples.chain_offsets).tolist(),
+        'columns': {'weights': 'weights.npy', 'loglikes': 'loglikes.npy' if samples.loglikes is not None else None},
+        'name_tag': samples.name_tag,
+    }
+    try:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+        np.save(os.path.join(cache_dir, 'weights.npy'), samples.weights)
+        if samples.loglikes is not None:
+            np.save(os.path.join(cache_dir, 'loglikes.npy'), samples.loglikes)
+        for i, name in enumerate(names):
+            manifest['columns'][name.rstrip('*')] = f'col_{i}.npy'
+            np.save(os.path.join(cache_dir, f'col_{i}.npy'), np.ascontiguousarray(samples.samples[:, i]))
+        # the manifest is written last, so that an interrupted write never looks like a valid cache
+        with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix='.json', delete=False) as tmp:
+            json.dump(manifest, tmp)
+        os.replace(tmp.name, os.path.join(cache_dir, 'manifest.json'))
+    except OSError:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def _from_cache(root, manifest, params=None, settings=None):
+    """Build the getdist samples from the cached columns (only reading the requested parameters)"""
+    names = [name.rstrip('*') for name in manifest['names']]
+    idx = range(len(names)) if params is None else [names.index(p) for p in params]
+    columns = np.column_stack([_read_column(root, manifest, names[i]) for i in idx])
+    weights = np.array(_read_column(root, manifest, 'weights'))
+    loglikes = _read_column(root, manifest, 'loglikes')
+    loglikes = None if loglikes is None else np.array(loglikes)
+    offsets = manifest['chain_offsets']
+    split = lambda arr: None if arr is None else [arr[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    ranges = {names[i]: manifest['ranges'][names[i]] for i in idx if names[i] in manifest['ranges']}
+    return MCSamples(samples=split(columns), weights=split(weights), loglikes=split(loglikes),
+                     names=[manifest['names'][i] for i in idx], labels=[manifest['labels'][i] for i in idx],
+                     ranges=ranges, settings=_no_burn_in(settings), name_tag=manifest['name_tag'])
+
+def _subset(samples, params, settings=None):
+    """Getdist samples restricted to a subset of parameters"""
+    idx = [samples.index[p] for p in params]
+    offsets = samples.chain_offsets
+    split = lambda arr: None if arr is None else [arr[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    info = [samples.paramNames.names[i] for i in idx]
+    return MCSamples(samples=split(samples.samples[:, idx]), weights=split(samples.weights), loglikes=split(samples.loglikes),
+                     names=[p.name + ('*' if p.isDerived else '') for p in info], labels=[p.label for p in info],
+                     ranges={p: [samples.ranges.getLower(p), samples.ranges.getUpper(p)] for p in params},
+                     settings=_no_burn_in(settings), name_tag=samples.name_tag)
+
+def _no_burn_in(settings):
+    """The analysis settings of the samples, without burn-in removal (it was already applied when they were loaded)"""
+    return dict(settings or {}, ignore_rows=0)
+
+def _read_column(root, manifest, name):
+    fname = manifest['columns'].get(name)
+    if fname is None:
+        return None
+    return np.load(os.path.join(_cache_dir(root), fname), mmap_mode='r')
+
+def _cache_dir(root):
+    return root + '.npcache'
+
+def _settings_key(settings):
+    return json.loads(json.dumps(settings or {}, sort_keys=True, default=str))
+
+def _signature(root):
+    """Paths, mtimes and sizes of the files the samples are loaded from"""
+    files = chainFiles(root) or chainFiles(root, separator='.')
+    # the parameter names and ranges, and the Cobaya/CosmoMC metadata read by loadMCSamples
+    files += [root + ext for ext in ('.paramnames', '.ranges', '.updated.yaml', '.properties.ini') if os.path.exists(root + ext)]
+    return [[f, os.stat(f).st_mtime_ns, os.stat(f).st_size] for f in files]
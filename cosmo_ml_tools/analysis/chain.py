@@ -1,16 +1,26 @@
+import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional
 from .base import ChainBase
-from getdist import loadMCSamples
+from .cache import load_samples
+try:
+    import pandas as pd
+except ModuleNotFoundError:
+    pd = None
 
 class MHChain(ChainBase):    
     """
     Metropolis-Hastings Base Class
     """
-    def load(self,engine:str='getdist'):
+    def load(self,engine:str='getdist',params:Optional[list[str]]=None,cache:bool=True):
         """Load the chain using the specified Engine. Defaults to Getdist.
 
         Args:
             engine (str, optional): choice analysis engine. Engines that are currently implemented include: ['getdist'] Defaults to 'getdist'. TODO: include compatibility with `chainconsumer` and `anesthaetic`
+            params (list[str], optional): parameters to load. Defaults to None (all parameters).
+            cache (bool, optional): read the chain from its binary sidecar cache, creating it on first load (see `cache.load_samples`). Defaults to True.
         Raises:
             NotImplementedError: If the engine is not yet implemented
 
@@ -18,7 +28,7 @@ class MHChain(ChainBase):
             Samples: an instance of the Samples class.
         """
         if engine=='getdist':
-            return loadMCSamples(self._root+self.fn,self.gd_settings)
+            return load_samples(self._root+self.fn,self.gd_settings,params=params,cache=cache)
         else:
             raise NotImplementedError
     
@@ -57,39 +67,80 @@ class MontePythonChain(MHChain):
 # Helpers functions    
 #####################    
 
-def convert_to_harmonic(chain_fn:str,ndim:int,N:int=4,sampler:str='cobaya',ignore:float=0.3)-> tuple[list,list]:
+def convert_to_harmonic(chain_fn:str,ndim:int,N:int=4,sampler:str='cobaya',ignore:float=0.3,n_workers:Optional[int]=None)-> tuple[list,list]:
     """
     Helper function to convert a set of chains into a Harmonic-friendly format
 
     Args:
         chain_fn (str): the location of the chains on the disk, where chain_fn is the root for all the chains (and .param_names files)
         ndim (int): Number of sampled (free parameters)
-        N (int, optional): Number of chains {chain_fn}__i.txt with i from 1 to N. Defaults to 4.
+        N (int, optional): Number of chains {chain_fn}.i.txt with i from 1 to N. Defaults to 4.
         sampler (str, optional): specifies sampler used to compute the samples, useful for the format. Defaults to 'cobaya'.
         ignore (float, optional): The fraction of samples to reject as burn-in. Defaults to 0.3.
+        n_workers (int, optional): Number of chains read in parallel. Defaults to None (one per chain, up to the number of CPUs).
 
     Returns:
         tuple[list,list]: a tuple with the samples and log-posterior values in a Harmonic-compatible format
     """
-    #Load individual chains
-    chains={f'chain{i}': np.loadtxt(f'{chain_fn}.{i}.txt') for i in range(1,N)}
-    
-    # Determine the smaller of them and determine burn-in
-    min_len=np.min([chain.shape[0] for chain in chains.values()])
-    burn_in=int(ignore * min_len)
-    
-    # Reshape them into harmonic-friendly format
-    if sampler=='cobaya':
-        samples=np.array([chain[burn_in:min_len,2:ndim+2] for chain in chains.values()]).reshape((N,min_len-burn_in,ndim))
-        lnprob=-np.array([chain[burn_in:min_len,1] for chain in chains.values()]).reshape((N,min_len-burn_in))
-    
     #TODO: Implement Montepython compatibility (Should check which columns give lnprob and whether the sampled params are first)
-    elif sampler=='montepython':
+    if sampler=='montepython':
         print('Sorry, Montepython not yet implemented!')
         return
-   
-    else:
+    elif sampler!='cobaya':
         print('Sorry, sampler not recognized or not yet implemented!')
         return
     
-    return samples, lnprob
\ No newline at end of file
+    #Load individual chains, only parsing the -lnprob and sampled parameters columns
+    usecols=list(range(1,ndim+2))
+    chains=read_chains([f'{chain_fn}.{i}.txt' for i in range(1,N+1)],usecols=usecols,n_workers=n_workers)
+    
+    # Determine the smaller of them and determine burn-in
+    min_len=np.min([chain.shape[0] for chain in chains])
+    burn_in=int(ignore * min_len)
+    
+    # Copy them directly into the harmonic-friendly format (burn-in is removed through views of the chains)
+    samples=np.empty((N,min_len-burn_in,ndim))
+    lnprob=np.empty((N,min_len-burn_in))
+    for i,chain in enumerate(chains):
+        samples[i]=chain[burn_in:min_len,1:]
+        np.negative(chain[burn_in:min_len,0],out=lnprob[i])
+    
+    return samples, lnprob
+
+def read_chain(fname:str,usecols:Optional[list[int]]=None,engine:str='numpy') -> np.ndarray:
+    """
+    Read a text chain file (e.g. from Cobaya or MontePython), only parsing the requested columns.
+
+    Args:
+        fname (str): the chain file.
+        usecols (list[int], optional): indices of the columns to read, all others are skipped while parsing. Defaults to None (all columns).
+        engine (str, optional): the text parser, 'numpy' (the C parser of np.loadtxt, numpy>=1.23) or 'pandas' (C engine). Defaults to 'numpy'.
+
+    Returns:
+        np.ndarray: an array of shape (n_samples, len(usecols)), with the columns in increasing order.
+    """
+    usecols=None if usecols is None else sorted(usecols)
+    if engine=='pandas' and pd is not None:
+        df=pd.read_csv(fname,sep=r'\s+',comment='#',header=None,usecols=usecols,dtype=np.float64,engine='c')
+        return df.to_numpy()
+    return np.loadtxt(fname,usecols=usecols,ndmin=2)
+
+def read_chains(fnames:list[str],usecols:Optional[list[int]]=None,n_workers:Optional[int]=None,engine:str='numpy') -> list[np.ndarray]:
+    """
+    Read several text chain files in parallel, one file per process (see `read_chain`).
+
+    Args:
+        fnames (list[str]): the chain files.
+        usecols (list[int], optional): indices of the columns to read. Defaults to None (all columns).
+        n_workers (int, optional): number of files read at once. Defaults to None (one per file, up to the number of CPUs).
+        engine (str, optional): the text parser, 'numpy' or 'pandas'. Defaults to 'numpy'.
+
+    Returns:
+        list[np.ndarray]: the chains, in the same order as fnames.
+    """
+    read=partial(read_chain,usecols=usecols,engine=engine)
+    n_workers=min(len(fnames),os.cpu_count() or 1) if n_workers is None else n_workers
+    if n_workers<2:
+        return [read(fname) for fname in fnames]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(read,fnames))
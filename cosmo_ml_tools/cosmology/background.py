@@ -0,0 +1,86 @@
+import numpy as np
+from typing import Optional, Union
+from scipy.interpolate import make_interp_spline
+
+_BACKGROUND_KEYS = {'H': 'H [1/Mpc]',
+                    'comoving_distance': 'comov. dist.',
+                    'angular_distance': 'ang.diam.dist.',
+                    'luminosity_distance': 'lum. dist.',
+                    'D': 'gr.fac. D',
+                    'f': 'gr.fac. f'}
+
+class BackgroundInterpolator:
+    """
+    Vectorized spline interpolation of the background table computed by Class.
+    """
+    def __init__(self, background: dict, order: int = 3, z_max: Optional[float] = None) -> None:
+        """
+        Interpolate the columns of a Class background table (as returned by ``get_background()``) at arbitrary redshifts.
+        Splines are built in x = ln(1+z) and only for the requested columns, the first time they are needed.
+        Strictly positive columns (e.g. H, rho_i) are interpolated in log-space.
+
+        Args:
+            background (dict): the background table as returned by ``cosmo.get_background()``.
+            order (int, optional): order of the interpolating splines. Defaults to 3.
+            z_max (float | None, optional): keep only the table rows with z <= z_max (plus one more row), which reduces the cost of building the splines. Defaults to None.
+        """
+        z = np.asarray(background['z'])
+        x, idx = np.unique(np.log1p(z), return_index=True)
+        if z_max is not None:
+            n = min(np.searchsorted(x, np.log1p(z_max)) + 2, x.size)
+            x, idx = x[:n], idx[:n]
+        self.order = order
+        self._x = x
+        self._idx = idx
+        self._background = background
+        self._splines = {}
+
+    def __call__(self, key: str, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """
+        Evaluate a column of the background table at the redshifts z.
+
+        Args:
+            key (str): a column of the Class background table, e.g. '(.)rho_cdm' or 'H [1/Mpc]'.
+            z (float | np.ndarray): redshift(s) where to evaluate the column.
+
+        Returns:
+            float | np.ndarray: the interpolated values, with the same shape as z.
+        """
+        if key not in self._splines:
+            self._splines[key] = self._build(key)
+        spline, log = self._splines[key]
+        y = spline(np.log1p(z))
+        return np.exp(y) if log else y
+
+    def _build(self, key: str) -> tuple:
+        y = np.asarray(self._background[key])[self._idx]
+        log = bool(np.all(y > 0))
+        return make_interp_spline(self._x, np.log(y) if log else y, k=self.order), log
+
+    def H(self, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Hubble rate in 1/Mpc"""
+        return self(_BACKGROUND_KEYS['H'], z)
+
+    def comoving_distance(self, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Comoving distance in Mpc"""
+        return self(_BACKGROUND_KEYS['comoving_distance'], z)
+
+    def angular_distance(self, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Angular diameter distance in Mpc"""
+        return self(_BACKGROUND_KEYS['angular_distance'], z)
+
+    def luminosity_distance(self, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Luminosity distance in Mpc"""
+        return self(_BACKGROUND_KEYS['luminosity_distance'], z)
+
+    def growth_factor(self, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Linear growth factor D(z)"""
+        return self(_BACKGROUND_KEYS['D'], z)
+
+    def growth_rate(self, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Linear growth rate f(z) = dlnD/dlna"""
+        return self(_BACKGROUND_KEYS['f'], z)
+
+    def rho(self, component: str, z: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Density of a given component, e.g. 'cdm', 'b', 'g', 'ur', 'lambda', 'fld', 'crit', in units of 3/(8 pi G) Mpc^-2"""
+        return self(f'(.)rho_{component}', z)
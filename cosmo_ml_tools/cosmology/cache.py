@@ -0,0 +1,147 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from collections import Counter
+from dataclasses import is_dataclass, asdict
+from typing import Optional, Union
+
+class DiskCache:
+    """
+    Content-addressed on-disk cache for the outputs of a Boltzmann solver.
+    """
+    def __init__(self, path: str, max_size: float = 1e9) -> None:
+        """
+        Store the solver outputs (Cls, P(k) grids, background tables) in binary .npy files, in one folder per cosmology.
+        Folders are named after a hash of the parameters, outputs are memory-mapped when read back
+        and the least recently used cosmologies are removed once the cache grows above `max_size`.
+
+        Args:
+            path (str): the folder where to store the cache.
+            max_size (float, optional): maximum size of the cache in bytes. Defaults to 1e9 (1GB).
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = Counter()
+        self.misses = Counter()
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(*infos: Optional[Union[dict, object]]) -> str:
+        """
+        Canonical hash of a set of parameter dictionaries (or precision dataclasses).
+
+        Returns:
+            str: a hexadecimal SHA-256 digest, independent of the ordering of the dictionaries' keys.
+        """
+        canonical = [asdict(info) if is_dataclass(info) else info for info in infos]
+        dump = json.dumps(canonical, sort_keys=True, default=_to_json)
+        return hashlib.sha256(dump.encode()).hexdigest()
+
+    def get(self, key: str, name: str) -> Optional[Union[dict, np.ndarray]]:
+        """
+        Read an output from the cache.
+
+        Args:
+            key (str): the hash of the cosmology, as returned by `DiskCache.key`.
+            name (str): the name of the output, e.g. 'background'.
+
+        Returns:
+            dict | np.ndarray | None: the (memory-mapped) output, or None if it is not in the cache.
+        """
+        entry = os.path.join(self.path, key)
+        fname = os.path.join(entry, f'{name}.npy')
+        if not os.path.exists(fname):
+            self.misses[name] += 1
+            return None
+        self.hits[name] += 1
+        os.utime(entry)
+        data = np.load(fname, mmap_mode='r')
+        columns_fname = os.path.join(entry, f'{name}.json')
+        if os.path.exists(columns_fname):
+            with open(columns_fname, 'r') as file:
+                columns = json.load(file)
+            return {col: data[i] for i, col in enumerate(columns)}
+        return data
+
+    def put(self, key: str, name: str, value: Union[dict, np.ndarray]) -> None:
+        """
+        Write an output to the cache. Dictionaries are stored as a single 2D array (one row per key),
+        and are silently skipped if their values do not all have the same shape.
+
+        Args:
+            key (str): the hash of the cosmology, as returned by `DiskCache.key`.
+            name (str): the name of the output, e.g. 'background'.
+            value (dict | np.ndarray): the output to store.
+        """
+        columns = None
+        if isinstance(value, dict):
+            columns = list(value.keys())
+            if len({np.shape(v) for v in value.values()}) != 1:
+                return
+            value = np.stack([np.asarray(v, dtype='float64') for v in value.values()])
+
+        entry = os.path.join(self.path, key)
+        os.makedirs(entry, exist_ok=True)
+        # Write to a temporary file first, so that concurrent readers never see a partial output
+        with tempfile.NamedTemporaryFile(dir=entry, suffix='.npy', delete=False) as tmp:
+            np.save(tmp, np.asarray(value))
+        if columns is not None:
+            with open(os.path.join(entry, f'{name}.json'), 'w') as file:
+                json.dump(columns, file)
+        os.replace(tmp.name, os.path.join(entry, f'{name}.npy'))
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove the least recently used cosmologies until the cache is smaller than `max_size`.
+
+        Args:
+            keep (str | None, optional): a cosmology that should never be removed (e.g. the one just written). Defaults to None.
+        """
+        entries = []
+        for key in os.listdir(self.path):
+            entry = os.path.join(self.path, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, key))
+            except OSError:  # not a folder, or removed by another process in the meantime
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove every output stored in the cache."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    @property
+    def size(self) -> int:
+        """Size of the cache on disk, in bytes."""
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(self.path) for f in files)
+
+def _to_json(obj):
+    """Serialize the numpy types that can appear in parameter dictionaries."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+def array_digest(*arrays: np.ndarray) -> str:
+    """Short hash of a set of arrays, used to tell apart outputs evaluated on different grids."""
+    h = hashlib.sha256()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr, dtype='float64')
+        h.update(str(arr.shape).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()[:16]
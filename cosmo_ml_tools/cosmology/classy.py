@@ -5,9 +5,15 @@ TODO:
 """
 
 
+import os
 import numpy as np
-from typing import Optional, Union
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Union
 from .base import BoltzmannBase
+from .background import BackgroundInterpolator
+from .cache import DiskCache, array_digest
+from .precision import DefaultPrecision
 from .constants import *
 from ..utils import initialize_helper
 
@@ -16,75 +22,211 @@ from ..utils import initialize_helper
 # except ModuleNotFoundError:
 #     print('Class is not installed in the current environment!')
 
+# Background columns (.)rho_X summed up for each of the components in ClassEngine.Omega_of_z
+_RHO_COMPONENTS={'cdm':['cdm'],'c':['cdm'],'b':['b'],'cb':['b','cdm'],'m':['b','cdm','ur'],'g':['g'],'ur':['ur']}
+
 class ClassEngine(BoltzmannBase):
     """Base Class for the Boltzmann solver Class and its extensions"""
     
     def __init__(self,cosmo = None,
                  info: Optional[Union[str,dict]] = None,
-                 other_info: Optional[dict] = None , verbose: int = 0,
-                 name:str = 'name') -> None:
+                 other_info: Optional[Union[dict,DefaultPrecision]] = None , verbose: int = 0,
+                 name:str = 'name', bg_settings: Optional[dict] = None,
+                 disk_cache: Optional[DiskCache] = None) -> None:
         """
         A wrapper for the Boltzmann solvers Class and its extensions.
 
         Args:
             info (str | dict): a string pointing to a .ini/.yaml file or python dictionary with the desired class settings/parameters
-            other_info (dict|None, optional): another set of settings passed to class (e.g. precision settings). Defaults to None.
+            other_info (dict|DefaultPrecision|None, optional): another set of settings passed to class (e.g. precision settings). Defaults to None.
             verbose (int, optional): Print useful information for debugging purposes. Defaults to 0.
             name (str, optional): Give a name to the instance of the class (used for labels in the plots).
+            bg_settings (dict|None, optional): settings passed to the BackgroundInterpolator (e.g. `order`, `z_max`). Defaults to None.
+            disk_cache (DiskCache|None, optional): an on-disk cache for the background, Cls and P(k). When given, Class only runs 
+            for the cosmologies (and outputs) that are not found in the cache. Defaults to None.
         """
         self._k_vals = 'Matter power spectrum not yet computed!'
         self._clean_state = True
         self._name = name
+        self._verbose = verbose
+        self._bg_settings = {} if bg_settings is None else bg_settings
+        self._cache = {}
+        self._cache_hits = Counter()
+        self._cache_misses = Counter()
+        self.other_info = other_info.to_dict() if isinstance(other_info,DefaultPrecision) else other_info
+        self.disk_cache = disk_cache
+        self._params = {}
+        self._pending_compute = False
         
         # Handle the info variable according to the type and return a dictionary
         if info is not None:
             self.info=initialize_helper(info)
 
+        if cosmo is None and disk_cache is not None:
+            # Class only runs if an output is not in the disk cache (see `update`)
+            from classy import Class
+            cosmo = Class()
+            if self.other_info is not None:
+                cosmo.set(self.other_info)
         if cosmo is None:
-            self.cosmo = get_classy(self.info,other_info=other_info)
+            self.cosmo = get_classy(self.info,other_info=self.other_info)
+            self._params.update(self.info)
+            self._clean_state = False
         else:
             self.cosmo = cosmo
             self.update(self.info)
-        
-        self._H_units = {'1/Mpc' : 1, 
-                         'km/s/Mpc' : C_KMS,
-                         'dimensionless': 1 / self.cosmo.Hubble(0)}
+    
+    @property
+    def cosmo(self):
+        """The Class instance. Accessing it runs any computation postponed by `update` (see `disk_cache`)."""
+        if self._pending_compute:
+            self.compute()
+        return self._cosmo
+    
+    @cosmo.setter
+    def cosmo(self,cosmo) -> None:
+        self._cosmo = cosmo
+    
+    @property
+    def _H_units(self) -> dict:
+        return {'1/Mpc' : 1, 
+                'km/s/Mpc' : C_KMS,
+                'dimensionless': 1 / self.background['H [1/Mpc]'][-1]}
 
 
-    def Pk(self,k:Union[float,np.ndarray],units:str='h/Mpc',non_linear:bool=False):
+    def Pk(self,k:Union[float,np.ndarray],z:Union[float,np.ndarray]=0.,units:str='h/Mpc',non_linear:bool=False):
         """Retrieve the (linear/non-linear) matter powerspectrum using Class.
 
         Args:
-            k (Union[float,np.ndarray]): _description_
-            units (str, optional): _description_. Defaults to 'h/Mpc'.
+            k (Union[float,np.ndarray]): wavenumbers where to evaluate the power spectrum.
+            z (Union[float,np.ndarray], optional): redshift(s) where to evaluate the power spectrum. Defaults to 0.
+            units (str, optional): units of k, either 'h/Mpc' or '1/Mpc'. Defaults to 'h/Mpc'.
+            non_linear (bool, optional): whether to return the non-linear power spectrum. Defaults to False.
 
         Returns:
-            np.ndarray : an array with P(k) values in the requested k-range.
+            np.ndarray : an array with P(k) values in the requested k-range, with shape (len(k),) for a scalar z and (len(z),len(k)) otherwise.
         """
-        return get_Pk(k,self.cosmo,units=units)
+        if self.disk_cache is None:
+            return get_Pk(k,self.cosmo,z=z,units=units,non_linear=non_linear)
+        return self._cached(('Pk',array_digest(k,z),np.ndim(z),units,non_linear),
+                            lambda: get_Pk(k,self.cosmo,z=z,units=units,non_linear=non_linear),persist=True)
         
     def Hubble(self,z: Union[float,np.ndarray], units: str = 'km/s/Mpc'):
-        H=np.array([self.cosmo.Hubble(zi) for zi in z]) if isinstance(z,np.ndarray) else self.cosmo.Hubble(z)
+        if isinstance(z,np.ndarray) or self.disk_cache is not None:
+            H=self.bg_interp.H(z)
+        else:
+            H=self.cosmo.Hubble(z)
         return self._H_units[units] * H
     
+    def comoving_distance(self,z: Union[float,np.ndarray]):
+        """Comoving distance in Mpc"""
+        return self.bg_interp.comoving_distance(z)
+    
+    def angular_distance(self,z: Union[float,np.ndarray]):
+        """Angular diameter distance in Mpc"""
+        return self.bg_interp.angular_distance(z)
+    
+    def luminosity_distance(self,z: Union[float,np.ndarray]):
+        """Luminosity distance in Mpc"""
+        return self.bg_interp.luminosity_distance(z)
+    
+    def growth_factor(self,z: Union[float,np.ndarray]):
+        """Linear growth factor D(z)"""
+        return self.bg_interp.growth_factor(z)
+    
+    def growth_rate(self,z: Union[float,np.ndarray]):
+        """Linear growth rate f(z)"""
+        return self.bg_interp.growth_rate(z)
+    
+    def rho_of_z(self,component:str,z: Union[float,np.ndarray]):
+        """Density of a given component (e.g. 'cdm','b','g','ur','crit') at the redshift(s) z"""
+        return self.bg_interp.rho(component,z)
+    
     def alpha(self,which:str='M'):
-        return self._alphas[which]
+        return self._alphas()[which]
     
     def compute(self):
-        self.cosmo.compute()
+        self._pending_compute=False
+        self._cosmo.compute()
         self._clean_state=False
+        self.clear_cache()
     
     def empty(self):
         if not self._clean_state:
-            self.cosmo.empty()  
-            self.cosmo.cleanup_struct()
+            self._cosmo.empty()  
+            self._cosmo.cleanup_struct()
+        self._params={}
+        self._pending_compute=False
+        self.clear_cache()
+    
+    def clear_cache(self) -> None:
+        """Drop the outputs stored for the current cosmology (hit/miss counters are kept)."""
+        self._cache.clear()
+    
+    @property
+    def cache_info(self) -> dict:
+        """Number of cache hits and misses (i.e. extractions from Class) for each of the cached outputs."""
+        return {key: {'hits': self._cache_hits[key], 'misses': self._cache_misses[key]} 
+                for key in self._cache_misses.keys() | self._cache_hits.keys()}
+    
+    def _cached(self,key,fn:Callable,persist:bool=False):
+        """Return the output stored under `key` for the current cosmology, computing it with `fn()` on the first call.
+        If `persist` is True, the output is also read from (or written to) the disk cache, if any."""
+        if key in self._cache:
+            self._cache_hits[key]+=1
+            return self._cache[key]
+        
+        self._cache_misses[key]+=1
+        if persist and self.disk_cache is not None:
+            name=key if isinstance(key,str) else f'{key[0]}_{DiskCache.key(list(key))[:16]}'
+            cosmo_key=DiskCache.key(self._params,self.other_info)
+            value=self.disk_cache.get(cosmo_key,name)
+            if value is None:
+                value=fn()
+                self.disk_cache.put(cosmo_key,name,value)
+        else:
+            value=fn()
+        self._cache[key]=value
+        return value
     
     def update(self,info:dict) -> None:
         """
         Update the values of the cosmological parameters with the provided dictionary and recompute observables.
         """
-        self.cosmo.set(info)
-        self.compute()
+        self._cosmo.set(info)
+        self._params.update(info)
+        if self.disk_cache is None:
+            self.compute()
+        else:
+            # Postpone the computation until an output that is not in the disk cache is requested
+            self.clear_cache()
+            self._pending_compute=True
+    
+    def map(self,param_dicts:list[dict],outputs:Optional[list[str]]=None,n_workers:Optional[int]=None,
+            output_kwargs:Optional[dict]=None,chunksize:int=1) -> dict:
+        """Evaluate the requested outputs for many cosmologies in parallel.
+        Each worker process holds a single long-lived Class instance (initialized with `self.info` and `self.other_info`)
+        which is updated with each of the parameter dictionaries it receives. The current instance is left untouched.
+
+        Args:
+            param_dicts (list[dict]): a list of dictionaries with the cosmological parameters to update for each point.
+            outputs (list[str] | None, optional): names of the ClassEngine attributes/methods to evaluate, e.g. ['Cls','Pk','Hubble']. Defaults to None, i.e. ['Cls'].
+            n_workers (int | None, optional): number of worker processes. Defaults to None, i.e. the number of CPUs.
+            output_kwargs (dict | None, optional): keyword arguments passed to the methods in `outputs`, e.g. {'Pk': {'k':k,'z':z}}. Defaults to None.
+            chunksize (int, optional): number of points sent to a worker at once. Defaults to 1.
+
+        Returns:
+            dict: a dictionary with the outputs stacked along the first axis (dictionaries, such as Cls, are stacked key by key)
+            and a boolean array 'success', True where Class succeeded (the failed points are filled with NaNs,
+            and reported by the workers if the engine is verbose).
+        """
+        outputs = ['Cls'] if outputs is None else outputs
+        n_workers = os.cpu_count() if n_workers is None else n_workers
+        init_args = (self.info, self.other_info, self._bg_settings, self.disk_cache, outputs, {} if output_kwargs is None else output_kwargs,
+                     self._verbose)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_map_worker, initargs=init_args) as pool:
+            results = list(pool.map(_map_worker, param_dicts, chunksize=chunksize))
+        return _stack_map_results(results, outputs)
     
     def store(self):
         pass
@@ -96,15 +238,33 @@ class ClassEngine(BoltzmannBase):
         pass
     
     def _background(self):
-        return self.cosmo.get_background()
+        return self._cached('background',lambda: self.cosmo.get_background(),persist=True)
     
     def _alphas(self):
-        return get_alphas(self.cosmo)
+        return self._cached('alphas',lambda: get_alphas(self._cosmo,background=self.background))
     
-    def Omega_of_z(self,component:str):
-        _densities={'cdm':self.rho_cdm,'c':self.rho_cdm,'b':self.rho_b,'cb':self.rho_b+self.rho_cdm,'m':self.rho_m,'g':self.rho_g,'ur':self.rho_ur,'de':self.rho_de}
-        Omega_of_z = _densities[component.lower()] / self.rho_crit
-        return Omega_of_z
+    def Omega_of_z(self,component:Union[str,list[str]]) -> np.ndarray:
+        """Density parameter(s) Omega_i(z) = rho_i(z)/rho_crit(z) on the background redshift grid.
+        Only the background columns of the requested components are read, and results are stored until the next compute.
+
+        Args:
+            component (str | list[str]): one of 'cdm' (or 'c'), 'b', 'cb', 'm', 'g', 'ur' and 'de', or a list of them.
+
+        Returns:
+            np.ndarray: Omega_i(z), stacked with shape (len(component),len(z)) when a list of components is given.
+        """
+        if isinstance(component,str):
+            component=component.lower()
+            return self._cached(('Omega_of_z',component),lambda: self._Omega_of_z(component))
+        return np.stack([self.Omega_of_z(c) for c in component])
+    
+    def _Omega_of_z(self,component:str) -> np.ndarray:
+        b=self.background
+        keys=[self.DE_id] if component=='de' else [f'(.)rho_{k}' for k in _RHO_COMPONENTS[component]]
+        rho=b[keys[0]].copy()
+        for key in keys[1:]:
+            rho+=b[key]
+        return rho / b['(.)rho_crit']
     
     @property
     def fde(self):
@@ -150,13 +310,19 @@ class ClassEngine(BoltzmannBase):
     def background(self):
         return self._background()
     
+    @property
+    def bg_interp(self) -> BackgroundInterpolator:
+        """Spline interpolator of the background table, built once per compute."""
+        return self._cached('bg_interp',lambda: BackgroundInterpolator(self.background,**self._bg_settings))
+    
     @property
     def ell(self):
         return self.Cls['ell']
         
     @property
     def Cls(self,ell_factor=True,lensed=True,units='muK2'):
-        return get_Cl(self.cosmo,ell_factor=ell_factor,lensed=lensed,units=units)
+        return self._cached(('Cls',ell_factor,lensed,units),
+                            lambda: get_Cl(self.cosmo,ell_factor=ell_factor,lensed=lensed,units=units),persist=True)
 
     @property
     def H0(self):
@@ -241,11 +407,50 @@ class ClassEngine(BoltzmannBase):
             DE_type='Scalar Field'        
         return DE_type      
 
-def get_Pk(k,cosmo,z:float = 0.,units='h/Mpc'):
-    if units in ['h/Mpc']:
-        h=cosmo.h()
-        return np.array([cosmo.pk(ki*h,z)*h**3 for ki in k])
-    return np.array([cosmo.pk(ki,z) for ki in k])
+def get_Pk(k,cosmo,z:Union[float,np.ndarray] = 0.,units:str='h/Mpc',non_linear:bool=False) -> np.ndarray:
+    """Get the (linear/non-linear) matter power spectrum on a (z,k) grid in a single call.
+
+    Uses the bulk ``get_pk_array`` interface of classy when available. Otherwise, a bicubic spline in (z, ln k)
+    is built from a single ``get_pk_and_k_and_z`` extraction and evaluated on the whole grid at once.
+
+    Args:
+        k (float | np.ndarray): wavenumbers where to evaluate the power spectrum.
+        cosmo (_type_): An instance of the Class class
+        z (float | np.ndarray, optional): redshift(s) where to evaluate the power spectrum. Defaults to 0.
+        units (str, optional): units of k, either 'h/Mpc' or '1/Mpc'. Defaults to 'h/Mpc'.
+        non_linear (bool, optional): whether to return the non-linear power spectrum. Defaults to False.
+
+    Returns:
+        np.ndarray: P(k) with shape (len(k),) for a scalar z and (len(z),len(k)) otherwise.
+    """
+    k=np.atleast_1d(np.asarray(k,dtype='float64'))
+    zs=np.atleast_1d(np.asarray(z,dtype='float64'))
+    h=cosmo.h() if units in ['h/Mpc'] else 1.
+    k_Mpc=np.ascontiguousarray(k*h)
+    
+    if hasattr(cosmo,'get_pk_array'):
+        pk=cosmo.get_pk_array(k_Mpc,np.ascontiguousarray(zs),k_Mpc.size,zs.size,int(non_linear))
+        pk=np.reshape(pk,(zs.size,k_Mpc.size))
+    elif hasattr(cosmo,'get_pk_and_k_and_z'):
+        pk=_interpolate_Pk(cosmo,k_Mpc,zs,non_linear=non_linear)
+    else:
+        pk=_get_Pk_loop(k_Mpc,cosmo,zs,non_linear=non_linear)
+    
+    pk*=h**3
+    return pk if np.ndim(z) else pk[0]
+
+def _interpolate_Pk(cosmo,k:np.ndarray,z:np.ndarray,non_linear:bool=False) -> np.ndarray:
+    """Evaluate P(k,z) [k in 1/Mpc] from a spline built on the table stored by Class."""
+    from scipy.interpolate import RectBivariateSpline
+    pk_table,k_table,z_table=cosmo.get_pk_and_k_and_z(nonlinear=non_linear)
+    idx=np.argsort(z_table)
+    spline=RectBivariateSpline(z_table[idx],np.log(k_table),np.log(pk_table.T[idx]))
+    return np.exp(spline.ev(z[:,None],np.log(k)[None,:]))
+
+def _get_Pk_loop(k:np.ndarray,cosmo,z:np.ndarray,non_linear:bool=False) -> np.ndarray:
+    """Evaluate P(k,z) [k in 1/Mpc] point by point. Slow, only used if classy exposes no bulk interface."""
+    pk=cosmo.pk if non_linear else cosmo.pk_lin
+    return np.array([[pk(ki,zi) for ki in k] for zi in z])
     
     
 def get_classy(info:dict,other_info:Optional[dict]=None,verbose=0):
@@ -258,12 +463,64 @@ def get_classy(info:dict,other_info:Optional[dict]=None,verbose=0):
     Returns:
         Class instance: a Classy object with computations stored in it.
     """
-    # m=Class()
-    # m.set(info)
-    # if other_info is not None: m.set(other_info)
-    # m.compute()
-    # return m
-    pass
+    from classy import Class
+    m=Class()
+    m.set(info)
+    if other_info is not None: m.set(other_info)
+    m.compute()
+    return m
+
+#####################################    
+# Helpers for ClassEngine.map workers   
+#####################################
+
+_MAP_WORKER = {}
+
+def _init_map_worker(info:dict,other_info:Optional[dict],bg_settings:dict,disk_cache:Optional[DiskCache],
+                     outputs:list[str],output_kwargs:dict,verbose:int=0) -> None:
+    """Create the long-lived ClassEngine of a worker process."""
+    _MAP_WORKER['engine'] = ClassEngine(info=info,other_info=other_info,bg_settings=bg_settings,disk_cache=disk_cache)
+    _MAP_WORKER['outputs'] = outputs
+    _MAP_WORKER['output_kwargs'] = output_kwargs
+    _MAP_WORKER['verbose'] = verbose
+
+def _map_worker(params:dict) -> Optional[dict]:
+    """Update the worker's cosmology and evaluate the requested outputs. Returns None if Class fails
+    (any other error, e.g. an unknown output or keyword argument, is raised)."""
+    from classy import CosmoComputationError, CosmoSevereError
+    engine = _MAP_WORKER['engine']
+    try:
+        engine.update(params)
+        results = {}
+        for out in _MAP_WORKER['outputs']:
+            val = getattr(engine, out)
+            results[out] = val(**_MAP_WORKER['output_kwargs'].get(out, {})) if callable(val) else val
+    except (CosmoComputationError, CosmoSevereError) as err:
+        if _MAP_WORKER['verbose']:
+            print(f'Class failed for {params}: {err}')
+        return None
+    return results
+
+def _stack_map_results(results:list[Optional[dict]],outputs:list[str]) -> dict:
+    """Stack the outputs of ClassEngine.map, filling the failed points with NaNs."""
+    success = np.array([res is not None for res in results])
+    stacked = {'success': success}
+    if not success.any():
+        return stacked
+    template = results[int(np.argmax(success))]
+    
+    def _stack(values,template_val):
+        nan_val = np.full(np.shape(template_val), np.nan)
+        return np.stack([nan_val if val is None else np.asarray(val) for val in values])
+    
+    for out in outputs:
+        values = [None if res is None else res[out] for res in results]
+        if isinstance(template[out], dict):
+            stacked[out] = {key: _stack([None if val is None else val[key] for val in values], template_val)
+                            for key, template_val in template[out].items()}
+        else:
+            stacked[out] = _stack(values, template[out])
+    return stacked
     
 
 def get_Cl(cosmo,ell_factor:bool=True,lensed:bool=True,units:str='muK2') -> dict:
@@ -296,24 +553,50 @@ def get_Cl(cosmo,ell_factor:bool=True,lensed:bool=True,units:str='muK2') -> dict
         
     return  {key: norm * l_factor[key] * val[2:] for key,val in Cls.items()}
 
-def get_alphas(cosmo) -> dict:
+def get_alphas(cosmo,background:Optional[dict]=None) -> dict:
     """Get the evolution of the alpha functions from hiclass
 
     Args:
         cosmo (_type_): An instance of the hi_class/mochi_class class
+        background (dict | None, optional): a background table already extracted from `cosmo`. Defaults to None, in which case it is retrieved from `cosmo`.
     Returns:
         dict: a dictionary containing the evolution of the alpha functions
     """    
     # Retrieve alpha's from Class
-    b = cosmo.get_background()
+    b = cosmo.get_background() if background is None else background
     alphas = {k: b[key] for k,key in zip(['M','B','K','T'],['Mpl_running_smg','braiding_smg','kineticity_smg','tensor_excess_smg'])}
     alpha_H = b['beyond_horndeski_smg'] if 'beyond_horndeski_smg' in b.keys() else np.zeros_like(b['Mpl_running_smg'])
     alphas.update({'H':alpha_H})
     return alphas
 
+def benchmark_Pk(k:Optional[np.ndarray]=None,z:Optional[np.ndarray]=None,n_repeat:int=5) -> tuple[float,float]:
+    """Time the batched P(k,z) of `get_Pk` against the per-k loop, for a default Class cosmology.
+
+    Args:
+        k (np.ndarray | None, optional): wavenumbers in h/Mpc. Defaults to None, i.e. 500 points between 1e-4 and 1.
+        z (np.ndarray | None, optional): redshifts. Defaults to None, i.e. 20 points between 0 and 3.
+        n_repeat (int, optional): number of timed evaluations. Defaults to 5.
+
+    Returns:
+        tuple[float,float]: the mean time (in seconds) of the loop and of the batched evaluation.
+    """
+    from timeit import timeit
+    from classy import Class
+    k=np.logspace(-4,0,500) if k is None else np.asarray(k)
+    z=np.linspace(0,3,20) if z is None else np.asarray(z)
+    cosmo=Class()
+    cosmo.set({'output':'mPk','P_k_max_1/Mpc':10.,'z_max_pk':float(z.max())})
+    cosmo.compute()
+    t_loop=timeit(lambda: _get_Pk_loop(k*cosmo.h(),cosmo,z),number=n_repeat)/n_repeat
+    t_batch=timeit(lambda: get_Pk(k,cosmo,z=z),number=n_repeat)/n_repeat
+    print(f'P(k,z) on a {z.size}x{k.size} grid: loop {t_loop*1e3:.2f} ms, batched {t_batch*1e3:.2f} ms ({t_loop/t_batch:.1f}x)')
+    return t_loop,t_batch
+
 if __name__=='__main__':
     from classy import Class
     
+    benchmark_Pk()
+    
     settings={'output':'tCl,pCl,lCl,mPk','lensing':'yes'}
     
     dic=Class()
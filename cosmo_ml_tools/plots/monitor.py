@@ -1,3 +1,183 @@
 """
 Useful scripts to monitor the status of the computations/chains convergence
-"""
\ No newline at end of file
+"""
+import os
+import re
+import glob
+import numpy as np
+from typing import Optional
+from ..stats.moments import RunningMoments
+from ..stats.convergence import r_minus_one
+
+class ChainFollower:
+    """
+    Follow running MCMC chains ({root}.1.txt, {root}.2.txt, ...) and monitor their convergence.
+    """
+    def __init__(self, root: str, params: Optional[list[str]] = None, names: Optional[list[str]] = None) -> None:
+        """
+        Keep the byte offset reached in each chain file, so that each `update` only parses the rows appended since the previous one,
+        and update running statistics (means, covariances, Gelman-Rubin R-1 and acceptance rates) incrementally,
+        i.e. in O(new rows) per refresh. New chain files are picked up as they appear.
+
+        The first two columns are the weight (multiplicity) and -ln(posterior) of each row, as in Cobaya and MontePython chains.
+        Column names are read from the Cobaya header (or given through `names`, e.g. for MontePython chains).
+
+        Args:
+            root (str): root name of the chains.
+            params (list[str], optional): parameters to monitor. Defaults to None (all the columns but the weight and -ln(posterior)).
+            names (list[str], optional): names of all the columns, if the chains have no header. Defaults to None.
+        """
+        self.root = root
+        self.params = params
+        self.names = names
+        self.history = []
+        self._offsets = {}
+        self._moments = {}
+        self._rows = {}
+        self._cols = None
+
+    @property
+    def files(self) -> list[str]:
+        """Chain files found on disk, sorted by chain index"""
+        pattern = re.compile(re.escape(os.path.basename(self.root)) + r'\.(\d+)\.txt$')
+        files = [f for f in glob.glob(self.root + '.*.txt') if pattern.match(os.path.basename(f))]
+        return sorted(files, key=lambda f: int(pattern.match(os.path.basename(f)).group(1)))
+
+    def update(self) -> int:
+        """
+        Parse the rows appended to the chains since the last update, and update the statistics.
+
+        Returns:
+            int: the number of new rows.
+        """
+        n_new = 0
+        for fname in self.files:
+            rows = self._read_new_rows(fname)
+            if rows is None or len(rows) == 0:
+                continue
+            if fname not in self._moments:
+                self._moments[fname] = RunningMoments()
+                self._rows[fname] = 0
+            self._moments[fname].update(rows[:, self._cols], rows[:, 0])
+            self._rows[fname] += len(rows)
+            n_new += len(rows)
+        if n_new and len(self._moments) > 1:
+            self.history.append((self.n_rows, self.R_minus_one))
+        return n_new
+
+    def _read_new_rows(self, fname):
+        """Read the complete rows written after the stored offset (a trailing partial line is left for the next update)"""
+        offset = self._offsets.get(fname, 0)
+        if os.path.getsize(fname) < offset:  # the chain was restarted
+            offset = 0
+            self._moments.pop(fname, None)
+        with open(fname, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+        end = data.rfind(b'\n') + 1
+        self._offsets[fname] = offset + end
+        lines = data[:end].decode().splitlines()
+        if self._cols is None:
+            self._set_columns(lines)
+            if self._cols is None:
+                return None
+        rows = [line for line in lines if line.strip() and not line.lstrip().startswith('#')]
+        return np.loadtxt(rows, ndmin=2) if rows else None
+
+    def _set_columns(self, lines):
+        """Column names from the header (or `names`) and indices of the monitored parameters"""
+        if self.names is None:
+            header = [line for line in lines if line.lstrip().startswith('#')]
+            if header:
+                self.names = header[0].lstrip('#').split()
+            else:
+                first = next((line for line in lines if line.strip()), None)
+                if first is None:
+                    return
+                self.names = ['weight', 'minuslogpost'] + [f'p{i}' for i in range(len(first.split()) - 2)]
+        self.params = self.names[2:] if self.params is None else self.params
+        self._cols = [self.names.index(p) for p in self.params]
+
+    @property
+    def n_rows(self) -> int:
+        """Total number of rows (accepted steps) read so far"""
+        return sum(self._rows.values())
+
+    @property
+    def acceptance(self) -> np.ndarray:
+        """Acceptance rate of each chain, i.e. the number of accepted steps over the total weight"""
+        return np.array([self._rows[f] / m.weight for f, m in self._moments.items()])
+
+    @property
+    def means(self) -> np.ndarray:
+        """Weighted mean of the parameters, over all chains"""
+        weights = np.array([m.weight for m in self._moments.values()])
+        return np.einsum('c,cp->p', weights, np.array([m.mean for m in self._moments.values()])) / weights.sum()
+
+    @property
+    def cov(self) -> np.ndarray:
+        """Weighted covariance of the parameters, over all chains"""
+        weights = np.array([m.weight for m in self._moments.values()])
+        means = np.array([m.mean for m in self._moments.values()])
+        M2 = sum(m.M2 for m in self._moments.values())
+        dm = means - self.means
+        return (M2 + np.einsum('c,cp,cq->pq', weights, dm, dm)) / weights.sum()
+
+    @property
+    def R_minus_one(self) -> np.ndarray:
+        """Gelman-Rubin R-1 of each parameter: variance of the chain means over the mean of the chain variances"""
+        means = np.array([m.mean for m in self._moments.values()])
+        variances = np.array([m.var for m in self._moments.values()])
+        return r_minus_one(means, variances)
+
+    @property
+    def R_minus_one_max(self) -> float:
+        """Largest R-1 over all the directions in parameter space, as monitored by Cobaya (largest eigenvalue of W^{-1} B)"""
+        means = np.array([m.mean for m in self._moments.values()])
+        W = np.mean([m.cov for m in self._moments.values()], axis=0)
+        B = np.atleast_2d(np.cov(means.T))
+        L = np.linalg.cholesky(W)
+        Linv = np.linalg.inv(L)
+        return np.max(np.linalg.eigvalsh(Linv @ B @ Linv.T))
+
+    def summary(self) -> str:
+        """A short summary of the chains status"""
+        lines = [f'{self.root}: {len(self._moments)} chains, {self.n_rows} accepted steps, '
+                 f'acceptance {np.round(self.acceptance, 3).tolist()}']
+        if len(self._moments) > 1:
+            lines.append(f'R-1 (max over directions) = {self.R_minus_one_max:.4f}')
+            lines += [f'  {p}: mean = {m:.5g}, R-1 = {r:.4f}' for p, m, r in zip(self.params, self.means, self.R_minus_one)]
+        return '\n'.join(lines)
+
+    def plot_convergence(self, ax=None, params: Optional[list[str]] = None):
+        """
+        Plot the evolution of R-1 with the number of accepted steps, for the recorded updates.
+
+        Args:
+            ax (optional): a matplotlib axes instance. Defaults to None.
+            params (list[str], optional): parameters to plot. Defaults to None (all monitored parameters).
+        """
+        if ax is None:
+            import matplotlib.pyplot as plt
+            _, ax = plt.subplots()
+        steps = [h[0] for h in self.history]
+        R = np.array([h[1] for h in self.history])
+        for p in (self.params if params is None else params):
+            ax.plot(steps, R[:, self.params.index(p)], label=p)
+        ax.set_xlabel('accepted steps')
+        ax.set_ylabel('$R-1$')
+        ax.set_yscale('log')
+        return ax
+
+def follow(roots: list[str], **kwargs) -> dict:
+    """
+    Create a `ChainFollower` for each of a set of running jobs.
+
+    Args:
+        roots (list[str]): root names of the chains.
+        **kwargs: passed to `ChainFollower`.
+
+    Returns:
+        dict: the followers, with the roots as keys. Call `update` on each of them to refresh.
+    """
+    return {root: ChainFollower(root, **kwargs) for root in roots}
@@ -1,19 +1,27 @@
 import numpy as np
+from typing import Iterator, Optional, Union
+from ..stats.quantiles import streaming_percentile
 
-def plot_fill_between(x : np.ndarray, samples_y: np.ndarray, label: str = None,
-                      ax = None, color: str = 'gray', lw: float = 2., alpha:float = 0.5, quantiles:list=[2.3, 16, 50, 84, 97.7]):
+def plot_fill_between(x : np.ndarray, samples_y: Union[np.ndarray, Iterator], label: str = None,
+                      ax = None, color: str = 'gray', lw: float = 2., alpha:float = 0.5, quantiles:list=[2.3, 16, 50, 84, 97.7],
+                      weights: Optional[np.ndarray] = None, compression: int = 2000):
     """
-    Plot median and quantiles for a given (flatten) array of samples
+    Plot median and quantiles for a given (flatten) array of samples, or for samples streamed in blocks
+    (an iterator, e.g. a generator yielding chunks of samples), in which case the quantiles are computed with bounded memory
+    and an accuracy set by `compression` (see `stats.quantiles.StreamingQuantiles`).
 
     Args:
         x (np.ndarray): an array with x-values as a numpy array.
-        samples_y (np.ndarray): a numpy array with samples for the quantity f=y(x).
+        samples_y (np.ndarray | Iterator): an array-like (e.g. a numpy or jax array, or a list of samples) with samples
+            for the quantity f=y(x), or an iterator over such arrays (or over tuples (samples_y, weights) for weighted samples).
         label (str, optional): labels to use in the legend. Defaults to None.
         ax (_type_, optional): a matplotlib axes instance. If None, will create a single plot with default settings. Defaults to None.
         color (str, optional): color for the contours. Defaults to 'gray'.
         lw (float, optional): length-width for the lines. Defaults to 2..
         alpha (float, optional): transparency of the contour colors. Defaults to 0.5.
         quantiles (list, optional): quantiles of the distribution to plot. Defaults to [2.3, 16, 50, 84, 97.7].
+        weights (np.ndarray, optional): weights of the samples, if samples_y is an array. Defaults to None.
+        compression (int, optional): the t-digest compression for the streamed or weighted quantiles. Defaults to 2000.
     """
     if ax is None:
         try: 
@@ -22,7 +30,12 @@ def plot_fill_between(x : np.ndarray, samples_y: np.ndarray, label: str = None,
             print('Cannot import matplotlib. Try installing matplotlib before!')
         fig,ax=plt.subplots()
         
-    qs = np.percentile(samples_y, q=quantiles, axis=0)
+    if isinstance(samples_y, Iterator):
+        qs = streaming_percentile(samples_y, quantiles, compression)
+    elif weights is None:
+        qs = np.percentile(np.asarray(samples_y), q=quantiles, axis=0)
+    else:
+        qs = streaming_percentile([(np.asarray(samples_y), weights)], quantiles, compression)
     idx = len(qs) // 2
     median = qs[idx]
     for i in range(1, idx + 1):
@@ -1,62 +1,250 @@
-from typing import Dict, Type
+import copy
+from functools import partial
+from typing import Dict, Optional, Sequence, Tuple, Type
+import jax
+from jax import jit
 import jax.numpy as jnp
 import jax.random as jra
+from jax.scipy.optimize import minimize
+from jax.scipy.special import erfc
 import numpyro.distributions as dist
 
-from .gpjax import GaussianProcessJax
+from .gpjax import GaussianProcessJax, gp_marginal, gp_predict_marginal, _chunks
 
 def ExpectedImprovement(rng_key: jnp.ndarray, model: Type[GaussianProcessJax],
        X: jnp.ndarray, xi: float = 0.01,
-       maximize: bool = False, n: int = 1) -> jnp.ndarray:
+       maximize: bool = False) -> jnp.ndarray:
     """
-    Expected Improvement
+    Expected Improvement over the best training point, computed analytically
+    from the predictive mean/variance and averaged over the GP hyperparameter samples
     """
-    y_mean, y_sampled = model.predict(rng_key, X, n=n)
-    if n > 1:
-        y_sampled = y_sampled.reshape(n * y_sampled.shape[0], -1)
-    mean, sigma = y_sampled.mean(0), y_sampled.std(0)
-    u = (mean - y_mean.max() - xi) / sigma
-    u = -u if not maximize else u
-    normal = dist.Normal(jnp.zeros_like(u), jnp.ones_like(u))
-    ucdf = normal.cdf(u)
-    updf = jnp.exp(normal.log_prob(u))
-    return sigma * (updf + u * ucdf) 
+    mean, var = model.predict_marginal(X)
+    return _expected_improvement(mean, var, _best(model, maximize), xi=xi, maximize=maximize)
 
 
 def UpperConfidenceBound(rng_key: jnp.ndarray, model: Type[GaussianProcessJax],
         X: jnp.ndarray, beta: float = .25,
-        maximize: bool = False, n: int = 1) -> jnp.ndarray:
+        maximize: bool = False) -> jnp.ndarray:
     """
-    Upper confidence bound
+    Upper confidence bound, averaged over the GP hyperparameter samples
     """
-    _, y_sampled = model.predict(rng_key, X, n=n)
-    if n > 1:
-        y_sampled = y_sampled.reshape(n * y_sampled.shape[0], -1)
-    mean, var= y_sampled.mean(0), y_sampled.var(0)
-    delta = jnp.sqrt(beta * var)
-    if maximize:
-        return mean + delta
-    return mean - delta 
+    mean, var = model.predict_marginal(X)
+    return _confidence_bound(mean, var, beta=beta, maximize=maximize)
 
 
 def UncertaintyExploration(rng_key: jnp.ndarray,
        model: Type[GaussianProcessJax],
-       X: jnp.ndarray, n: int = 1) -> jnp.ndarray:
-    """Uncertainty-based exploration (aka kriging)"""
-    _, y_sampled = model.predict(rng_key, X, n=n)
-    return y_sampled.var(0)
+       X: jnp.ndarray) -> jnp.ndarray:
+    """Uncertainty-based exploration (aka kriging): total predictive variance, marginalized over the GP hyperparameter samples"""
+    mean, var = model.predict_marginal(X)
+    return _total_variance(mean, var)
 
 
 def ThompsonSampling(rng_key: jnp.ndarray,
              model: Type[GaussianProcessJax],
-             posterior_samples: Dict[str, jnp.ndarray],
-             X: jnp.ndarray, n: int = 1) -> jnp.ndarray:
-    """Thompson sampling"""
-    posterior_samples = model.get_samples()
-    idx = jra.randint(rng_key, (1,), 0, len(posterior_samples["k_length"]))
+             posterior_samples: Optional[Dict[str, jnp.ndarray]] = None,
+             X: Optional[jnp.ndarray] = None, n: int = 1) -> jnp.ndarray:
+    """Thompson sampling (from the posterior samples of the fitted model if posterior_samples is None)"""
+    if X is None:
+        raise ValueError('ThompsonSampling needs the points X where to sample the GP')
+    if posterior_samples is None:
+        posterior_samples = model.get_state().samples
+    idx = jra.randint(rng_key, (1,), 0, len(posterior_samples["ell_f"]))
     samples = {k: v[idx] for (k, v) in posterior_samples.items()}
     _, tsample = model.predict(rng_key, X, samples, n)
     if n > 1:
         tsample = tsample.mean(1)
     return tsample.squeeze()
-     
+
+
+def optimize_acquisition(rng_key: jnp.ndarray, model: Type[GaussianProcessJax],
+        bounds: Sequence[Tuple[float, float]], acquisition: str = 'EI', q: int = 1,
+        strategy: str = 'kriging_believer', maximize: bool = False,
+        num_candidates: int = 10000, num_restarts: int = 20, maxiter: int = 100,
+        chunk_size: int = 2048, min_distance: float = 1e-3, **acq_kwargs) -> jnp.ndarray:
+    """
+    Find the next q points where to evaluate the (expensive) target function, e.g. to run them in parallel.
+    Each point is found by evaluating the acquisition function on `num_candidates` random points, and refining
+    the `num_restarts` best ones with BFGS (jitted, and vectorized over the starting points) inside the prior box.
+    The q points of a batch are selected sequentially, either conditioning the GP on the previous points with
+    their predictive mean as a fake observation ('kriging_believer'), or down-weighting the acquisition function
+    around them, using a Lipschitz estimate of the GP mean ('local_penalization', González et al. 2016).
+    A point closer than `min_distance` to one already selected is never proposed again in the same batch.
+
+    Args:
+        rng_key (jnp.ndarray): a jax random key.
+        model (GaussianProcessJax): a fitted GP.
+        bounds (Sequence[Tuple[float, float]]): the lower and upper bounds of each input dimension.
+        acquisition (str, optional): 'EI', 'UCB' or 'UE' (see `ExpectedImprovement`, `UpperConfidenceBound`
+            and `UncertaintyExploration`). Defaults to 'EI'.
+        q (int, optional): the number of points per batch. Defaults to 1.
+        strategy (str, optional): 'kriging_believer' or 'local_penalization'. Defaults to 'kriging_believer'.
+        maximize (bool, optional): whether the target function is maximized or minimized. Defaults to False.
+        num_candidates (int, optional): the number of random candidates used to pick the starting points. Defaults to 10000.
+        num_restarts (int, optional): the number of starting points refined with BFGS. Defaults to 20.
+        maxiter (int, optional): the maximum number of BFGS iterations. Defaults to 100.
+        chunk_size (int, optional): the number of candidates evaluated at once. Defaults to 2048.
+        min_distance (float, optional): the minimum distance between the points of a batch, in units of the prior box. Defaults to 1e-3.
+        **acq_kwargs: parameters of the acquisition function, i.e. xi for 'EI' and beta for 'UCB'.
+
+    Returns:
+        jnp.ndarray: the proposed points, with shape (q, input_dim).
+    """
+    if acquisition not in _ACQUISITIONS:
+        raise ValueError(f'Unknown acquisition function {acquisition}, choose among {list(_ACQUISITIONS)}')
+    if strategy not in ('kriging_believer', 'local_penalization'):
+        raise ValueError(f'Unknown batch strategy {strategy}')
+
+    bounds = jnp.asarray(bounds, dtype=float).reshape(-1, 2)
+    lower, width = bounds[:, 0], bounds[:, 1] - bounds[:, 0]
+    U = jra.uniform(rng_key, (num_candidates, bounds.shape[0]))
+
+    state = model.get_state()
+    y_best = _best(model, maximize)
+    believer = strategy == 'kriging_believer' and q > 1
+    if believer and model.solver is None:
+        # the fake observations replace the padded points of a training set with room for q - 1 more points,
+        # so that the objective and the optimizer compile only once for the whole batch
+        state, y_residual = model.get_padded_state(q - 1)
+    elif believer:
+        # the matrix-free solver has no padded training sets: the fake observations extend the training set of a copy of the model
+        fantasy = copy.copy(model)
+        fantasy._cache = dict(model._cache)
+    # the penalization terms of the points already selected, padded to q points so that the objective compiles only once
+    penalty = dict(U=jnp.zeros((q, bounds.shape[0])), mean=jnp.zeros(q), sigma=jnp.ones(q), mask=jnp.zeros(q),
+                   lipschitz=jnp.array(1.0), y_best=_best(model, maximize))
+    if strategy == 'local_penalization' and q > 1:
+        penalty['lipschitz'] = _lipschitz(model, U[:chunk_size], lower, width)
+
+    static = dict(kernel=model.kernel, mean_fn=model.mean_fn, solver=model.solver, acquisition=acquisition,
+                  maximize=maximize, penalized=strategy == 'local_penalization')
+    U_next = []
+    for i in range(q):
+        scores = jnp.concatenate([_objective(state=state, U=U_chunk, lower=lower, width=width, y_best=y_best,
+                                             penalty=penalty, acq_kwargs=acq_kwargs, **static)[:n_valid]
+                                  for U_chunk, n_valid in _chunks(U, chunk_size)])
+        scores = jnp.where(jnp.isfinite(scores), scores, -jnp.inf)
+        if U_next:
+            scores = jnp.where(_too_close(U, U_next, min_distance), -jnp.inf, scores)
+        best = jnp.argsort(-scores)[:num_restarts]
+        starts = U[best]
+        # BFGS works on the objective relative to the best candidate (e.g. EI values can be ~1e-6, far below its gtol)
+        scale = jnp.maximum(jnp.max(jnp.abs(scores[best][jnp.isfinite(scores[best])]), initial=0.), 1e-300)
+        U_opt, values = _multistart(state=state, starts=starts, lower=lower, width=width, y_best=y_best,
+                                    penalty=penalty, acq_kwargs=acq_kwargs, scale=scale, maxiter=maxiter, **static)
+        # BFGS may fail (NaNs), stop on a worse point than the candidates, or end up next to a point of the batch
+        values = jnp.where(jnp.isfinite(values), values, -jnp.inf)
+        if U_next:
+            values = jnp.where(_too_close(U_opt, U_next, min_distance), -jnp.inf, values)
+        U_opt = jnp.concatenate([U_opt, starts[:1]])
+        values = jnp.concatenate([values, scores[best[:1]]])
+        u = U_opt[jnp.argmax(values)]
+        U_next.append(u)
+        if i == q - 1:
+            break
+
+        x = (lower + width * u)[None]
+        mean, var = gp_predict_marginal(model.kernel, model.mean_fn, state, x, model.solver)
+        if strategy == 'kriging_believer':
+            # the fake observations of the kriging believer can improve on the best training point
+            y_fake = mean.mean(0)
+            y_best = jnp.maximum(y_best, y_fake[0]) if maximize else jnp.minimum(y_best, y_fake[0])
+            if model.solver is None:
+                state, y_residual = model.set_padded_point(state, y_residual, x, y_fake)
+            else:
+                fantasy.add_data(x, y_fake)
+                state = fantasy.get_state()
+        else:
+            penalty['U'] = penalty['U'].at[i].set(u)
+            penalty['mean'] = penalty['mean'].at[i].set(mean.mean())
+            penalty['sigma'] = penalty['sigma'].at[i].set(jnp.sqrt(_total_variance(mean, var)[0]))
+            penalty['mask'] = penalty['mask'].at[i].set(1.0)
+
+    return lower + width * jnp.stack(U_next)
+
+
+def _too_close(U, U_selected, min_distance):
+    """Whether each of the points U is within min_distance of one of the points already selected"""
+    distance = jnp.linalg.norm(U[:, None, :] - jnp.stack(U_selected)[None], axis=-1)
+    return jnp.any(distance < min_distance, axis=-1)
+
+def _best(model, maximize):
+    """Best observed value of the training set"""
+    return model.y_train.max() if maximize else model.y_train.min()
+
+def _expected_improvement(mean, var, y_best, xi=0.01, maximize=False):
+    """Expected improvement from predictive means and variances of shape (num_samples, m)"""
+    sigma = jnp.sqrt(var)
+    # improvement over y_best by more than xi, upwards if maximizing and downwards otherwise
+    u = (mean - y_best - xi) / sigma if maximize else (y_best - mean - xi) / sigma
+    normal = dist.Normal(jnp.zeros_like(u), jnp.ones_like(u))
+    ucdf = normal.cdf(u)
+    updf = jnp.exp(normal.log_prob(u))
+    return (sigma * (updf + u * ucdf)).mean(0)
+
+def _confidence_bound(mean, var, beta=.25, maximize=False):
+    """Upper (lower if minimizing) confidence bound from predictive means and variances of shape (num_samples, m)"""
+    delta = jnp.sqrt(beta * var)
+    if maximize:
+        return (mean + delta).mean(0)
+    return (mean - delta).mean(0)
+
+def _total_variance(mean, var):
+    """Predictive variance marginalized over the hyperparameter samples"""
+    return var.mean(0) + mean.var(0)
+
+_ACQUISITIONS = {
+    'EI': lambda mean, var, y_best, maximize, **kwargs: _expected_improvement(mean, var, y_best, maximize=maximize, **kwargs),
+    # the lower confidence bound is minimized
+    'UCB': lambda mean, var, y_best, maximize, **kwargs: (1 if maximize else -1) * _confidence_bound(mean, var, maximize=maximize, **kwargs),
+    'UE': lambda mean, var, y_best, maximize: _total_variance(mean, var),
+}
+
+@partial(jit, static_argnames=('kernel', 'mean_fn', 'solver', 'acquisition', 'maximize', 'penalized'))
+def _objective(kernel, mean_fn, state, U, lower, width, y_best, penalty, acq_kwargs,
+               solver=None, acquisition='EI', maximize=False, penalized=False):
+    """
+    Acquisition function (to be maximized) at the points U of the unit hypercube.
+    With local penalization, the log of the (softplus-transformed) acquisition function plus the log-penalties
+    of the points already selected.
+    """
+    X = lower + width * U
+    marginal = lambda params, factors: gp_marginal(kernel, mean_fn, state.X_train, state.X_inducing, X, params, factors,
+                                                   solver, state.mask)
+    mean, var = jax.vmap(marginal)(state.samples, state.factors)
+    score = _ACQUISITIONS[acquisition](mean, var, y_best, maximize, **acq_kwargs)
+    if not penalized:
+        return score
+
+    sign = 1.0 if maximize else -1.0
+    distance = jnp.sqrt(jnp.sum((U[:, None, :] - penalty['U'][None])**2, -1) + 1e-12)
+    z = (penalty['lipschitz'] * distance - sign * penalty['y_best'] + sign * penalty['mean']) / (jnp.sqrt(2) * penalty['sigma'])
+    log_phi = jnp.log(0.5 * erfc(-z) + 1e-300)
+    return jnp.log(jax.nn.softplus(score) + 1e-300) + jnp.sum(penalty['mask'] * log_phi, -1)
+
+@partial(jit, static_argnames=('kernel', 'mean_fn', 'solver', 'acquisition', 'maximize', 'penalized', 'maxiter'))
+def _multistart(kernel, mean_fn, state, starts, lower, width, y_best, penalty, acq_kwargs, scale=1.0,
+                solver=None, acquisition='EI', maximize=False, penalized=False, maxiter=100):
+    """Maximize the objective (divided by scale, so that it is of order unity) with BFGS from each of the starting points,
+    within the unit hypercube"""
+    def loss(v):
+        return -_objective(kernel, mean_fn, state, jax.nn.sigmoid(v)[None], lower, width, y_best, penalty, acq_kwargs,
+                           solver, acquisition, maximize, penalized)[0] / scale
+
+    @jax.vmap
+    def run(u0):
+        v0 = jnp.log(u0) - jnp.log1p(-u0)
+        result = minimize(loss, v0, method='BFGS', options={'maxiter': maxiter})
+        return jax.nn.sigmoid(result.x), -result.fun * scale
+
+    return run(jnp.clip(starts, 1e-6, 1 - 1e-6))
+
+def _lipschitz(model, U, lower, width):
+    """Estimate of the Lipschitz constant of the GP mean (in the unit hypercube) from its largest gradient on a set of points"""
+    state = model.get_state()
+    def mean(u):
+        marginal = lambda params, factors: gp_marginal(model.kernel, model.mean_fn, state.X_train, state.X_inducing,
+                                                       (lower + width * u)[None], params, factors, model.solver)
+        return jax.vmap(marginal)(state.samples, state.factors)[0].mean()
+    grads = jax.jit(jax.vmap(jax.grad(mean)))(U)
+    return jnp.maximum(jnp.max(jnp.linalg.norm(grads, axis=-1)), 1e-7)
@@ -0,0 +1,158 @@
+from typing import Optional, Sequence
+import numpy as np
+from scipy.fft import next_fast_len
+from scipy.special import ndtri
+from .moments import RunningMoments
+
+def gelman_rubin(chains: Sequence[np.ndarray], weights: Optional[Sequence[np.ndarray]] = None,
+                 chunk_size: int = 100000) -> np.ndarray:
+    """
+    Gelman-Rubin R-1 statistics of all the parameters at once, i.e. the variance of the chain means
+    over the mean of the chain variances (as monitored by Cobaya and getdist).
+    The weighted moments of each chain are accumulated chunk by chunk (see `RunningMoments`),
+    so that the chains can be memory-mapped arrays (e.g. from `analysis.cache.load_columns`).
+
+    Args:
+        chains (Sequence[np.ndarray]): the chains, with shape (n_i, n_params).
+        weights (Sequence[np.ndarray], optional): the weights of the samples of each chain. Defaults to None.
+        chunk_size (int, optional): number of rows per chunk. Defaults to 100000.
+
+    Returns:
+        np.ndarray: R-1 for each parameter.
+
+    Raises:
+        ValueError: if there are less than 2 chains.
+    """
+    weights = [None] * len(chains) if weights is None else weights
+    means, variances = [], []
+    for chain, w in zip(chains, weights):
+        acc = RunningMoments(covariance=False)
+        for start in range(0, len(chain), chunk_size):
+            acc.update(chain[start:start + chunk_size], None if w is None else w[start:start + chunk_size])
+        means.append(acc.mean)
+        variances.append(acc.var)
+    return r_minus_one(np.array(means), np.array(variances))
+
+def r_minus_one(means: np.ndarray, variances: np.ndarray) -> np.ndarray:
+    """R-1 from the means and variances of each chain, with shape (n_chains, n_params)"""
+    if len(means) < 2:
+        raise ValueError(f'The Gelman-Rubin R-1 needs at least 2 chains, got {len(means)}')
+    return means.var(0, ddof=1) / variances.mean(0)
+
+def split_rhat(chains: Sequence[np.ndarray], weights: Optional[Sequence[np.ndarray]] = None,
+               rank_normalize: bool = True) -> np.ndarray:
+    """
+    Split R-hat of all the parameters at once, as in Vehtari et al. (2021): each chain is split in two halves and,
+    if rank_normalize, the statistic is the largest of the bulk (rank-normalized draws) and tail
+    (rank-normalized folded draws) R-hat.
+
+    Args:
+        chains (Sequence[np.ndarray]): the chains, with shape (n_i, n_params).
+        weights (Sequence[np.ndarray], optional): integer weights (multiplicities) of the samples of each chain. Defaults to None.
+        rank_normalize (bool, optional): use the rank-normalized split R-hat. Defaults to True.
+
+    Returns:
+        np.ndarray: R-hat for each parameter.
+    """
+    draws = _split(_draws(chains, weights))
+    if not rank_normalize:
+        return _rhat(draws)
+    folded = np.abs(draws - np.median(draws, axis=(0, 1)))
+    return np.maximum(_rhat(_z_scale(draws)), _rhat(_z_scale(folded)))
+
+def ess(chains: Sequence[np.ndarray], weights: Optional[Sequence[np.ndarray]] = None, method: str = 'bulk') -> np.ndarray:
+    """
+    Effective sample size of all the parameters at once, from the autocorrelations of the split chains
+    (computed with FFTs) truncated with Geyer's initial monotone sequence, as in Vehtari et al. (2021).
+
+    Args:
+        chains (Sequence[np.ndarray]): the chains, with shape (n_i, n_params).
+        weights (Sequence[np.ndarray], optional): integer weights (multiplicities) of the samples of each chain. Defaults to None.
+        method (str, optional): 'bulk' (rank-normalized draws), 'tail' (smallest ESS of the 5% and 95% quantiles)
+            or 'mean' (the draws themselves). Defaults to 'bulk'.
+
+    Returns:
+        np.ndarray: ESS for each parameter.
+    """
+    draws = _split(_draws(chains, weights))
+    if method == 'bulk':
+        return _ess(_z_scale(draws))
+    elif method == 'tail':
+        q05, q95 = np.quantile(draws, [0.05, 0.95], axis=(0, 1))
+        return np.minimum(_ess((draws <= q05).astype(float)), _ess((draws <= q95).astype(float)))
+    elif method == 'mean':
+        return _ess(draws)
+    raise ValueError(f'Unknown method {method}, choose between bulk, tail and mean')
+
+def _draws(chains, weights=None):
+    """Stack the chains into an array of shape (n_chains, n_draws, n_params), repeating the rows with integer weights
+    and truncating the chains to the shortest one"""
+    if weights is not None:
+        chains = [np.repeat(chain, _multiplicities(w), axis=0) for chain, w in zip(chains, weights)]
+    n = min(len(chain) for chain in chains)
+    return np.stack([np.asarray(chain[:n], dtype=float) for chain in chains])
+
+def _multiplicities(w):
+    counts = np.rint(w).astype(int)
+    if not np.allclose(w, counts):
+        raise ValueError('Rank-based diagnostics need integer weights (multiplicities of the samples)')
+    return counts
+
+def _split(draws):
+    """Split each chain in two halves"""
+    half = draws.shape[1] // 2
+    return np.concatenate([draws[:, :half], draws[:, -half:]])
+
+def _z_scale(draws):
+    """Normal scores of the ranks of the pooled draws"""
+    n = draws.shape[0] * draws.shape[1]
+    ranks = _ranks(draws.reshape(n, -1).T).T.reshape(draws.shape)
+    return ndtri((ranks - 0.375) / (n + 0.25))
+
+def _ranks(x):
+    """Ranks along the last axis, averaged over ties (as scipy.stats.rankdata), from a single argsort"""
+    x = np.ascontiguousarray(x)
+    n = x.shape[-1]
+    order = np.argsort(x, axis=-1)
+    s = np.take_along_axis(x, order, -1)
+    i = np.arange(n)
+    # first and last positions of each group of ties in the sorted values
+    new = np.ones(x.shape, dtype=bool)
+    new[..., 1:] = s[..., 1:] != s[..., :-1]
+    last = np.ones(x.shape, dtype=bool)
+    last[..., :-1] = new[..., 1:]
+    start = np.maximum.accumulate(np.where(new, i, 0), axis=-1)
+    end = np.minimum.accumulate(np.where(last, i, n - 1)[..., ::-1], axis=-1)[..., ::-1]
+    ranks = np.empty(x.shape)
+    np.put_along_axis(ranks, order, (start + end) / 2 + 1, -1)
+    return ranks
+
+def _rhat(draws):
+    n = draws.shape[1]
+    B = n * draws.mean(1).var(0, ddof=1)
+    W = draws.var(1, ddof=1).mean(0)
+    return np.sqrt(((n - 1) / n * W + B / n) / W)
+
+def _autocovariance(draws):
+    """Autocovariance of each chain along the draws, through FFTs"""
+    n = draws.shape[1]
+    # FFTs along the contiguous (last) axis, zero-padded to avoid circular correlations
+    x = np.ascontiguousarray(np.moveaxis(draws - draws.mean(1, keepdims=True), 1, -1))
+    size = next_fast_len(2 * n, real=True)
+    fft = np.fft.rfft(x, n=size, axis=-1)
+    acov = np.fft.irfft(fft.real**2 + fft.imag**2, n=size, axis=-1)[..., :n] / n
+    return np.moveaxis(acov, -1, 1)
+
+def _ess(draws):
+    m, n = draws.shape[:2]
+    acov = _autocovariance(draws)
+    mean_var = acov[:, 0].mean(0) * n / (n - 1)
+    var_plus = mean_var * (n - 1) / n + draws.mean(1).var(0, ddof=1)
+    rho = 1. - (mean_var - acov.mean(0)) / var_plus
+    rho[0] = 1.
+    # Geyer's initial monotone sequence: sums of pairs of autocorrelations, up to the first non-positive one
+    pairs = rho[:2 * (n // 2)].reshape(n // 2, 2, -1).sum(1)
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    pairs = np.minimum.accumulate(np.where(positive, pairs, 0.), axis=0)
+    tau = np.maximum(-1. + 2. * pairs.sum(0), 1. / np.log10(m * n))
+    return m * n / tau
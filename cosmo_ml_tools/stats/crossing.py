@@ -1,6 +1,9 @@
+from typing import Callable, Optional
 import numpy as np
-from numpy.polynomial.chebyshev import Chebyshev
+from numpy.polynomial.chebyshev import Chebyshev, chebvander
 from tqdm import tqdm
+import jax
+import jax.numpy as jnp
 
 def get_Chebyshev_T(x:float|np.ndarray,Ci:list|np.ndarray):
     r"""
@@ -16,6 +19,67 @@ def get_Chebyshev_T(x:float|np.ndarray,Ci:list|np.ndarray):
     cheb = Chebyshev(Ci,domain=(x[0],x[-1]))
     return cheb
 
+def get_Chebyshev_basis(x:np.ndarray,order:int) -> np.ndarray:
+    r"""
+    Get the Chebyshev basis matrix $T_i(x)$, i.e. the polynomials of `get_Chebyshev_T` (with the same domain) for unit coefficients.
+
+    Args:
+        x (np.ndarray): an array of values where to compute
+        order (int): number of Chebyshev polynomials
+
+    Returns:
+        np.ndarray: an array of shape (order, len(x)), such that `get_Chebyshev_T(x,Ci)(x) = Ci @ T`
+    """
+    x = np.asarray(x)
+    u = (2*x - (x[0] + x[-1]))/(x[-1] - x[0])
+    return chebvander(u,order-1).T
+
+def _stream(fn:Callable,samples:np.ndarray,n_out:int,chunk_size:Optional[int]=None,out:Optional[np.ndarray]=None,
+            backend:str='numpy',progress:bool=False) -> np.ndarray:
+    """Apply a batched function to chunks of samples, writing the results into a (preallocated or memory-mapped) output array.
+    With the jax backend, the function is jitted and runs in double precision, as the numpy backend."""
+    if backend not in ('numpy','jax'):
+        raise ValueError(f'Unknown backend {backend}, choose between numpy and jax')
+    n = samples.shape[0]
+    chunk_size = n if chunk_size is None else chunk_size
+    if out is None:
+        out = np.empty((n,n_out))
+    if backend == 'numpy':
+        for start in tqdm(range(0,n,chunk_size),disable=not progress):
+            out[start:start+chunk_size] = fn(samples[start:start+chunk_size])
+        return out
+    with _enable_x64():
+        fn = jax.jit(fn)
+        for start in tqdm(range(0,n,chunk_size),disable=not progress):
+            out[start:start+chunk_size] = fn(jnp.asarray(samples[start:start+chunk_size],dtype=jnp.float64))
+    return out
+
+def _enable_x64():
+    """Context manager enabling double precision in jax (jax.enable_x64 in recent versions, jax.experimental.enable_x64 before)"""
+    if hasattr(jax,'enable_x64'):
+        return jax.enable_x64(True)
+    from jax.experimental import enable_x64
+    return enable_x64()
+
+def eval_Chebyshev(x:np.ndarray,samples:np.ndarray,chunk_size:Optional[int]=None,out:Optional[np.ndarray]=None,
+                   backend:str='numpy',progress:bool=False) -> np.ndarray:
+    r"""
+    Evaluate the Chebyshev expansions of many samples of coefficients at once, as a single matrix product `samples @ T(x)`.
+
+    Args:
+        x (np.ndarray): an array of values where to compute
+        samples (np.ndarray): an array of shape (n_samples, order) with Chebyshev coefficients
+        chunk_size (int, optional): number of samples evaluated at once, to limit the memory usage. Defaults to None (all samples at once).
+        out (np.ndarray, optional): a (possibly memory-mapped) array of shape (n_samples, len(x)) where to write the results. Defaults to None.
+        backend (str, optional): 'numpy' or 'jax' (jitted, in double precision). Defaults to 'numpy'.
+        progress (bool, optional): show a progress bar over the chunks. Defaults to False.
+
+    Returns:
+        np.ndarray: an array of shape (n_samples, len(x))
+    """
+    T = get_Chebyshev_basis(x,samples.shape[1])
+    return _stream(lambda Ci: Ci @ T,samples,len(x),chunk_size,out,backend,progress)
+
 def analytical_fde_from_w(z,C0=1,C1=0,C2=0,C3=0,C4=0,C5=0,C6=0):
     r"""Compute the integral $f_\mathrm{DE}=\exp[\int 3(1+w) d\ln(1+z)]$ for a Chebyshev expansion of w(z) up to order 7 (C6)
 
@@ -32,26 +96,71 @@ def analytical_fde_from_w(z,C0=1,C1=0,C2=0,C3=0,C4=0,C5=0,C6=0):
     Returns:
         array: corresponding dark energy density evolution $f_\mathrm{DE}(z)$.
     """
+    return np.exp(_log_fde_from_w(z,np.array([[C0,C1,C2,C3,C4,C5,C6]],dtype=float))[0])
+
+def _log_fde_from_w(z:np.ndarray,C:np.ndarray) -> np.ndarray:
+    r"""$\ln f_\mathrm{DE}(z)$ of `analytical_fde_from_w` for an array of coefficients C of shape (n_samples, 7). Note that it is linear in C."""
     zmax=z.max()
-    return (1 + z)**((3*zmax*(-128*C4*zmax + zmax**2*(-256*C4 - 8*(C2 + 20*C4)*zmax + 2*(C1 - 4*(C2 + 4*C4))*zmax**2 - (-1 + C0 - C1 + C2 + C4)*zmax**3 + C3*(2 + zmax)*(16 + zmax*(16 + zmax))) + C5*(2 + zmax)*(256 + zmax*(4 + zmax)*(128 + zmax*(44 + zmax)))) - 3*C6*(8 + zmax*(8 + zmax))*(256 + zmax*(512 + zmax*(320 + zmax*(64 + zmax)))))/zmax**6)/np.exp((2*z*(256*C6*(-60 + z*(30 + z*(-20 + z*(15 + 2*z*(-6 + 5*z))))) + 64*(C5 - 12*C6)*(60 + z*(-30 + z*(20 + 3*z*(-5 + 4*z))))*zmax + 80*(C4 - 10*C5 + 54*C6)*(-12 + z*(6 + z*(-4 + 3*z)))*zmax**2 + 40*(C3 - 8*C4 + 35*C5 - 112*C6)*(6 + z*(-3 + 2*z))*zmax**3 + 30*(C2 - 6*C3 + 20*C4 - 50*C5 + 105*C6)*(-2 + z)*zmax**4 + 15*(C1 - 4*C2 + 9*C3 - 16*C4 + 25*C5 - 36*C6)*zmax**5))/(5.*zmax**6))
+    C0,C1,C2,C3,C4,C5,C6=(C[:,i,None] for i in range(7))
+    exponent=((3*zmax*(-128*C4*zmax + zmax**2*(-256*C4 - 8*(C2 + 20*C4)*zmax + 2*(C1 - 4*(C2 + 4*C4))*zmax**2 - (-1 + C0 - C1 + C2 + C4)*zmax**3 + C3*(2 + zmax)*(16 + zmax*(16 + zmax))) + C5*(2 + zmax)*(256 + zmax*(4 + zmax)*(128 + zmax*(44 + zmax)))) - 3*C6*(8 + zmax*(8 + zmax))*(256 + zmax*(512 + zmax*(320 + zmax*(64 + zmax))))))/zmax**6
+    integral=(2*z*(256*C6*(-60 + z*(30 + z*(-20 + z*(15 + 2*z*(-6 + 5*z))))) + 64*(C5 - 12*C6)*(60 + z*(-30 + z*(20 + 3*z*(-5 + 4*z))))*zmax + 80*(C4 - 10*C5 + 54*C6)*(-12 + z*(6 + z*(-4 + 3*z)))*zmax**2 + 40*(C3 - 8*C4 + 35*C5 - 112*C6)*(6 + z*(-3 + 2*z))*zmax**3 + 30*(C2 - 6*C3 + 20*C4 - 50*C5 + 105*C6)*(-2 + z)*zmax**4 + 15*(C1 - 4*C2 + 9*C3 - 16*C4 + 25*C5 - 36*C6)*zmax**5))/(5.*zmax**6)
+    return np.log1p(z)*exponent - integral
+
+def get_fde_from_w_terms(z:np.ndarray) -> tuple:
+    r"""
+    Precompute the z-dependent terms of `analytical_fde_from_w`, which is of the form $\ln f_\mathrm{DE}(z) = a(z) + \sum_i C_i B_i(z)$.
+
+    Args:
+        z (np.ndarray): redshift array
+
+    Returns:
+        tuple: the arrays a(z), of shape (len(z),), and B(z), of shape (7, len(z))
+    """
+    offset=_log_fde_from_w(z,np.zeros((1,7)))[0]
+    B=_log_fde_from_w(z,np.eye(7)) - offset
+    return offset,B
+
+def fde_from_w(z:np.ndarray,samples:np.ndarray,chunk_size:Optional[int]=None,out:Optional[np.ndarray]=None,
+               backend:str='numpy',progress:bool=False) -> np.ndarray:
+    r"""
+    Batched `analytical_fde_from_w`: the z-dependent terms are computed once, and all the samples of coefficients
+    are applied in a single contraction (per chunk), i.e. $f_\mathrm{DE} = \exp[a(z) + C B(z)]$.
+
+    Args:
+        z (np.ndarray): redshift array
+        samples (np.ndarray): an array of shape (n_samples, order) with the Chebyshev coefficients C0, C1, ... (order <= 7)
+        chunk_size (int, optional): number of samples evaluated at once, to limit the memory usage. Defaults to None (all samples at once).
+        out (np.ndarray, optional): a (possibly memory-mapped) array of shape (n_samples, len(z)) where to write the results. Defaults to None.
+        backend (str, optional): 'numpy' or 'jax' (jitted, in double precision). Defaults to 'numpy'.
+        progress (bool, optional): show a progress bar over the chunks. Defaults to False.
+
+    Returns:
+        np.ndarray: an array of shape (n_samples, len(z)) with the samples of $f_\mathrm{DE}(z)$
+    """
+    offset,B=get_fde_from_w_terms(z)
+    B=B[:samples.shape[1]]
+    xp=jnp if backend == 'jax' else np
+    return _stream(lambda Ci: xp.exp(offset + Ci @ B),samples,len(z),chunk_size,out,backend,progress)
 
-def get_samples_crossing_fde(z:np.ndarray,samples_gd:dict,order:int=4) -> dict:
+def get_samples_crossing_fde(z:np.ndarray,samples_gd:dict,order:int=4,chunk_size:Optional[int]=None,backend:str='numpy') -> dict:
     r"""Get the dark energy evolution $f_\mathrm{DE}(z)$ from MCMC samples of the Chebyshev coefficients
 
     Args:
         z (np.ndarray): array with redshift values
         samples_gd (dict): a dictionary with getdist instances. They keys in the dictionary are used as labels for each chains.
         order (int, optional): The order of the polynomial expansion of $f_\mathrm{DE}(z)=\rho_{\rm DE}()$. Defaults to 4.
+        chunk_size (int, optional): number of samples evaluated at once (see `eval_Chebyshev`). Defaults to None.
+        backend (str, optional): 'numpy' or 'jax' (jitted, in double precision). Defaults to 'numpy'.
 
     Returns:
         dict: a dictionary containing the corresponding samples of fde(z) for each chain.
     """
     coeffs=[f'C{i}' for i in range(order)]
     samples_hyper={label: np.array([samples[c] for c in coeffs]).T for label,samples in samples_gd.items()}
-    crossing_fde={label: np.array([get_Chebyshev_T(z,Ci)(z) for Ci in tqdm(samples)]) for label,samples in samples_hyper.items()}
+    crossing_fde={label: eval_Chebyshev(z,samples,chunk_size,backend=backend) for label,samples in samples_hyper.items()}
     return crossing_fde
 
-def get_samples_crossing_w(z,samples_gd:dict,order:int=4,return_fde:bool=True) -> dict:
+def get_samples_crossing_w(z,samples_gd:dict,order:int=4,return_fde:bool=True,chunk_size:Optional[int]=None,backend:str='numpy') -> dict:
     r"""
     Get the dark energy evolution
 
@@ -67,8 +176,8 @@ def get_samples_crossing_w(z,samples_gd:dict,order:int=4,return_fde:bool=True) -
 
     coeffs=[f'C{i}' for i in range(order)]
     samples_hyper={label: np.array([samples[c] for c in coeffs]).T for label,samples in samples_gd.items()}
-    crossing_w={label: np.array([-get_Chebyshev_T(z,Ci)(z) for Ci in tqdm(samples)]) for label,samples in samples_hyper.items()}
-    crossing_fde={lbl: np.array([analytical_fde_from_w(z,*Ci) for Ci in tqdm(samples)]) for lbl,samples in samples_hyper.items()}
+    crossing_w={label: -eval_Chebyshev(z,samples,chunk_size,backend=backend) for label,samples in samples_hyper.items()}
+    crossing_fde={lbl: fde_from_w(z,samples,chunk_size,backend=backend) for lbl,samples in samples_hyper.items()}
     if return_fde:
         return crossing_w,crossing_fde
     return crossing_w
\ No newline at end of file
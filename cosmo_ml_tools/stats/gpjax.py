@@ -1,8 +1,11 @@
 from functools import partial
+from typing import NamedTuple, Optional
 import jax
 from jax import jit
 import jax.numpy as jnp
 import jax.random as jra
+from jax.scipy.linalg import cho_solve, solve_triangular
+from jax.scipy.optimize import minimize
 
 import numpyro
 import numpyro.distributions as dist
@@ -11,21 +14,53 @@ from numpyro.infer import MCMC, NUTS
 numpyro.enable_x64()
 
 from .base import GaussianProcessBase
+from .kernels import kernel_diag, add_jitter
+from .iterative import CGSolver, iterative_factor, iterative_log_likelihood, iterative_posterior, iterative_marginal
+
+class GPState(NamedTuple):
+    """
+    Explicit state of a fitted GP (a pytree that can be passed to jitted functions): training inputs, 
+    inducing points (None for an exact GP), hyperparameter samples and the corresponding cached factors,
+    and the mask flagging the actual training points of a padded training set (None if not padded, see `get_padded_state`)
+    """
+    X_train: jnp.ndarray
+    X_inducing: Optional[jnp.ndarray]
+    samples: dict
+    factors: tuple
+    mask: Optional[jnp.ndarray] = None
 
 class GaussianProcessJax(GaussianProcessBase):
-    def __init__(self, kernel, input_dim: int, mean_fn=None): 
+    def __init__(self, kernel, input_dim: int, mean_fn=None,
+                 sparse=None, num_inducing: int = 100, X_inducing=None, solver=None): 
         """
         Base Class implementing the usual Gaussian Process Regression algorithm. 
         The GP posterior is sampled using the Hamiltonian Monte Carlo 'No-U Turn' Sampler (NUTS) as implemented in numpyro
         e.g. BaseGP(input_dim=2, kernel=RBFKernel)
+        
+        For large training sets, set `sparse` to 'fitc' or 'vfe' to use an inducing-point approximation,
+        with O(n m^2) cost and O(n m) memory for m inducing points. The inducing points are either given (`X_inducing`)
+        or a random subset of `num_inducing` training points.
+        
+        For large exact GPs, set `solver` to 'cg' (or a `CGSolver` with custom settings) to replace the Cholesky 
+        decompositions by matrix-free conjugate gradients and stochastic Lanczos quadrature, with O(n) memory.
         """
         # clear_cache()
         self.input_dim = input_dim
         self.kernel = kernel
         self.mean_fn = mean_fn
+        self.sparse = sparse
+        self.num_inducing = num_inducing
+        self.X_inducing = X_inducing
+        if solver == 'cg':
+            solver = CGSolver()
+        if solver is not None and sparse is not None:
+            raise ValueError('The iterative solver is only available for exact GPs (sparse=None)')
+        self.solver = solver
         self.X_train = None
         self.y_train = None
         self.mcmc = None
+        self.map_params = None
+        self._cache = None
 
     def model(self, X, y):
         """GP model"""
@@ -35,37 +70,41 @@ class GaussianProcessJax(GaussianProcessBase):
         # Sample kernel parameters and noise
         with numpyro.plate('k_param', self.input_dim):  # allows using ARD kernel for input_dim > 1
             length = numpyro.sample("ell_f", dist.LogNormal(0.0, 1.0))
-            scale = numpyro.sample("sigma_f", dist.LogNormal(0.0, 1.0))
-            noise = numpyro.sample("noise", dist.LogNormal(0.0, 1.0))
+        scale = numpyro.sample("sigma_f", dist.LogNormal(0.0, 1.0))
+        noise = numpyro.sample("noise", dist.LogNormal(0.0, 1.0))
+        params = {"ell_f": length, "sigma_f": scale, "noise": noise}
+    
+        # Add mean function (if any)
+        if self.mean_fn is not None:
+            f_loc += self.mean_fn(X).squeeze()
+        
+        if self.sparse is not None:
+            # inducing-point approximation of the marginal likelihood
+            numpyro.factor("y", sparse_log_likelihood(self.kernel, X, self.X_inducing, y - f_loc, params, self.sparse))
+            return
+        if self.solver is not None:
+            numpyro.factor("y", iterative_log_likelihood(self.kernel, X, y - f_loc, params, self.solver))
+            return
         
-            # Add mean function (if any)
-            if self.mean_fn is not None:
-                f_loc += self.mean_fn(X).squeeze()
-            
-            # compute kernel
-            k = self.kernel(
-                X, X,
-                {"ell_f": length, "sigma_f": scale},
-                noise
-            )
-            # sample y according to the standard Gaussian process formula
-            numpyro.sample(
-                "y",
-                dist.MultivariateNormal(loc=f_loc, covariance_matrix=k),
-                obs=y,
-            )
+        # compute kernel
+        k = self.kernel(X, X, params, noise)
+        # sample y according to the standard Gaussian process formula
+        numpyro.sample(
+            "y",
+            dist.MultivariateNormal(loc=f_loc, covariance_matrix=k),
+            obs=y,
+        )
 
     def run_MCMC(self, rng_key, X, y,
             num_warmup=2000, num_samples=2000, num_chains=1,
-            progress_bar=True, print_summary=True):
+            progress_bar=True, print_summary=True, init_strategy=None):
         """
         Run MCMC to infer the GP model parameters
         """
-        X = X if X.ndim > 1 else X[:, None]
-        self.X_train = X
-        self.y_train = y
+        X, y = self._set_training_data(X, y)
 
-        init_strategy = numpyro.infer.init_to_median(num_samples=10)
+        if init_strategy is None:
+            init_strategy = numpyro.infer.init_to_median(num_samples=10)
         kernel = NUTS(self.model, init_strategy=init_strategy)
         self.mcmc = MCMC(
             kernel,
@@ -78,63 +117,452 @@ class GaussianProcessJax(GaussianProcessBase):
         self.mcmc.run(rng_key, X, y)
         if print_summary:
             self.mcmc.print_summary()
+        self.compute_cache()
+    
+    def fit(self, rng_key, X, y, method='map', num_restarts=10, init_params=None, **mcmc_kwargs):
+        """
+        Fit the GP hyperparameters. With method='mcmc' they are sampled with NUTS (see `run_MCMC`), while with method='map'
+        a point estimate is found by maximizing the log marginal likelihood (plus the log-normal priors of the model) 
+        with BFGS, from `num_restarts` random starting points (and `init_params`, if given) optimized in parallel.
+        """
+        if method == 'mcmc':
+            return self.run_MCMC(rng_key, X, y, **mcmc_kwargs)
+        if method != 'map':
+            raise NotImplementedError(f'Fitting method {method} not implemented')
+        
+        self._set_training_data(X, y)
+        u0 = jra.normal(rng_key, (num_restarts, self.input_dim + 2))
+        if init_params is not None:
+            u0 = u0.at[0].set(self._pack(init_params))
+        X_train, y_residual, mask = self.X_train, self._y_residual(), None
+        if self.solver is None:
+            # padded to a multiple of _PAD_SIZE points, so that refits after `add_data` reuse the compiled optimizer
+            X_train, y_residual, mask = _pad_training_set(X_train, y_residual, _PAD_SIZE)
+        results = gp_fit_map(self.kernel, X_train, self.X_inducing, y_residual, u0, mask,
+                             sparse=self.sparse, solver=self.solver)
+        
+        self.mcmc = None
+        self.map_params = self._unpack(results.x[jnp.nanargmin(results.fun)])
+        self.compute_cache({k: v[None] for k, v in self.map_params.items()})
+    
+    def log_marginal_likelihood(self, params, y_residual=None):
+        """Log marginal likelihood of the training data for a single sample of GP hyperparameters"""
+        y_residual = self._y_residual() if y_residual is None else y_residual
+        return gp_log_likelihood(self.kernel, self.X_train, self.X_inducing, y_residual, params, self.sparse, self.solver)
+    
+    def _pack(self, params):
+        """Flatten the GP hyperparameters into a vector of log-values"""
+        return jnp.log(jnp.concatenate([jnp.ravel(params[k]) for k in ["ell_f", "sigma_f", "noise"]]))
+    
+    def _unpack(self, u):
+        """Inverse of `_pack`"""
+        return _unpack_params(u, self.input_dim)
+    
+    def _set_training_data(self, X, y):
+        """Store the training set (and select the inducing points in sparse mode)"""
+        X = X if X.ndim > 1 else X[:, None]
+        self.X_train = X
+        self.y_train = y
+        if self.sparse is not None and self.X_inducing is None:
+            idx = jra.choice(jra.PRNGKey(0), X.shape[0], (min(self.num_inducing, X.shape[0]),), replace=False)
+            self.X_inducing = X[idx]
+        return X, y
+    
+    def add_data(self, X_new, y_new, refit=False, rng_key=None, **fit_kwargs):
+        """
+        Append new points to the training set. The cached Cholesky factors of every hyperparameter sample are 
+        extended with a block (rank-k) update, in O(n^2 k) instead of a full O(n^3) refactorization
+        (in sparse mode, the O(n m^2) factors are simply recomputed).
+        If `refit` is True, the hyperparameters are fitted again with the last method used, starting from
+        the median of the previous posterior (NUTS) or from the previous point estimate (MAP).
+        """
+        X_new = X_new if X_new.ndim > 1 else X_new[:, None]
+        X_old = self.X_train
+        self.X_train = jnp.concatenate([X_old, X_new])
+        self.y_train = jnp.concatenate([self.y_train, jnp.atleast_1d(y_new)])
+        
+        if refit:
+            rng_key = jra.PRNGKey(0) if rng_key is None else rng_key
+            if self.mcmc is None:
+                self.fit(rng_key, self.X_train, self.y_train, method='map', init_params=self.map_params, **fit_kwargs)
+                return
+            init_values = {k: jnp.median(v, 0) for k, v in self.get_mcmc_samples().items()}
+            self.run_MCMC(rng_key, self.X_train, self.y_train,
+                          init_strategy=numpyro.infer.init_to_value(values=init_values), **fit_kwargs)
+        elif self._cache is not None and (self.sparse is not None or self.solver is not None):
+            self.compute_cache(self._cache["samples"])
+        elif self._cache is not None:
+            y_residual = self._y_residual()
+            update = lambda params, L: cholesky_update(self.kernel, X_old, X_new, y_residual, params, L)
+            L = self._cache["factors"][0]
+            self._cache["factors"] = jax.vmap(update)(self._cache["samples"], L)
+    
+    def compute_cache(self, samples=None, thin=1):
+        """
+        Compute (and store) the Cholesky factor L of K(X_train,X_train) and alpha = K^{-1} y for each sample of GP hyperparameters,
+        so that predictions only need triangular solves. Note that the cache takes num_samples x n_train^2 floats, use `thin` for large training sets.
+        In sparse mode, the cache only holds O(m^2) floats per sample (see `sparse_factor`).
+        """
+        if samples is None:
+            samples = self.get_mcmc_samples(chain_dim=False)
+        samples = {k: v[::thin] for k, v in samples.items()}
+        self._cache = {"samples": samples, "factors": self._factorize(samples)}
+    
+    def _factorize(self, samples):
+        """Cholesky factors for a batch of GP hyperparameters samples"""
+        return gp_factor(self.kernel, self.X_train, self.X_inducing, self._y_residual(), samples, self.sparse, self.solver)
+    
+    def _y_residual(self):
+        """Training targets with the mean function (if any) subtracted"""
+        if self.mean_fn is not None:
+            return self.y_train - self.mean_fn(self.X_train).squeeze()
+        return self.y_train
     
     def get_mcmc_samples(self, chain_dim=False):
         """Get posterior samples (after running the MCMC chains)"""
         return self.mcmc.get_samples(group_by_chain=chain_dim)
 
-    @partial(jit, static_argnames='self')
-    def get_posterior(self, X_test, params):
+    def get_state(self, samples=None):
         """
-        Returns parameters (mean and cov) of multivariate normal posterior
-        for a single sample of GP hyperparameters
+        The GPState used for predictions: the cached hyperparameter samples and factors if `samples` is None,
+        otherwise the given samples and their (freshly computed) factors
         """
-        noise = params["noise"]
-        y_residual = self.y_train
-        if self.mean_fn is not None:
-            y_residual -= self.mean_fn(self.X_train).squeeze()
-            # y_residual -= self.mean_fn(self.X_train, params).squeeze()
-            
-        # compute kernel matrices for train and test data
-        k_pp = self.kernel(X_test, X_test, params, noise)
-        k_pX = self.kernel(X_test, self.X_train, params, jitter=0.0)
-        k_XX = self.kernel(self.X_train, self.X_train, params, noise)
-        
-        # compute the predictive covariance and mean
-        K_xx_inv = jnp.linalg.inv(k_XX)
-        cov = k_pp - jnp.matmul(k_pX, jnp.matmul(K_xx_inv, jnp.transpose(k_pX)))
-        mean = jnp.matmul(k_pX, jnp.matmul(K_xx_inv, y_residual))
+        if samples is None:
+            if self._cache is None:
+                self.compute_cache()
+            samples, factors = self._cache["samples"], self._cache["factors"]
+        else:
+            factors = self._factorize(samples)
+        X_inducing = self.X_inducing if self.sparse is not None else None
+        return GPState(self.X_train, X_inducing, samples, factors)
+
+    def get_padded_state(self, n_extra=0):
+        """
+        The GPState of `get_state` (for the cached hyperparameter samples), with the training set padded to a multiple 
+        of _PAD_SIZE points leaving room for `n_extra` more (see `_pad_training_set`), so that jitted functions of the state
+        compile once for training sets of similar sizes. The padded points can then be replaced by new (e.g. fake) 
+        observations with `set_padded_point`, without changing the shapes. Not available with the matrix-free solver.
         
-        if self.mean_fn is not None:
-            mean += self.mean_fn(X_test).squeeze()
-            # mean += self.mean_fn(X_test, params).squeeze()
-        return mean, cov
+        Returns:
+            tuple: the padded GPState, and the padded training targets (with the mean function subtracted)
+        """
+        if self.solver is not None:
+            raise NotImplementedError('The matrix-free solver does not support padded training sets')
+        samples = self.get_state().samples
+        X_train, y_residual, mask = _pad_training_set(self.X_train, self._y_residual(), _PAD_SIZE, n_extra)
+        X_inducing = self.X_inducing if self.sparse is not None else None
+        factors = gp_factor(self.kernel, X_train, X_inducing, y_residual, samples, self.sparse, mask=mask)
+        return GPState(X_train, X_inducing, samples, factors, mask), y_residual
+
+    def set_padded_point(self, state, y_residual, x, y):
+        """
+        Replace the first padded point of a padded GPState (see `get_padded_state`) by an observation y at x
+        (for all the hyperparameter samples), and refactorize the training covariance.
         
-    def _predict(self, rng_key, X_test, params, n):
-        """Prediction with a single sample of GP hyperparameters"""
+        Returns:
+            tuple: the updated GPState and padded training targets
+        """
+        i = int(state.mask.sum())
+        if i == state.mask.shape[0]:
+            raise ValueError('No padded point left in the GPState')
+        x = jnp.reshape(x, (1, -1))
+        y = jnp.reshape(y, (-1,))[0] - (self.mean_fn(x).squeeze() if self.mean_fn is not None else 0.)
+        X_train = state.X_train.at[i].set(x[0])
+        y_residual = y_residual.at[i].set(y)
+        mask = state.mask.at[i].set(True)
+        factors = gp_factor(self.kernel, X_train, state.X_inducing, y_residual, state.samples, self.sparse, mask=mask)
+        return GPState(X_train, state.X_inducing, state.samples, factors, mask), y_residual
+
+    def get_posterior(self, X_test, params, factors=None):
+        """
+        Returns parameters (mean and cov) of multivariate normal posterior
+        for a single sample of GP hyperparameters, given the (optional) cached factors, 
+        i.e. the Cholesky factor L and alpha = K^{-1} y (or the output of `sparse_factor` in sparse mode)
+        """
         X_test = X_test if X_test.ndim > 1 else X_test[:, None]
-        
-        # Get the predictive mean and covariance
-        y_mean, K = self.get_posterior(X_test, params)
-        
-        # draw samples from the posterior predictive for a given set of hyperparameters
-        y_sample = dist.MultivariateNormal(y_mean, K).sample(rng_key, sample_shape=(n,))
-        
-        return y_mean, y_sample.squeeze()
+        if factors is None and self.sparse is not None:
+            factors = sparse_factor(self.kernel, self.X_train, self.X_inducing, self._y_residual(), params, self.sparse)
+        elif factors is None and self.solver is not None:
+            factors = iterative_factor(self.kernel, self.X_train, self._y_residual(), params, self.solver)
+        elif factors is None:
+            factors = cholesky_factor(self.kernel, self.X_train, self._y_residual(), params)
+        X_inducing = self.X_inducing if self.sparse is not None else None
+        return gp_posterior(self.kernel, self.mean_fn, self.X_train, X_inducing, X_test, params, factors, self.solver)
     
-    def predict(self, rng_key, X_test, samples=None, n=1):
-        """Make prediction at X_test points using sampled GP hyperparameters"""
-        if samples is None:
-            samples = self.get_samples(chain_dim=False)
-        num_samples = samples["ell_f"].shape[0]
+    def predict(self, rng_key, X_test, samples=None, n=1, chunk_size=None):
+        """
+        Make prediction at X_test points using sampled GP hyperparameters (and their cached Cholesky factors if `samples` is None).
+        If `chunk_size` is given, the test points are processed in chunks of fixed size (see `predict_stream`),
+        in which case posterior samples are only correlated within each chunk.
+        """
+        if chunk_size is None:
+            X_test = X_test if X_test.ndim > 1 else X_test[:, None]
+            return gp_predict(self.kernel, self.mean_fn, self.get_state(samples), rng_key, X_test, n, self.solver)
         
-        # use vmap for 'vectorization'
-        vmap_args = (jra.split(rng_key, num_samples), samples)
-        predictive = jax.vmap(lambda params: self._predict(params[0], X_test, params[1], n))
+        y_means, y_sampled = zip(*self.predict_stream(rng_key, X_test, samples, n, chunk_size))
+        return jnp.concatenate(y_means), jnp.concatenate(y_sampled, axis=-1)
+    
+    def predict_stream(self, rng_key, X_test, samples=None, n=1, chunk_size=1024):
+        """
+        Generator of predictions over consecutive chunks of X_test (e.g. a large numpy or memory-mapped array).
+        The last chunk is padded to `chunk_size` so that the prediction is compiled only once.
+        """
+        state = self.get_state(samples)
+        for i, (X_chunk, n_valid) in enumerate(_chunks(X_test, chunk_size)):
+            y_mean, y_sampled = gp_predict(self.kernel, self.mean_fn, state, jra.fold_in(rng_key, i), X_chunk, n, self.solver)
+            yield y_mean[:n_valid], y_sampled[..., :n_valid]
+    
+    def predict_marginal(self, X_test, samples=None, chunk_size=None):
+        """
+        Predictive mean and variance at each of the X_test points, for each sample of GP hyperparameters, 
+        without forming the predictive covariance nor drawing posterior samples (O(m) memory for m test points).
         
-        y_means, y_sampled = predictive(vmap_args)
+        Returns:
+            tuple: means and variances, both with shape (num_samples, m)
+        """
+        state = self.get_state(samples)
+        if chunk_size is None:
+            X_test = X_test if X_test.ndim > 1 else X_test[:, None]
+            return gp_predict_marginal(self.kernel, self.mean_fn, state, X_test, self.solver)
         
-        return y_means.mean(0), y_sampled
+        results = [tuple(r[:, :n_valid] for r in gp_predict_marginal(self.kernel, self.mean_fn, state, X_chunk, self.solver))
+                   for X_chunk, n_valid in _chunks(X_test, chunk_size)]
+        means, variances = zip(*results)
+        return jnp.concatenate(means, axis=1), jnp.concatenate(variances, axis=1)
+
+def _chunks(X_test, chunk_size):
+    """Iterate over chunks of X_test, padding the last one to chunk_size. Yields the chunk and its number of actual points."""
+    for start in range(0, len(X_test), chunk_size):
+        X_chunk = jnp.asarray(X_test[start:start + chunk_size])
+        X_chunk = X_chunk if X_chunk.ndim > 1 else X_chunk[:, None]
+        n_valid = X_chunk.shape[0]
+        yield jnp.pad(X_chunk, ((0, chunk_size - n_valid), (0, 0)), mode='edge'), n_valid
+
+def gp_posterior(kernel, mean_fn, X_train, X_inducing, X_test, params, factors, solver=None, mask=None):
+    """
+    Mean and covariance of the GP posterior at X_test for a single sample of GP hyperparameters and its cached factors
+    (exact GP if X_inducing is None, inducing-point approximation otherwise, and matrix-free exact GP if a `CGSolver` is given),
+    for the training points flagged by mask if given (see `get_padded_state`)
+    """
+    if solver is not None:
+        mean, cov = iterative_posterior(kernel, X_train, X_test, params, solver, *factors)
+    elif X_inducing is None:
+        mean, cov = cholesky_posterior(kernel, X_train, X_test, params, *factors, mask=mask)
+    else:
+        mean, cov = sparse_posterior(kernel, X_inducing, X_test, params, *factors)
+    if mean_fn is not None:
+        mean = mean + mean_fn(X_test).reshape(-1)
+    return mean, cov
+
+def gp_marginal(kernel, mean_fn, X_train, X_inducing, X_test, params, factors, solver=None, mask=None):
+    """
+    Mean and variance (i.e. only the diagonal of the covariance) of the GP posterior at X_test 
+    for a single sample of GP hyperparameters and its cached factors, for the training points flagged by mask if given
+    """
+    k_diag = kernel_diag(kernel, X_test, params) + add_jitter(params["noise"])
+    if solver is not None:
+        mean, var = iterative_marginal(kernel, X_train, X_test, params, solver, *factors)
+    elif X_inducing is None:
+        L, alpha = factors
+        k_pX = kernel(X_test, X_train, params, jitter=0.0)
+        if mask is not None:
+            k_pX = jnp.where(mask, k_pX, 0.)
+        mean = jnp.matmul(k_pX, alpha)
+        var = k_diag - jnp.sum(solve_triangular(L, jnp.transpose(k_pX), lower=True)**2, 0)
+    else:
+        L_uu, L_A, beta = factors
+        W = solve_triangular(L_uu, kernel(X_inducing, X_test, params, jitter=0.0), lower=True)
+        mean = jnp.matmul(jnp.transpose(W), beta)
+        var = k_diag - jnp.sum(W**2, 0) + jnp.sum(solve_triangular(L_A, W, lower=True)**2, 0)
+    if mean_fn is not None:
+        mean = mean + mean_fn(X_test).reshape(-1)
+    return mean, var
+
+@partial(jit, static_argnames=('kernel', 'mean_fn', 'solver'))
+def gp_predict_marginal(kernel, mean_fn, state, X_test, solver=None):
+    """
+    Predictive means and variances at X_test for each of the hyperparameter samples of a given GPState
+    """
+    marginal = lambda params, factors: gp_marginal(kernel, mean_fn, state.X_train, state.X_inducing, X_test, params, factors,
+                                                   solver, state.mask)
+    return jax.vmap(marginal)(state.samples, state.factors)
+
+@partial(jit, static_argnames=('kernel', 'mean_fn', 'n', 'solver'))
+def gp_predict(kernel, mean_fn, state, rng_key, X_test, n=1, solver=None):
+    """
+    Posterior predictive mean (averaged over the hyperparameter samples) and n posterior samples 
+    per hyperparameter sample at X_test, for a given GPState
+    """
+    def single(key, params, factors):
+        y_mean, K = gp_posterior(kernel, mean_fn, state.X_train, state.X_inducing, X_test, params, factors, solver, state.mask)
+        # draw samples from the posterior predictive for a given set of hyperparameters
+        y_sample = dist.MultivariateNormal(y_mean, K).sample(key, sample_shape=(n,))
+        return y_mean, y_sample[0] if n == 1 else y_sample
+    
+    num_samples = state.samples["ell_f"].shape[0]
+    y_means, y_sampled = jax.vmap(single)(jra.split(rng_key, num_samples), state.samples, state.factors)
+    return y_means.mean(0), y_sampled
+
+def gp_log_likelihood(kernel, X_train, X_inducing, y, params, sparse=None, solver=None, mask=None):
+    """
+    Log marginal likelihood of the training data (with the mean function subtracted) for a single sample of GP hyperparameters.
+    If given, `mask` flags the actual training points of a padded training set (see `_pad_training_set`):
+    the other points are decoupled from them, with unit variance and zero targets, and do not contribute.
+    """
+    if sparse is not None:
+        return sparse_log_likelihood(kernel, X_train, X_inducing, y, params, sparse, mask)
+    if solver is not None:
+        return iterative_log_likelihood(kernel, X_train, y, params, solver)
+    L, alpha = cholesky_factor(kernel, X_train, y, params, mask)
+    n = len(y) if mask is None else mask.sum()
+    return -0.5 * jnp.dot(y, alpha) - jnp.sum(jnp.log(jnp.diag(L))) - 0.5 * n * jnp.log(2 * jnp.pi)
+
+@partial(jit, static_argnames=('kernel', 'sparse', 'solver'))
+def gp_fit_map(kernel, X_train, X_inducing, y, u0, mask=None, sparse=None, solver=None):
+    """
+    Maximize the log-posterior of the log-hyperparameters (log marginal likelihood plus standard normal priors) with BFGS,
+    from each of the starting points u0 of shape (num_restarts, input_dim + 2) in parallel. Compiled once per kernel, solver
+    and training set shape. `mask` flags the actual training points of a padded training set (see `gp_log_likelihood`),
+    so that training sets of different sizes can share the same compiled function.
+    """
+    def loss(u):
+        log_prior = dist.Normal(0.0, 1.0).log_prob(u).sum()
+        params = _unpack_params(u, X_train.shape[1])
+        return -(gp_log_likelihood(kernel, X_train, X_inducing, y, params, sparse, solver, mask) + log_prior)
+    
+    return jax.vmap(lambda u: minimize(loss, u, method='BFGS'))(u0)
+
+@partial(jit, static_argnames=('kernel', 'sparse', 'solver'))
+def gp_factor(kernel, X_train, X_inducing, y, samples, sparse=None, solver=None, mask=None):
+    """
+    Cached factors for a batch of GP hyperparameters samples (see `cholesky_factor`, `sparse_factor` and `iterative_factor`),
+    for the training points flagged by mask if given (not available with the matrix-free solver)
+    """
+    if sparse is not None:
+        factorize = lambda params: sparse_factor(kernel, X_train, X_inducing, y, params, sparse, mask)
+    elif solver is not None:
+        factorize = lambda params: iterative_factor(kernel, X_train, y, params, solver)
+    else:
+        factorize = lambda params: cholesky_factor(kernel, X_train, y, params, mask)
+    return jax.vmap(factorize)(samples)
+
+_PAD_SIZE = 64
+
+def _pad_training_set(X, y, multiple, n_extra=0):
+    """Pad the training set (repeating its first point, with zero targets) to a multiple of `multiple` points,
+    with room for at least `n_extra` more points"""
+    n = X.shape[0]
+    n_pad = -(-(n + n_extra) // multiple) * multiple
+    X = jnp.concatenate([X, jnp.broadcast_to(X[:1], (n_pad - n, X.shape[1]))])
+    y = jnp.concatenate([y, jnp.zeros(n_pad - n)])
+    return X, y, jnp.arange(n_pad) < n
+
+def _unpack_params(u, input_dim):
+    """GP hyperparameters from a vector of log-values"""
+    d = input_dim
+    return {"ell_f": jnp.exp(u[:d]), "sigma_f": jnp.exp(u[d]), "noise": jnp.exp(u[d + 1])}
+
+@partial(jit, static_argnames='kernel')
+def cholesky_factor(kernel, X, y, params, mask=None):
+    """
+    Cholesky factor L of the training covariance K(X,X) (including noise) and alpha = K^{-1} y, 
+    for a single sample of GP hyperparameters. The points of a padded training set that are not flagged by mask
+    are decoupled from the others, with unit variance.
+    """
+    k_XX = kernel(X, X, params, params["noise"])
+    if mask is not None:
+        k_XX = jnp.where(mask[:, None] & mask[None, :], k_XX, 0.) + jnp.diag(jnp.where(mask, 0., 1.))
+    L = jnp.linalg.cholesky(k_XX)
+    alpha = cho_solve((L, True), y)
+    return L, alpha
+
+@partial(jit, static_argnames='kernel')
+def cholesky_update(kernel, X, X_new, y, params, L):
+    """
+    Extend the Cholesky factor L of K(X,X) to the training set [X, X_new] with a block update,
+    and return it together with alpha = K^{-1} y for the full training set
+    """
+    k_Xn = kernel(X, X_new, params, jitter=0.0)
+    k_nn = kernel(X_new, X_new, params, params["noise"])
+    S = solve_triangular(L, k_Xn, lower=True)
+    L_nn = jnp.linalg.cholesky(k_nn - jnp.matmul(jnp.transpose(S), S))
+    L = jnp.block([[L, jnp.zeros_like(k_Xn)], [jnp.transpose(S), L_nn]])
+    alpha = cho_solve((L, True), y)
+    return L, alpha
+
+@partial(jit, static_argnames='kernel')
+def cholesky_posterior(kernel, X_train, X_test, params, L, alpha, mask=None):
+    """
+    Mean and covariance of the GP posterior at X_test, given the Cholesky factor L and alpha = K^{-1} y
+    (of the training points flagged by mask, if given)
+    """
+    k_pp = kernel(X_test, X_test, params, params["noise"])
+    k_pX = kernel(X_test, X_train, params, jitter=0.0)
+    if mask is not None:
+        k_pX = jnp.where(mask, k_pX, 0.)
+    mean = jnp.matmul(k_pX, alpha)
+    v = solve_triangular(L, jnp.transpose(k_pX), lower=True)
+    cov = k_pp - jnp.matmul(jnp.transpose(v), v)
+    return mean, cov
+
+@partial(jit, static_argnames=('kernel', 'method'))
+def sparse_factor(kernel, X, X_u, y, params, method='fitc', mask=None):
+    """
+    Factors of the inducing-point (FITC or VFE) approximation K ~ Q + Lambda, with Q = K_xu K_uu^{-1} K_ux,
+    for a single sample of GP hyperparameters: the Cholesky factors L_uu of K_uu and L_A of A = I + V Lambda^{-1} V^T 
+    (where V = L_uu^{-1} K_ux), and beta = A^{-1} V Lambda^{-1} y. The cost is O(n m^2) for m inducing points.
+    Only the training points flagged by mask (if given) contribute.
+    """
+    L_uu, L_A, beta, _ = _sparse_terms(kernel, X, X_u, y, params, method, mask)
+    return L_uu, L_A, beta
+
+def _sparse_terms(kernel, X, X_u, y, params, method, mask=None):
+    """Factors of the inducing-point approximation, plus the terms needed by the marginal likelihood
+    (the points of a padded training set that are not flagged by mask are decoupled, with unit variance)"""
+    noise = params["noise"]
+    k_uu = kernel(X_u, X_u, params)
+    k_ux = kernel(X_u, X, params, jitter=0.0)
+    L_uu = jnp.linalg.cholesky(k_uu)
+    V = solve_triangular(L_uu, k_ux, lower=True)
+    if mask is not None:
+        V = V * mask
+    residual_var = kernel_diag(kernel, X, params) - jnp.sum(V**2, 0)
+    lam = noise + residual_var if method == 'fitc' else noise * jnp.ones(X.shape[0])
+    if mask is not None:
+        residual_var = jnp.where(mask, residual_var, 0.)
+        lam = jnp.where(mask, lam, 1.)
+    V_lam = V / lam
+    L_A = jnp.linalg.cholesky(jnp.eye(X_u.shape[0]) + jnp.matmul(V_lam, jnp.transpose(V)))
+    c = solve_triangular(L_A, jnp.matmul(V_lam, y), lower=True)
+    beta = solve_triangular(jnp.transpose(L_A), c, lower=False)
+    return L_uu, L_A, beta, (lam, c, residual_var)
+
+@partial(jit, static_argnames=('kernel', 'method'))
+def sparse_log_likelihood(kernel, X, X_u, y, params, method='fitc', mask=None):
+    """
+    Log marginal likelihood of (zero-mean) y under the inducing-point approximation ('fitc', or the 'vfe' lower bound),
+    for the points flagged by mask if given (see `gp_log_likelihood`)
+    """
+    _, L_A, _, (lam, c, residual_var) = _sparse_terms(kernel, X, X_u, y, params, method, mask)
+    quad = jnp.sum(y**2 / lam) - jnp.sum(c**2)
+    logdet = jnp.sum(jnp.log(lam)) + 2 * jnp.sum(jnp.log(jnp.diag(L_A)))
+    n = X.shape[0] if mask is None else mask.sum()
+    log_like = -0.5 * (quad + logdet + n * jnp.log(2 * jnp.pi))
+    if method == 'vfe':
+        log_like -= 0.5 * jnp.sum(residual_var) / params["noise"]
+    return log_like
+
+@partial(jit, static_argnames='kernel')
+def sparse_posterior(kernel, X_u, X_test, params, L_uu, L_A, beta):
+    """
+    Mean and covariance of the GP posterior at X_test under the inducing-point approximation, given the output of `sparse_factor`
+    """
+    k_pp = kernel(X_test, X_test, params, params["noise"])
+    W = solve_triangular(L_uu, kernel(X_u, X_test, params, jitter=0.0), lower=True)
+    U = solve_triangular(L_A, W, lower=True)
+    mean = jnp.matmul(jnp.transpose(W), beta)
+    cov = k_pp - jnp.matmul(jnp.transpose(W), W) + jnp.matmul(jnp.transpose(U), U)
+    return mean, cov
 
 
 # if jax.__version__ < '0.2.26':
@@ -143,4 +571,30 @@ class GaussianProcessJax(GaussianProcessBase):
 #     clear_cache = jax._src.dispatch._xla_callable.cache_clear
      
 if __name__=='__main__':
-    print('All Good')
\ No newline at end of file
+    # Benchmark the Cholesky-based posterior against the explicit inverse
+    from timeit import timeit
+    from .kernels import ExpontentialSquaredKernel as kernel
+    
+    params = {"ell_f": jnp.array([0.5]), "sigma_f": jnp.array(1.), "noise": jnp.array(1e-4)}
+    X_test = jnp.linspace(0, 1, 200)[:, None]
+    
+    @jit
+    def inv_posterior(X_train, y, X_test, params):
+        k_pp = kernel(X_test, X_test, params, params["noise"])
+        k_pX = kernel(X_test, X_train, params, jitter=0.0)
+        K_xx_inv = jnp.linalg.inv(kernel(X_train, X_train, params, params["noise"]))
+        return jnp.matmul(k_pX, jnp.matmul(K_xx_inv, y)), k_pp - jnp.matmul(k_pX, jnp.matmul(K_xx_inv, k_pX.T))
+    
+    for n in [100, 500, 1000, 2000, 5000]:
+        X = jra.uniform(jra.PRNGKey(0), (n, 1))
+        y = jnp.sin(6 * X[:, 0])
+        L, alpha = cholesky_factor(kernel, X, y, params)
+        
+        def bench(f):
+            jax.block_until_ready(f())  # compile
+            return timeit(lambda: jax.block_until_ready(f()), number=3) / 3
+        
+        t_inv = bench(lambda: inv_posterior(X, y, X_test, params))
+        t_fact = bench(lambda: cholesky_factor(kernel, X, y, params))
+        t_pred = bench(lambda: cholesky_posterior(kernel, X, X_test, params, L, alpha))
+        print(f'n={n}: inverse {t_inv*1e3:.1f} ms, cholesky {t_fact*1e3:.1f} ms + cached predict {t_pred*1e3:.1f} ms')
\ No newline at end of file
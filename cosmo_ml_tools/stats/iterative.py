@@ -0,0 +1,155 @@
+from functools import partial
+from typing import NamedTuple
+import jax
+from jax import jit, lax
+import jax.numpy as jnp
+import jax.random as jra
+from jax.scipy.linalg import cho_solve, solve_triangular
+from jax.scipy.sparse.linalg import cg
+
+from .kernels import kernel_mvp, kernel_diag, add_jitter
+
+class CGSolver(NamedTuple):
+    """
+    Settings of the matrix-free linear algebra backend: K^{-1} v is computed with preconditioned conjugate gradients
+    and log|K| with stochastic Lanczos quadrature, using only kernel-vector products (see `kernels.kernel_mvp`),
+    i.e. with O(n) memory instead of O(n^2). Being hashable, it can be passed as a static argument to jitted functions.
+
+    Args:
+        tol (float): relative tolerance of the conjugate gradients. Defaults to 1e-6.
+        max_iters (int): maximum number of conjugate gradients iterations. Defaults to 1000.
+        num_probes (int): number of random probe vectors used by the stochastic estimates of log|K| (and of its gradient). Defaults to 16.
+        lanczos_steps (int): number of Lanczos iterations per probe vector. Defaults to 50.
+        precond_rank (int): number of training points used by the Nystrom preconditioner. Defaults to 100.
+        block_size (int): number of rows of K computed at once in the kernel-vector products. Defaults to 512.
+        seed (int): seed of the probe vectors and of the preconditioner points. Defaults to 0.
+    """
+    tol: float = 1e-6
+    max_iters: int = 1000
+    num_probes: int = 16
+    lanczos_steps: int = 50
+    precond_rank: int = 100
+    block_size: int = 512
+    seed: int = 0
+
+def nystrom_preconditioner(kernel, X, params, solver):
+    """
+    Low-rank plus diagonal approximation P = V^T V + noise I of the training covariance, with V = L_uu^{-1} K_ux
+    for a random subset u of `solver.precond_rank` training points. Returns V and the Cholesky factor of noise I + V V^T.
+    """
+    rank = min(solver.precond_rank, X.shape[0])
+    X_u = X[jra.choice(jra.PRNGKey(solver.seed), X.shape[0], (rank,), replace=False)]
+    L_uu = jnp.linalg.cholesky(kernel(X_u, X_u, params))
+    V = solve_triangular(L_uu, kernel(X_u, X, params, jitter=0.0), lower=True)
+    noise = add_jitter(params["noise"])
+    L_s = jnp.linalg.cholesky(noise * jnp.eye(rank) + jnp.matmul(V, jnp.transpose(V)))
+    return V, L_s
+
+def precondition(params, V, L_s, v):
+    """Apply P^{-1} to v with the Woodbury identity, in O(n r) for a preconditioner of rank r"""
+    noise = add_jitter(params["noise"])
+    return (v - jnp.matmul(jnp.transpose(V), cho_solve((L_s, True), jnp.matmul(V, v)))) / noise
+
+def cg_solve(kernel, X, params, b, solver, V=None, L_s=None):
+    """
+    K^{-1} b for the training covariance K = K(X, X) + noise I, with (Nystrom-preconditioned) conjugate gradients.
+    The columns of a 2D b are solved independently. Differentiable with respect to params and b.
+    """
+    if V is None:
+        V, L_s = nystrom_preconditioner(kernel, X, params, solver)
+    matvec = lambda v: kernel_mvp(kernel, X, v, params, params["noise"], block_size=solver.block_size)
+    solve = lambda b: cg(matvec, b, tol=solver.tol, maxiter=solver.max_iters,
+                         M=lambda v: precondition(params, V, L_s, v))[0]
+    return jax.vmap(solve, in_axes=1, out_axes=1)(b) if b.ndim > 1 else solve(b)
+
+def _probes(solver, n):
+    """Rademacher probe vectors, with shape (n, num_probes)"""
+    return jra.rademacher(jra.PRNGKey(solver.seed), (n, solver.num_probes)).astype(float)
+
+def lanczos(matvec, Z, num_steps):
+    """
+    `num_steps` Lanczos iterations for each of the columns of Z (without reorthogonalization).
+    Returns the diagonal and off-diagonal terms of the tridiagonal matrices, with shapes (k, num_steps) and (k, num_steps - 1).
+    """
+    def step(carry, _):
+        q, q_prev, beta_prev = carry
+        w = matvec(q) - beta_prev * q_prev
+        alpha = jnp.sum(q * w, 0)
+        w = w - alpha * q
+        beta = jnp.linalg.norm(w, axis=0)
+        q_next = w / jnp.where(beta > 1e-12, beta, 1.0)
+        return (q_next, q, beta), (alpha, beta)
+
+    Q = Z / jnp.linalg.norm(Z, axis=0)
+    _, (alphas, betas) = lax.scan(step, (Q, jnp.zeros_like(Q), jnp.zeros(Z.shape[1])), None, length=num_steps)
+    return jnp.transpose(alphas), jnp.transpose(betas[:-1])
+
+@partial(jax.custom_jvp, nondiff_argnums=(0, 3))
+def slq_logdet(kernel, X, params, solver):
+    """
+    Stochastic Lanczos quadrature estimate of log|K| for the training covariance K = K(X, X) + noise I,
+    in O(num_probes x lanczos_steps) kernel-vector products. Its derivatives with respect to params
+    are given by the stochastic trace estimate d log|K| = E_z[z^T K^{-1} dK z] (with conjugate gradients).
+    """
+    Z = _probes(solver, X.shape[0])
+    matvec = lambda v: kernel_mvp(kernel, X, v, params, params["noise"], block_size=solver.block_size)
+    alphas, betas = lanczos(matvec, Z, min(solver.lanczos_steps, X.shape[0]))
+
+    def quadrature(alpha, beta):
+        T = jnp.diag(alpha) + jnp.diag(beta, 1) + jnp.diag(beta, -1)
+        theta, U = jnp.linalg.eigh(T)
+        return jnp.sum(U[0]**2 * jnp.log(jnp.maximum(theta, 1e-300)))
+
+    # ||z||^2 = n for Rademacher probes
+    return X.shape[0] * jnp.mean(jax.vmap(quadrature)(alphas, betas))
+
+@slq_logdet.defjvp
+def _slq_logdet_jvp(kernel, solver, primals, tangents):
+    X, params = primals
+    _, params_dot = tangents
+    Z = _probes(solver, X.shape[0])
+    KinvZ = cg_solve(kernel, X, lax.stop_gradient(params), Z, solver)
+    mvp = lambda params: kernel_mvp(kernel, X, Z, params, params["noise"], block_size=solver.block_size)
+    _, dKZ = jax.jvp(mvp, (params,), (params_dot,))
+    return slq_logdet(kernel, X, params, solver), jnp.sum(KinvZ * dKZ) / solver.num_probes
+
+@partial(jit, static_argnames=('kernel', 'solver'))
+def iterative_factor(kernel, X, y, params, solver):
+    """
+    Matrix-free counterpart of `cholesky_factor` for a single sample of GP hyperparameters:
+    alpha = K^{-1} y and the Nystrom preconditioner (V, L_s), in O(n r) memory
+    """
+    V, L_s = nystrom_preconditioner(kernel, X, params, solver)
+    alpha = cg_solve(kernel, X, params, y, solver, V, L_s)
+    return alpha, V, L_s
+
+@partial(jit, static_argnames=('kernel', 'solver'))
+def iterative_log_likelihood(kernel, X, y, params, solver):
+    """Log marginal likelihood of (zero-mean) y, with conjugate gradients and stochastic Lanczos quadrature"""
+    alpha = cg_solve(kernel, X, params, y, solver)
+    logdet = slq_logdet(kernel, X, params, solver)
+    return -0.5 * (jnp.dot(y, alpha) + logdet + X.shape[0] * jnp.log(2 * jnp.pi))
+
+def _cross_covariance(kernel, X_train, X_test, params, solver, V, L_s):
+    """K(X_train, X_test) and K^{-1} K(X_train, X_test)"""
+    k_Xp = kernel(X_train, X_test, params, jitter=0.0)
+    return k_Xp, cg_solve(kernel, X_train, params, k_Xp, solver, V, L_s)
+
+@partial(jit, static_argnames=('kernel', 'solver'))
+def iterative_posterior(kernel, X_train, X_test, params, solver, alpha, V, L_s):
+    """
+    Mean and covariance of the GP posterior at X_test, given the output of `iterative_factor`.
+    Takes O(n m) memory for m test points, so large test sets should be processed in chunks.
+    """
+    k_pp = kernel(X_test, X_test, params, params["noise"])
+    mean = kernel_mvp(kernel, X_test, alpha, params, Y=X_train, block_size=solver.block_size)
+    k_Xp, v = _cross_covariance(kernel, X_train, X_test, params, solver, V, L_s)
+    return mean, k_pp - jnp.matmul(jnp.transpose(k_Xp), v)
+
+@partial(jit, static_argnames=('kernel', 'solver'))
+def iterative_marginal(kernel, X_train, X_test, params, solver, alpha, V, L_s):
+    """Mean and variance (diagonal of the covariance) of the GP posterior at X_test, given the output of `iterative_factor`"""
+    k_diag = kernel_diag(kernel, X_test, params) + add_jitter(params["noise"])
+    mean = kernel_mvp(kernel, X_test, alpha, params, Y=X_train, block_size=solver.block_size)
+    k_Xp, v = _cross_covariance(kernel, X_train, X_test, params, solver, V, L_s)
+    return mean, k_diag - jnp.sum(k_Xp * v, 0)
@@ -1,5 +1,7 @@
-from typing import Dict, Union
-from jax import jit
+from functools import partial
+from typing import Callable, Dict, Optional, Union
+import jax
+from jax import jit, lax
 import jax.numpy as jnp
 
 @jit
@@ -21,7 +23,7 @@ def ExpontentialSquaredKernel(X: jnp.ndarray, Y: jnp.ndarray,
     r2 = square_scaled_distance(X, Y, params["ell_f"])
     k = params["sigma_f"] * jnp.exp(-0.5 * r2)
     if X.shape == Y.shape:
-        k += add_jitter(noise, **kwargs) * jnp.eye(X.shape[0])
+        k = add_diagonal(k, add_jitter(noise, **kwargs))
     return k
 
 
@@ -46,7 +48,7 @@ def MaternKernel(X: jnp.ndarray, Y: jnp.ndarray,
     sqrt5_r = 5**0.5 * r
     k = params["sigma_f"] * (1 + sqrt5_r + (5/3) * r2) * jnp.exp(-sqrt5_r)
     if X.shape == Y.shape:
-        k += add_jitter(noise, **kwargs) * jnp.eye(X.shape[0])
+        k = add_diagonal(k, add_jitter(noise, **kwargs))
     return k
 
 def _sqrt(x: jnp.ndarray, eps=1e-12)-> jnp.ndarray:
@@ -73,6 +75,33 @@ def add_jitter(x: jnp.ndarray, jitter:float = 1e-6) -> jnp.ndarray:
     """
     return x + jitter
 
+def add_diagonal(k: jnp.ndarray, value: Union[jnp.ndarray, float]) -> jnp.ndarray:
+    """Add a value to the diagonal of a square matrix, without allocating an identity matrix (in-place under jit).
+
+    Args:
+        k (jnp.ndarray): a square matrix
+        value (Union[jnp.ndarray, float]): the value to add to the diagonal
+
+    Returns:
+        jnp.ndarray: an array with k + value * I values
+    """
+    idx = jnp.arange(k.shape[0])
+    return k.at[idx, idx].add(value)
+
+def kernel_diag(kernel: Callable, X: jnp.ndarray,
+                params: Dict[str, jnp.ndarray]) -> jnp.ndarray:
+    """Diagonal of kernel(X, X), without noise/jitter, computed without forming the full covariance matrix.
+
+    Args:
+        kernel (Callable): one of the kernels above.
+        X (jnp.ndarray): array of X values
+        params (Dict[str, jnp.ndarray]): a dictionary with the kernel hyperparameter values.
+
+    Returns:
+        jnp.ndarray: an array with the values k(x_i, x_i)
+    """
+    return jax.vmap(lambda x: kernel(x[None], x[None], params, jitter=0.0)[0, 0])(X)
+
 def square_scaled_distance(X: jnp.ndarray, Y: jnp.ndarray,
                            lengthscale: Union[jnp.ndarray, float] = 1.
                            ) -> jnp.ndarray:
@@ -88,8 +117,66 @@ def square_scaled_distance(X: jnp.ndarray, Y: jnp.ndarray,
     """
     scaled_X = X / lengthscale
     scaled_Y = Y / lengthscale
-    X2 = (scaled_X ** 2).sum(1, keepdims=True)
-    Y2 = (scaled_Y ** 2).sum(1, keepdims=True)
-    XY = jnp.matmul(scaled_X, scaled_Y.T)
-    r2 = X2 - 2 * XY + Y2.T
-    return r2.clip(0)
+    X2 = (scaled_X ** 2).sum(1)
+    Y2 = (scaled_Y ** 2).sum(1)
+    # single fused expression, so that XLA only materializes the n x m output (plus the matmul)
+    r2 = X2[:, None] + Y2[None, :] - 2 * jnp.matmul(scaled_X, scaled_Y.T)
+    return jnp.maximum(r2, 0)
+
+def _row_blocks(X: jnp.ndarray, block_size: int) -> jnp.ndarray:
+    """Reshape X into blocks of `block_size` rows, padding the last block with copies of the last row"""
+    n = X.shape[0]
+    num_blocks = -(-n // block_size)
+    X = jnp.pad(X, ((0, num_blocks * block_size - n), (0, 0)), mode='edge')
+    return X.reshape(num_blocks, block_size, X.shape[1])
+
+@partial(jit, static_argnames=('kernel', 'block_size'))
+def tiled_kernel(kernel: Callable, X: jnp.ndarray, Y: jnp.ndarray,
+                 params: Dict[str, jnp.ndarray], noise: float = 0,
+                 block_size: int = 1024, **kwargs: float) -> jnp.ndarray:
+    """Kernel matrix computed in blocks of `block_size` rows (streamed with `lax.map`), so that the temporary arrays
+    only take O(block_size x m) memory on top of the n x m output. Noise and jitter are added to the diagonal if X and Y have the same shape.
+
+    Args:
+        kernel (Callable): one of the kernels above.
+        X (jnp.ndarray): array of X values
+        Y (jnp.ndarray): array of Y values
+        params (Dict[str, jnp.ndarray]): a dictionary with the kernel hyperparameter values.
+        noise (float, optional): additional white noise to be added to the diagonal of the covariance matrix. Defaults to 0.
+        block_size (int, optional): number of rows computed at once. Defaults to 1024.
+
+    Returns:
+        jnp.ndarray: the kernel evaluated at the X,Y values.
+    """
+    blocks = lax.map(lambda X_block: kernel(X_block, Y, params, jitter=0.0), _row_blocks(X, block_size))
+    k = blocks.reshape(-1, Y.shape[0])[:X.shape[0]]
+    if X.shape == Y.shape:
+        k = add_diagonal(k, add_jitter(noise, **kwargs))
+    return k
+
+@partial(jit, static_argnames=('kernel', 'block_size'))
+def kernel_mvp(kernel: Callable, X: jnp.ndarray, v: jnp.ndarray,
+               params: Dict[str, jnp.ndarray], noise: float = 0,
+               Y: Optional[jnp.ndarray] = None, block_size: int = 1024,
+               **kwargs: float) -> jnp.ndarray:
+    """Matrix-free kernel-vector product K(X, Y) v, computed in blocks of `block_size` rows of K which are never stored,
+    i.e. with O(block_size x m) memory instead of O(n x m). Used by iterative solvers (e.g. conjugate gradients).
+
+    Args:
+        kernel (Callable): one of the kernels above.
+        X (jnp.ndarray): array of X values
+        v (jnp.ndarray): a vector (m,) or a set of vectors (m, k)
+        params (Dict[str, jnp.ndarray]): a dictionary with the kernel hyperparameter values.
+        noise (float, optional): white noise (plus jitter) added to the diagonal of K(X, X), only used if Y is None. Defaults to 0.
+        Y (Optional[jnp.ndarray], optional): array of Y values. Defaults to None, i.e. the (square) training covariance K(X, X).
+        block_size (int, optional): number of rows of K computed at once. Defaults to 1024.
+
+    Returns:
+        jnp.ndarray: an array with the K(X, Y) v values, of shape (n,) or (n, k)
+    """
+    Z = X if Y is None else Y
+    blocks = lax.map(lambda X_block: jnp.matmul(kernel(X_block, Z, params, jitter=0.0), v), _row_blocks(X, block_size))
+    kv = blocks.reshape(-1, *v.shape[1:])[:X.shape[0]]
+    if Y is None:
+        kv = kv + add_jitter(noise, **kwargs) * v
+    return kv
@@ -0,0 +1,68 @@
+from typing import Optional
+import numpy as np
+
+class RunningMoments:
+    """
+    Streaming (weighted) mean and covariance of samples, updated one block at a time.
+    """
+    def __init__(self, covariance: bool = True) -> None:
+        """
+        Welford/Chan accumulators of the weighted mean and of the sum of squared deviations, updated with blocks of samples
+        of shape (..., n, p), where the leading dimensions (e.g. one per chain) are independent accumulators.
+        Each update costs O(n p^2) (or O(n p) without covariance) and is numerically stable for long chains.
+
+        Args:
+            covariance (bool, optional): track the full covariance, otherwise only the variances. Defaults to True.
+        """
+        self.covariance = covariance
+        self.weight = None
+        self.mean = None
+        self.M2 = None
+
+    def update(self, x: np.ndarray, weights: Optional[np.ndarray] = None) -> None:
+        """
+        Add a block of samples.
+
+        Args:
+            x (np.ndarray): an array of shape (..., n, p).
+            weights (np.ndarray, optional): the weights of the samples, with shape (..., n). Defaults to None.
+        """
+        x = np.asarray(x, dtype=float)
+        w = np.ones(x.shape[:-1]) if weights is None else np.asarray(weights, dtype=float)
+        w_b = w.sum(-1)
+        if not np.any(w_b > 0):
+            return
+        mean_b = np.einsum('...n,...np->...p', w, x) / np.where(w_b > 0, w_b, 1.)[..., None]
+        dx = x - mean_b[..., None, :]
+        if self.covariance:
+            M2_b = np.einsum('...n,...np,...nq->...pq', w, dx, dx)
+        else:
+            M2_b = np.einsum('...n,...np->...p', w, dx**2)
+
+        if self.weight is None:
+            self.weight, self.mean, self.M2 = w_b, mean_b, M2_b
+            return
+        # Chan et al. pairwise combination of the accumulated and new moments
+        total = self.weight + w_b
+        frac = w_b / np.where(total > 0, total, 1.)
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * frac[..., None]
+        if self.covariance:
+            correction = np.einsum('...p,...q->...pq', delta, delta) * (self.weight * frac)[..., None, None]
+        else:
+            correction = delta**2 * (self.weight * frac)[..., None]
+        self.M2 = self.M2 + M2_b + correction
+        self.weight = total
+
+    @property
+    def var(self) -> np.ndarray:
+        """Weighted variance of each parameter, with shape (..., p)"""
+        M2 = np.diagonal(self.M2, axis1=-2, axis2=-1) if self.covariance else self.M2
+        return M2 / self.weight[..., None]
+
+    @property
+    def cov(self) -> np.ndarray:
+        """Weighted covariance, with shape (..., p, p)"""
+        if not self.covariance:
+            raise ValueError('The covariance is not tracked, use covariance=True')
+        return self.M2 / self.weight[..., None, None]
@@ -0,0 +1,115 @@
+from typing import Iterable, Optional, Tuple, Union
+import numpy as np
+
+class StreamingQuantiles:
+    """
+    Streaming (weighted) quantiles of a function y(x) sampled in blocks, e.g. posterior samples of f_DE(z).
+    """
+    def __init__(self, compression: int = 2000) -> None:
+        """
+        Accumulate blocks of samples of shape (n_samples, n_x) into one merging t-digest per x value (Dunning & Ertl 2019):
+        the samples are summarized by at most compression/2 + 1 weighted centroids, sorted by value, whose size is bounded in rank
+        (the arcsine scale function), i.e. small in the tails and largest at the median. Memory is O(n_x x compression)
+        independently of the number of samples, and the quantile errors are bounded in rank (~ 1/compression at the median,
+        much less in the tails) whatever the range of the samples (outliers, heavy tails).
+        Non-finite samples (nan, +-inf) are dropped, and counted in `n_nonfinite`.
+
+        Args:
+            compression (int, optional): the t-digest compression, which sets the accuracy. Defaults to 2000.
+        """
+        self.compression = compression
+        self.means = None
+        self.weights = None
+        self.min = None
+        self.max = None
+        self.n_samples = 0
+        self.n_nonfinite = None
+
+    def update(self, samples_y: np.ndarray, weights: Optional[np.ndarray] = None) -> None:
+        """
+        Add a block of samples.
+
+        Args:
+            samples_y (np.ndarray): an array of shape (n_samples, n_x).
+            weights (np.ndarray, optional): the weights of the samples, with shape (n_samples,). Defaults to None.
+        """
+        samples_y = np.asarray(samples_y, dtype=float)
+        samples_y = samples_y.reshape(samples_y.shape[0], -1).T
+        n_x, n = samples_y.shape
+        w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+        w = np.broadcast_to(w, (n_x, n))
+        finite = np.isfinite(samples_y)
+        if self.means is None:
+            self.means = np.zeros((n_x, 0))
+            self.weights = np.zeros((n_x, 0))
+            self.min = np.full(n_x, np.inf)
+            self.max = np.full(n_x, -np.inf)
+            self.n_nonfinite = np.zeros(n_x, dtype=int)
+        self.n_nonfinite += n - finite.sum(1)
+        self.n_samples += n
+        self.min = np.minimum(self.min, np.where(finite, samples_y, np.inf).min(1, initial=np.inf))
+        self.max = np.maximum(self.max, np.where(finite, samples_y, -np.inf).max(1, initial=-np.inf))
+        self._merge(np.concatenate([self.means, np.where(finite, samples_y, 0.)], 1),
+                    np.concatenate([self.weights, np.where(finite, w, 0.)], 1))
+
+    def _merge(self, values, weights):
+        """Sort the centroids and samples, and merge them into the centroids of the scale function"""
+        order = np.argsort(values, axis=1, kind='stable')
+        values = np.take_along_axis(values, order, 1)
+        weights = np.take_along_axis(weights, order, 1)
+        total = weights.sum(1, keepdims=True)
+        q = (np.cumsum(weights, 1) - weights / 2) / np.where(total > 0, total, 1.)
+        # arcsine scale function: the centroids span at most a unit of k(q) = compression / (2 pi) arcsin(2q - 1)
+        n_k = self.compression // 2 + 1
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)) + self.compression / 4)
+        idx = np.clip(k.astype(int), 0, n_k - 1) + n_k * np.arange(len(values))[:, None]
+        size = len(values) * n_k
+        self.weights = np.bincount(idx.ravel(), weights.ravel(), minlength=size).reshape(-1, n_k)
+        sums = np.bincount(idx.ravel(), (weights * values).ravel(), minlength=size).reshape(-1, n_k)
+        self.means = np.where(self.weights > 0, sums / np.where(self.weights > 0, self.weights, 1.), 0.)
+
+    def percentile(self, q: Union[float, list]) -> np.ndarray:
+        """
+        Percentiles of the (finite) samples accumulated so far, with the same convention as `np.percentile(samples_y, q, axis=0)`,
+        interpolating linearly between the centroids (NaN for the x values without finite samples).
+
+        Args:
+            q (float | list): percentile(s) to compute, between 0 and 100.
+
+        Returns:
+            np.ndarray: an array of shape (len(q), n_x), or (n_x,) for a scalar q.
+        """
+        q = np.asarray(q, dtype=float)
+        result = np.full((q.size, len(self.means)), np.nan)
+        for i, (means, weights) in enumerate(zip(self.means, self.weights)):
+            keep = weights > 0
+            means, weights = means[keep], weights[keep]
+            if not len(weights):
+                continue
+            total = weights.sum()
+            centers = np.cumsum(weights) - weights / 2
+            result[:, i] = np.interp(q.ravel() / 100. * total, np.concatenate([[0.], centers, [total]]),
+                                     np.concatenate([[self.min[i]], means, [self.max[i]]]))
+        return result if q.ndim else result[0]
+
+def streaming_percentile(blocks: Iterable[Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]], q: Union[float, list],
+                         compression: int = 2000) -> np.ndarray:
+    """
+    Percentiles of samples given as an iterable of blocks (e.g. a generator, or chunks of a memory-mapped array),
+    with bounded memory (see `StreamingQuantiles`).
+
+    Args:
+        blocks (Iterable): arrays of shape (n_samples, n_x), or tuples (samples_y, weights) for weighted samples.
+        q (float | list): percentile(s) to compute, between 0 and 100.
+        compression (int, optional): the t-digest compression. Defaults to 2000.
+
+    Returns:
+        np.ndarray: an array of shape (len(q), n_x), or (n_x,) for a scalar q.
+    """
+    acc = StreamingQuantiles(compression)
+    for block in blocks:
+        if isinstance(block, tuple):
+            acc.update(*block)
+        else:
+            acc.update(block)
+    return acc.percentile(q)
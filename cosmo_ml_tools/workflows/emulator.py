@@ -1,4 +1,347 @@
+"""
+Train fast emulators of the Boltzmann solver outputs (Cls, P(k), H(z), ...).
+
+The workflow samples a Latin hypercube over the priors of a Cobaya-like ``info`` dictionary,
+computes the requested outputs with ``ClassEngine.map`` (in parallel and with checkpoints),
+compresses them with a PCA and trains a small neural network (in JAX) mapping the parameters to the PCA coefficients.
+"""
+import os
+import json
+import pickle
+import hashlib
 import numpy as np
+from typing import Optional, Union
+from scipy.stats import qmc
+
+import jax
+import jax.numpy as jnp
+import jax.random as jra
+from jax.example_libraries import optimizers
+
+def get_prior_bounds(info: dict, n_sigma: float = 4.) -> dict:
+    """
+    Get the ranges of the sampled parameters from a Cobaya-like info dictionary.
+
+    Args:
+        info (dict): settings for the run, with the priors in info['params'].
+        n_sigma (float, optional): number of standard deviations kept for gaussian priors. Defaults to 4.
+
+    Returns:
+        dict: a dictionary {parameter: (min, max)} for all the sampled parameters.
+    """
+    bounds = {}
+    for parameter, settings in info['params'].items():
+        if not isinstance(settings, dict) or 'prior' not in settings:
+            continue
+        prior = settings['prior']
+        if prior.get('dist', 'uniform') == 'norm':
+            bounds[parameter] = (prior['loc'] - n_sigma * prior['scale'], prior['loc'] + n_sigma * prior['scale'])
+        else:
+            bounds[parameter] = (prior['min'], prior['max'])
+    return bounds
+
+def latin_hypercube(bounds: dict, n_samples: int, seed: Optional[int] = None) -> np.ndarray:
+    """
+    Latin hypercube design over the parameter ranges.
+
+    Args:
+        bounds (dict): a dictionary {parameter: (min, max)}, e.g. from `get_prior_bounds`.
+        n_samples (int): number of points in the design.
+        seed (int | None, optional): seed of the random number generator. Defaults to None.
+
+    Returns:
+        np.ndarray: an array of shape (n_samples, n_params), with columns ordered as `bounds`.
+    """
+    lower, upper = np.array(list(bounds.values())).T
+    design = qmc.LatinHypercube(d=len(bounds), seed=seed).random(n_samples)
+    return qmc.scale(design, lower, upper)
+
+def generate_training_set(engine, names: list[str], samples: np.ndarray, outputs: Optional[list[str]] = None,
+                          output_kwargs: Optional[dict] = None, n_workers: Optional[int] = None,
+                          batch_size: int = 1000, checkpoint: Optional[str] = None) -> dict:
+    """
+    Compute the requested outputs for every point of the design with ``ClassEngine.map``.
+
+    Args:
+        engine (ClassEngine): a ClassEngine instance with the fixed settings of the runs.
+        names (list[str]): names of the (Class) parameters, one per column of `samples`.
+        samples (np.ndarray): an array of shape (n_samples, n_params) with the design.
+        outputs (list[str] | None, optional): the ClassEngine outputs to compute. Defaults to None, i.e. ['Cls'].
+        output_kwargs (dict | None, optional): keyword arguments for the outputs, e.g. {'Pk': {'k':k,'z':z}}. Defaults to None.
+        n_workers (int | None, optional): number of worker processes. Defaults to None, i.e. the number of CPUs.
+        batch_size (int, optional): number of points computed between two checkpoints. Defaults to 1000.
+        checkpoint (str | None, optional): a folder where to store each finished batch. Batches found there are not recomputed,
+            unless they were computed for other points, names, outputs or output_kwargs. Defaults to None.
+
+    Returns:
+        dict: a dictionary with the flattened outputs ('Cls.tt', 'Pk', ...), each of shape (n_samples, ...), and the 'success' mask.
+    """
+    outputs = ['Cls'] if outputs is None else outputs
+    if checkpoint is not None:
+        os.makedirs(checkpoint, exist_ok=True)
+
+    batches = []
+    for i, start in enumerate(range(0, len(samples), batch_size)):
+        fname = None if checkpoint is None else os.path.join(checkpoint, f'batch_{i:05d}.npz')
+        digest = _batch_hash(names, samples[start:start + batch_size], outputs, output_kwargs)
+        if fname is not None and os.path.exists(fname):
+            with np.load(fname) as data:
+                batch = dict(data)
+            # stale checkpoints (another design or other outputs) are recomputed
+            if str(batch.pop('hash', '')) == digest:
+                batches.append(batch)
+                continue
+
+        param_dicts = [dict(zip(names, map(float, theta))) for theta in samples[start:start + batch_size]]
+        batch = _flatten_outputs(engine.map(param_dicts, outputs=outputs, n_workers=n_workers, output_kwargs=output_kwargs))
+        if fname is not None:
+            np.savez(fname, hash=digest, **batch)
+        batches.append(batch)
+
+    # batches where every point failed only have the 'success' mask, their outputs are filled with NaNs
+    template = next((batch for batch in batches if len(batch) > 1), batches[0])
+    fill = lambda batch, key: batch[key] if key in batch else np.full((len(batch['success']), *template[key].shape[1:]), np.nan)
+    return {key: np.concatenate([fill(batch, key) for batch in batches]) for key in template}
+
+def _batch_hash(names: list[str], samples: np.ndarray, outputs: list[str], output_kwargs: Optional[dict]) -> str:
+    """Hash of the inputs of a batch of the training set, stored with its checkpoint"""
+    settings = json.dumps([list(names), list(outputs), output_kwargs], sort_keys=True, default=lambda a: np.asarray(a).tolist())
+    return hashlib.sha256(settings.encode() + np.ascontiguousarray(samples, dtype=float).tobytes()).hexdigest()
+
+def _flatten_outputs(results: dict) -> dict:
+    """Flatten the (possibly nested) outputs of ClassEngine.map into {'Cls.tt': array, 'Pk': array, ...}"""
+    flat = {}
+    for out, val in results.items():
+        if isinstance(val, dict):
+            flat.update({f'{out}.{key}': v for key, v in val.items()})
+        else:
+            flat[out] = val
+    return flat
+
+class PCA:
+    """
+    Principal Component Analysis of a set of (standardized) spectra.
+    """
+    def __init__(self, n_components: int = 20, log: Optional[bool] = None) -> None:
+        """
+        Args:
+            n_components (int, optional): number of principal components kept. Defaults to 20.
+            log (bool | None, optional): whether to compress the logarithm of the spectra. Defaults to None, i.e. only if they are all positive.
+        """
+        self.n_components = n_components
+        self.log = log
+
+    def fit(self, Y: np.ndarray) -> 'PCA':
+        """Find the principal components of the spectra Y, with shape (n_samples, n_features)."""
+        if self.log is None:
+            self.log = bool(np.all(Y > 0))
+        Y = np.log(Y) if self.log else Y
+        self.mean = Y.mean(0)
+        self.std = Y.std(0) + 1e-30
+        _, _, Vt = np.linalg.svd((Y - self.mean) / self.std, full_matrices=False)
+        self.components = Vt[:self.n_components]
+        self.coeffs_std = (((Y - self.mean) / self.std) @ self.components.T).std(0) + 1e-30
+        return self
+
+    def transform(self, Y: np.ndarray) -> np.ndarray:
+        """Project the spectra Y onto the principal components."""
+        Y = np.log(Y) if self.log else Y
+        return ((Y - self.mean) / self.std) @ self.components.T / self.coeffs_std
+
+    def inverse_transform(self, coeffs: jnp.ndarray) -> jnp.ndarray:
+        """Reconstruct the spectra from their PCA coefficients (jax-compatible)."""
+        Y = (coeffs * self.coeffs_std) @ self.components * self.std + self.mean
+        return jnp.exp(Y) if self.log else Y
+
+def init_mlp(rng_key: jnp.ndarray, sizes: list[int]) -> list:
+    """Initialize the weights and biases of a fully-connected network with the given layer sizes."""
+    keys = jra.split(rng_key, len(sizes) - 1)
+    return [(jra.normal(k, (n_in, n_out)) * jnp.sqrt(2. / (n_in + n_out)), jnp.zeros(n_out))
+            for k, n_in, n_out in zip(keys, sizes[:-1], sizes[1:])]
+
+def mlp(params: list, x: jnp.ndarray) -> jnp.ndarray:
+    """Evaluate the fully-connected network on a batch of inputs x."""
+    for W, b in params[:-1]:
+        x = jax.nn.gelu(x @ W + b)
+    W, b = params[-1]
+    return x @ W + b
+
+def fit_mlp(rng_key: jnp.ndarray, X: np.ndarray, Y: np.ndarray, hidden: tuple[int, ...] = (128, 128, 128),
+            n_epochs: int = 2000, batch_size: int = 256, learning_rate: float = 1e-3, verbose: bool = True) -> list:
+    """
+    Train a fully-connected network with Adam, minimizing the mean squared error between mlp(X) and Y.
+
+    Returns:
+        list: the trained weights and biases.
+    """
+    init_key, rng_key = jra.split(rng_key)
+    opt_init, opt_update, get_params = optimizers.adam(learning_rate)
+    opt_state = opt_init(init_mlp(init_key, [X.shape[1], *hidden, Y.shape[1]]))
+
+    def loss(params, x, y):
+        return jnp.mean((mlp(params, x) - y)**2)
+
+    @jax.jit
+    def step(i, opt_state, x, y):
+        value, grads = jax.value_and_grad(loss)(get_params(opt_state), x, y)
+        return opt_update(i, grads, opt_state), value
+
+    n_batches = max(len(X) // batch_size, 1)
+    it = 0
+    for epoch in range(n_epochs):
+        rng_key, perm_key = jra.split(rng_key)
+        perm = np.asarray(jra.permutation(perm_key, len(X)))
+        for idx in np.array_split(perm, n_batches):
+            opt_state, value = step(it, opt_state, X[idx], Y[idx])
+            it += 1
+        if verbose and (epoch % max(n_epochs // 10, 1) == 0 or epoch == n_epochs - 1):
+            print(f'Epoch {epoch}: loss = {value:.3e}')
+    return get_params(opt_state)
+
+class Emulator:
+    """
+    Neural-network emulator of the outputs of ClassEngine, trained with `train`.
+    """
+    def __init__(self, bounds: dict, pcas: dict, networks: dict, shapes: dict, constants: dict, output_kwargs: dict) -> None:
+        """
+        Args:
+            bounds (dict): parameter ranges {parameter: (min, max)}, used to normalize the inputs.
+            pcas (dict): a PCA instance for each of the emulated outputs.
+            networks (dict): the trained network weights for each of the emulated outputs.
+            shapes (dict): the shape of a single sample of each of the emulated outputs.
+            constants (dict): outputs that do not depend on the parameters (e.g. 'Cls.ell').
+            output_kwargs (dict): the keyword arguments used to compute the training outputs (e.g. the k and z grids of P(k)).
+        """
+        self.names = list(bounds.keys())
+        self.bounds = bounds
+        self.pcas = pcas
+        self.networks = networks
+        self.shapes = shapes
+        self.constants = constants
+        self.output_kwargs = output_kwargs
+        self._lower, self._upper = (jnp.array(b) for b in np.array(list(bounds.values())).T)
+        self._predict = {key: jax.jit(lambda x, key=key: self.pcas[key].inverse_transform(mlp(self.networks[key], x)))
+                         for key in self.networks}
+        # the current parameters (see `update`), starting from the centre of the prior box
+        self._theta = {name: np.mean(bounds[name]) for name in self.names}
+
+    def predict(self, theta: Union[np.ndarray, dict], outputs: Optional[list[str]] = None) -> dict:
+        """
+        Batched prediction of the emulated outputs.
+
+        Args:
+            theta (np.ndarray | dict): an array of shape (n_points, n_params), ordered as `self.names`, or a dictionary {parameter: values}.
+            outputs (list[str] | None, optional): the (flattened) outputs to predict, e.g. ['Cls.tt','Pk']. Defaults to None, i.e. all of them.
+
+        Returns:
+            dict: the predicted outputs, each with shape (n_points, ...).
+        """
+        if isinstance(theta, dict):
+            theta = jnp.stack([jnp.atleast_1d(theta[name]) for name in self.names], axis=-1)
+        x = (jnp.atleast_2d(theta) - self._lower) / (self._upper - self._lower)
+        outputs = self.networks.keys() if outputs is None else outputs
+        return {key: self._predict[key](x).reshape(-1, *self.shapes[key]) for key in outputs}
+
+    def update(self, info: dict) -> None:
+        """Set the current values of the parameters, as in ClassEngine.update"""
+        self._theta.update({name: val for name, val in info.items() if name in self.bounds})
+
+    @property
+    def Cls(self) -> dict:
+        """Emulated Cls for the current parameters (see `update`), in the same format as ClassEngine.Cls"""
+        keys = [key for key in self.networks if key.startswith('Cls.')]
+        Cls = {key.split('.', 1)[1]: val[0] for key, val in self.predict(self._theta, keys).items()}
+        Cls.update({key.split('.', 1)[1]: val for key, val in self.constants.items() if key.startswith('Cls.')})
+        return Cls
+
+    def Pk(self, k: Optional[np.ndarray] = None, z: Optional[Union[float, np.ndarray]] = None, **kwargs) -> np.ndarray:
+        """
+        Emulated P(k) for the current parameters (see `update`), in the same format as ClassEngine.Pk.
+        The redshifts, units and linear/non-linear settings are fixed by the training set, while the power spectrum
+        is interpolated (log-log) when k differs from the training k.
+
+        Returns:
+            np.ndarray: P(k) with shape (len(k),) for a scalar z and (len(z),len(k)) otherwise.
+        """
+        train_kwargs = self.output_kwargs.get('Pk', {})
+        for key, val in dict(kwargs, z=z).items():
+            if val is None:
+                continue
+            if key not in train_kwargs:
+                raise ValueError(f'The emulator was trained with the default {key} of ClassEngine.Pk, '
+                                 f"set it in output_kwargs['Pk'] when training to use {key}={val}")
+            if np.shape(val) != np.shape(train_kwargs[key]) or np.any(np.asarray(val) != np.asarray(train_kwargs[key])):
+                raise ValueError(f'The emulator was trained with {key}={train_kwargs[key]}')
+        pk = np.asarray(self.predict(self._theta, ['Pk'])['Pk'][0])
+        if k is None:
+            return pk
+        log_k_train = np.log(train_kwargs['k'])
+        return np.exp(np.apply_along_axis(lambda row: np.interp(np.log(k), log_k_train, row), -1, np.log(pk)))
+
+    def save(self, filename: str) -> None:
+        """Store the emulator in a (pickle) file."""
+        networks = {key: [(np.asarray(W), np.asarray(b)) for W, b in net] for key, net in self.networks.items()}
+        with open(filename, 'wb') as file:
+            pickle.dump({'bounds': self.bounds, 'pcas': self.pcas, 'networks': networks, 'shapes': self.shapes,
+                         'constants': self.constants, 'output_kwargs': self.output_kwargs}, file)
+
+    @classmethod
+    def load(cls, filename: str) -> 'Emulator':
+        """Load an emulator stored with `Emulator.save`."""
+        with open(filename, 'rb') as file:
+            return cls(**pickle.load(file))
+
+def train(info: dict, engine, outputs: Optional[list[str]] = None, output_kwargs: Optional[dict] = None,
+          n_samples: int = 10000, n_components: int = 20, hidden: tuple[int, ...] = (128, 128, 128),
+          n_epochs: int = 2000, learning_rate: float = 1e-3, n_workers: Optional[int] = None,
+          checkpoint: Optional[str] = None, seed: int = 0, verbose: bool = True) -> Emulator:
+    """
+    Train an emulator of the ClassEngine outputs over the prior ranges of a Cobaya-like info dictionary.
+
+    Args:
+        info (dict): settings for the run, with the priors of the sampled (Class) parameters in info['params'].
+        engine (ClassEngine): a ClassEngine instance with the fixed settings of the runs.
+        outputs (list[str] | None, optional): the ClassEngine outputs to emulate, e.g. ['Cls','Pk']. Defaults to None, i.e. ['Cls'].
+        output_kwargs (dict | None, optional): keyword arguments for the outputs, e.g. {'Pk': {'k':k,'z':z}}. Defaults to None.
+        n_samples (int, optional): number of points in the Latin hypercube design. Defaults to 10000.
+        n_components (int, optional): number of PCA components kept for each output. Defaults to 20.
+        hidden (tuple[int, ...], optional): sizes of the hidden layers of the networks. Defaults to (128, 128, 128).
+        n_epochs (int, optional): number of training epochs. Defaults to 2000.
+        learning_rate (float, optional): learning rate of the Adam optimizer. Defaults to 1e-3.
+        n_workers (int | None, optional): number of processes running Class. Defaults to None, i.e. the number of CPUs.
+        checkpoint (str | None, optional): a folder where to store the training set as it is computed. Defaults to None.
+        seed (int, optional): seed for the design and the network initialization. Defaults to 0.
+        verbose (bool, optional): print the training loss. Defaults to True.
+
+    Returns:
+        Emulator: the trained emulator.
+    """
+    output_kwargs = {} if output_kwargs is None else output_kwargs
+    bounds = get_prior_bounds(info)
+    samples = latin_hypercube(bounds, n_samples, seed=seed)
+    data = generate_training_set(engine, list(bounds.keys()), samples, outputs=outputs, output_kwargs=output_kwargs,
+                                 n_workers=n_workers, checkpoint=checkpoint)
+
+    success = data.pop('success')
+    if not success.any():
+        raise ValueError(f'Class failed for all the {n_samples} points of the design, check the settings of the engine')
+    lower, upper = np.array(list(bounds.values())).T
+    X = (samples[success] - lower) / (upper - lower)
+
+    rng_key = jra.PRNGKey(seed)
+    pcas, networks, shapes, constants = {}, {}, {}, {}
+    for key, Y in data.items():
+        Y = Y[success]
+        if np.all(Y == Y[0]):
+            constants[key] = Y[0]
+            continue
+        shapes[key] = Y.shape[1:]
+        Y = Y.reshape(len(Y), -1)
+        pcas[key] = PCA(n_components=min(n_components, *Y.shape)).fit(Y)
+        if verbose:
+            print(f'Training the emulator for {key}')
+        rng_key, fit_key = jra.split(rng_key)
+        networks[key] = fit_mlp(fit_key, X, pcas[key].transform(Y), hidden=hidden, n_epochs=n_epochs,
+                                learning_rate=learning_rate, verbose=verbose)
 
-def train():
-    pass
+    return Emulator(bounds, pcas, networks, shapes, constants, output_kwargs)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""Tests for the posterior of functions of `cosmo_ml_tools.analysis.analysis`."""
+
+
+import threading
+import unittest
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from getdist import MCSamples
+
+from cosmo_ml_tools.analysis.analysis import Analysis, posterior_y
+
+
+def line(x, theta):
+    """y = a + b x for a batch of samples of (a, b)"""
+    return theta[:, :1] + theta[:, 1:] * x[None]
+
+
+class TestPosteriorY(unittest.TestCase):
+    """Tests for the chunked and parallel evaluation of y = f(x, theta)."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.linspace(0, 1, 20)
+        self.samples = rng.normal(size=(1050, 2))
+        self.weights = rng.integers(1, 4, size=1050).astype(float)
+
+    def test_executors(self):
+        """Serial, threaded and multiprocess evaluations yield the same chunks, in order, with their weights."""
+        expected = line(self.x, self.samples)
+        for n_workers, executor, vectorized in ((None, 'thread', True), (None, 'thread', False), (2, 'thread', True), (2, 'process', True)):
+            with self.subTest(n_workers=n_workers, executor=executor, vectorized=vectorized):
+                blocks = list(posterior_y(self.x, line if vectorized else lambda x, t: line(x, t[None])[0], self.samples,
+                                          self.weights, chunk_size=100, n_workers=n_workers, executor=executor, vectorized=vectorized))
+                self.assertEqual(len(blocks), 11)
+                ys, ws = zip(*blocks)
+                np.testing.assert_allclose(np.concatenate(ys), expected, rtol=1e-15)
+                np.testing.assert_array_equal(np.concatenate(ws), self.weights)
+
+    def test_bounded_in_flight(self):
+        """At most 2 x n_workers chunks are evaluated ahead of the consumer."""
+        calls, lock = [], threading.Lock()
+        def f(x, theta):
+            with lock:
+                calls.append(len(theta))
+            return line(x, theta)
+
+        blocks = posterior_y(self.x, f, self.samples, chunk_size=10, n_workers=2)
+        next(blocks)
+        self.assertLessEqual(len(calls), 4)
+        self.assertEqual(len(list(blocks)), 104)
+
+    def test_plot_posterior_y(self):
+        """The plotted median is the weighted median of y(x) over the samples."""
+        analysis = Analysis()
+        analysis._chains = {'line': MCSamples(samples=self.samples, weights=self.weights, names=['a', 'b'])}
+        _, ax = plt.subplots()
+        analysis.plot_posterior_y(self.x, line, ['a', 'b'], ax=ax, chunk_size=100, n_workers=2)
+        median = ax.get_lines()[0].get_ydata()
+        y = np.repeat(line(self.x, self.samples), self.weights.astype(int), axis=0)
+        np.testing.assert_allclose(median, np.median(y, 0), atol=1e-2)
+        plt.close(ax.figure)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""Tests for the chain readers of `cosmo_ml_tools.analysis.chain`."""
+
+
+import os
+import unittest
+import tempfile
+from importlib.util import find_spec
+
+import numpy as np
+
+from cosmo_ml_tools.analysis.chain import read_chain, read_chains, convert_to_harmonic
+
+
+class TestReadChains(unittest.TestCase):
+    """Tests for the column-selective (and parallel) reading of text chains."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.root = os.path.join(tempfile.mkdtemp(), 'chain')
+        self.chains = []
+        for i, n in enumerate((200, 150, 180), start=1):
+            chain = np.column_stack([rng.integers(1, 5, n), rng.exponential(size=n), rng.normal(size=(n, 4))])
+            np.savetxt(f'{self.root}.{i}.txt', chain, header='weight minuslogpost a b c d')
+            self.chains.append(chain)
+        self.fnames = [f'{self.root}.{i}.txt' for i in range(1, 4)]
+
+    def test_read_chain(self):
+        """Only the requested columns are read, in increasing order."""
+        np.testing.assert_array_equal(read_chain(self.fnames[0]), self.chains[0])
+        np.testing.assert_array_equal(read_chain(self.fnames[0], usecols=[3, 1]), self.chains[0][:, [1, 3]])
+
+    @unittest.skipIf(find_spec('pandas') is None, 'pandas is not installed')
+    def test_pandas_engine(self):
+        """The pandas parser reads the same values as numpy."""
+        np.testing.assert_allclose(read_chain(self.fnames[0], usecols=[1, 2], engine='pandas'), self.chains[0][:, 1:3], rtol=1e-15)
+
+    def test_read_chains(self):
+        """Reading the chains in parallel gives the chains of a serial read, in the same order."""
+        for chain, serial, parallel in zip(self.chains, read_chains(self.fnames, usecols=[0, 2], n_workers=1),
+                                           read_chains(self.fnames, usecols=[0, 2], n_workers=2)):
+            np.testing.assert_array_equal(serial, chain[:, [0, 2]])
+            np.testing.assert_array_equal(parallel, serial)
+
+    def test_convert_to_harmonic(self):
+        """The harmonic samples and log-posteriors are those of the full chains, truncated to the shortest one and without burn-in."""
+        ndim, ignore = 3, 0.3
+        samples, lnprob = convert_to_harmonic(self.root, ndim, N=3, ignore=ignore, n_workers=2)
+        min_len = min(len(chain) for chain in self.chains)
+        burn_in = int(ignore * min_len)
+        self.assertEqual(samples.shape, (3, min_len - burn_in, ndim))
+        for i, chain in enumerate(self.chains):
+            np.testing.assert_array_equal(samples[i], chain[burn_in:min_len, 2:ndim + 2])
+            np.testing.assert_array_equal(lnprob[i], -chain[burn_in:min_len, 1])
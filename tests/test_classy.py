@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Tests for the per-cosmology caches of `cosmo_ml_tools.cosmology.classy.ClassEngine`."""
+
+
+import unittest
+from importlib.util import find_spec
+
+import numpy as np
+
+from cosmo_ml_tools.cosmology.classy import ClassEngine
+
+
+@unittest.skipIf(find_spec('classy') is None, 'Class (classy) is not installed')
+class TestClassEngineCache(unittest.TestCase):
+    """Tests for the outputs stored for the current cosmology."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = ClassEngine(info={'output': 'tCl', 'h': 0.7})
+
+    def setUp(self):
+        self.engine.update({'h': 0.7})
+
+    def test_outputs_are_cached(self):
+        """The outputs are extracted from Class once per cosmology."""
+        misses = self.engine.cache_info.get('background', {'misses': 0})['misses']
+        background = self.engine.background
+        self.assertIs(self.engine.background, background)
+        self.assertIs(self.engine.Cls, self.engine.Cls)
+        self.assertEqual(self.engine.cache_info['background']['misses'], misses + 1)
+        self.assertGreaterEqual(self.engine.cache_info['background']['hits'], 1)
+
+    def test_update_invalidates(self):
+        """Updating the cosmology drops the outputs of the previous one."""
+        background, Cls, interp = self.engine.background, self.engine.Cls, self.engine.bg_interp
+        misses = self.engine.cache_info['background']['misses']
+        self.engine.update({'h': 0.68})
+        self.assertEqual(self.engine.cache_info['background']['misses'], misses)
+        H0 = self.engine.background['H [1/Mpc]'][-1]
+        self.assertEqual(self.engine.cache_info['background']['misses'], misses + 1)
+        np.testing.assert_allclose(H0 / background['H [1/Mpc]'][-1], 0.68 / 0.7)
+        self.assertFalse(np.allclose(self.engine.Cls['tt'], Cls['tt']))
+        self.assertIsNot(self.engine.bg_interp, interp)
+
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""Tests for the convergence diagnostics of `cosmo_ml_tools.stats.convergence`."""
+
+
+import unittest
+
+import numpy as np
+from getdist import MCSamples
+
+from cosmo_ml_tools.stats.convergence import gelman_rubin, split_rhat
+from cosmo_ml_tools.analysis.analysis import Analysis
+
+
+class TestGelmanRubin(unittest.TestCase):
+    """Tests for the Gelman-Rubin statistics."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.chains = [rng.normal(size=(500, 3)) for _ in range(4)]
+
+    def test_matches_direct_computation(self):
+        """The streaming R-1 is the variance of the chain means over the mean of the chain variances."""
+        means = np.array([chain.mean(0) for chain in self.chains])
+        variances = np.array([chain.var(0) for chain in self.chains])
+        R = gelman_rubin(self.chains, chunk_size=128)
+        np.testing.assert_allclose(R, means.var(0, ddof=1) / variances.mean(0))
+
+    def test_single_chain(self):
+        """A single chain raises a clear error instead of returning NaN."""
+        with self.assertRaisesRegex(ValueError, 'at least 2 chains'):
+            gelman_rubin(self.chains[:1])
+
+    def test_single_chain_label(self):
+        """A label made of a single chain has a NaN R-1 (with a warning), and does not prevent the others from being reported."""
+        analysis = Analysis()
+        analysis._chains = {'single': MCSamples(samples=[self.chains[0]], names=['a', 'b', 'c']),
+                            'multiple': MCSamples(samples=self.chains, names=['a', 'b', 'c'])}
+        with self.assertWarnsRegex(UserWarning, 'at least 2 chains'):
+            R = analysis.GelmanRubin
+        self.assertTrue(np.all(np.isnan(list(R['single'].values()))))
+        np.testing.assert_allclose(list(R['multiple'].values()), gelman_rubin(self.chains))
+        # the split R-hat is defined for a single chain
+        R = analysis._getGelmanRubin(method='rank')['single']
+        self.assertTrue(np.all(np.isfinite(list(R.values()))))
+
+    def test_split_rhat_converged(self):
+        """Independent chains drawn from the same distribution have R-hat close to 1."""
+        self.assertLess(np.max(split_rhat(self.chains)), 1.01)
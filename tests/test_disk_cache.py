@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Tests for the on-disk cache of `cosmo_ml_tools.cosmology.cache`."""
+
+
+import os
+import time
+import unittest
+import tempfile
+from importlib.util import find_spec
+
+import numpy as np
+
+from cosmo_ml_tools.cosmology.cache import DiskCache
+from cosmo_ml_tools.cosmology.classy import ClassEngine
+
+
+class TestDiskCache(unittest.TestCase):
+    """Tests for the storage, hits and eviction of the DiskCache."""
+
+    def setUp(self):
+        self.cache = DiskCache(tempfile.mkdtemp())
+
+    def test_key(self):
+        """The key of a cosmology does not depend on the ordering of the parameters."""
+        self.assertEqual(DiskCache.key({'h': 0.7, 'omega_b': 0.022}), DiskCache.key({'omega_b': 0.022, 'h': 0.7}))
+        self.assertNotEqual(DiskCache.key({'h': 0.7}), DiskCache.key({'h': 0.68}))
+
+    def test_hits(self):
+        """Stored outputs are read back (memory-mapped), and hits and misses are counted per output."""
+        key = DiskCache.key({'h': 0.7})
+        self.assertIsNone(self.cache.get(key, 'background'))
+        background = {'z': np.linspace(0, 10, 50), 'H [1/Mpc]': np.linspace(1, 2, 50)}
+        self.cache.put(key, 'background', background)
+        self.cache.put(key, 'Pk', np.ones((3, 4)))
+        read = self.cache.get(key, 'background')
+        self.assertEqual(list(read), list(background))
+        for col, val in background.items():
+            np.testing.assert_array_equal(read[col], val)
+        self.assertIsInstance(self.cache.get(key, 'Pk'), np.memmap)
+        self.assertEqual((self.cache.hits['background'], self.cache.misses['background']), (1, 1))
+        self.assertEqual(self.cache.hits['Pk'], 1)
+
+    def test_ragged_dict_is_skipped(self):
+        """Dictionaries with values of different shapes are not stored."""
+        key = DiskCache.key({'h': 0.7})
+        self.cache.put(key, 'Cls', {'ell': np.arange(10), 'tt': np.arange(5)})
+        self.assertIsNone(self.cache.get(key, 'Cls'))
+
+    def test_lru_eviction(self):
+        """Once above max_size, the least recently used cosmologies are removed first."""
+        keys = [DiskCache.key({'h': h}) for h in (0.6, 0.7, 0.8)]
+        value = np.ones(1000)
+        for key in keys[:2]:
+            self.cache.put(key, 'Pk', value)
+        # the first cosmology is older than the second one, but is read again
+        now = time.time()
+        for i, key in enumerate(keys[:2]):
+            os.utime(os.path.join(self.cache.path, key), (now - 100 + i, now - 100 + i))
+        self.cache.get(keys[0], 'Pk')
+        self.cache.max_size = 2.5 * self.cache.size / 2
+        self.cache.put(keys[2], 'Pk', value)
+        self.assertIsNotNone(self.cache.get(keys[0], 'Pk'))
+        self.assertIsNone(self.cache.get(keys[1], 'Pk'))
+        self.assertIsNotNone(self.cache.get(keys[2], 'Pk'))
+
+
+@unittest.skipIf(find_spec('classy') is None, 'Class (classy) is not installed')
+class TestClassEngineDiskCache(unittest.TestCase):
+    """Tests for the ClassEngine outputs read from a DiskCache."""
+
+    def test_cached_cosmology_is_not_computed(self):
+        """A second engine with the same cosmology reads the outputs from the disk, without running Class."""
+        cache = DiskCache(tempfile.mkdtemp())
+        info = {'output': 'tCl', 'h': 0.7}
+        Cls = ClassEngine(info=info, disk_cache=cache).Cls
+        engine = ClassEngine(info=info, disk_cache=cache)
+        np.testing.assert_allclose(engine.Cls['tt'], Cls['tt'])
+        self.assertTrue(engine._pending_compute)
+        self.assertEqual(sum(cache.hits.values()), 1)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""Tests for the Gaussian Process tools of `cosmo_ml_tools.stats`."""
+
+
+import unittest
+
+import numpy as np
+import jax.numpy as jnp
+import jax.random as jra
+
+from cosmo_ml_tools.stats.gpjax import GaussianProcessJax, gp_predict_marginal, gp_log_likelihood, sparse_log_likelihood
+from cosmo_ml_tools.stats.kernels import ExpontentialSquaredKernel
+from scipy.stats import norm
+
+from cosmo_ml_tools.stats.acquisition import optimize_acquisition, _expected_improvement
+
+
+class TestOptimizeAcquisition(unittest.TestCase):
+    """Tests for the batch optimization of the acquisition functions."""
+
+    @classmethod
+    def setUpClass(cls):
+        X = jra.uniform(jra.PRNGKey(0), (30, 2))
+        y = jnp.sum((X - 0.3)**2, -1)
+        cls.gp = GaussianProcessJax(ExpontentialSquaredKernel, 2)
+        cls.gp.fit(jra.PRNGKey(0), X, y, num_restarts=2)
+
+    def test_batch_points_are_distinct(self):
+        """The q points of a batch never repeat."""
+        for acquisition in ('EI', 'UCB'):
+            for strategy in ('kriging_believer', 'local_penalization'):
+                with self.subTest(acquisition=acquisition, strategy=strategy):
+                    X = np.asarray(optimize_acquisition(jra.PRNGKey(1), self.gp, [(0, 1), (0, 1)], acquisition=acquisition,
+                                                        q=3, strategy=strategy, num_candidates=1000, num_restarts=5))
+                    self.assertEqual(X.shape, (3, 2))
+                    distance = np.linalg.norm(X[:, None] - X[None], axis=-1)[np.triu_indices(3, 1)]
+                    self.assertGreaterEqual(distance.min(), 1e-3)
+                    self.assertTrue(np.all((X >= 0) & (X <= 1)))
+
+
+class TestSparseGP(unittest.TestCase):
+    """Tests for the inducing-point approximations."""
+
+    def setUp(self):
+        self.X = jra.uniform(jra.PRNGKey(0), (40, 2))
+        self.y = jnp.sin(3 * self.X[:, 0]) + self.X[:, 1]
+        self.params = {"ell_f": jnp.array([0.3, 0.5]), "sigma_f": jnp.array(1.), "noise": jnp.array(1e-2)}
+
+    def test_inducing_at_training_points(self):
+        """With the training points as inducing points, FITC and VFE are the exact GP."""
+        exact = gp_log_likelihood(ExpontentialSquaredKernel, self.X, None, self.y, self.params)
+        for method in ('fitc', 'vfe'):
+            with self.subTest(method=method):
+                sparse = sparse_log_likelihood(ExpontentialSquaredKernel, self.X, self.X, self.y, self.params, method)
+                np.testing.assert_allclose(sparse, exact, rtol=1e-4)
+
+        samples = {k: v[None] for k, v in self.params.items()}
+        X_test = jra.uniform(jra.PRNGKey(1), (20, 2))
+        predictions = []
+        for sparse in (None, 'fitc'):
+            gp = GaussianProcessJax(ExpontentialSquaredKernel, 2, sparse=sparse, X_inducing=self.X)
+            gp._set_training_data(self.X, self.y)
+            gp.compute_cache(samples)
+            predictions.append(gp.predict_marginal(X_test))
+        for exact, sparse in zip(*predictions):
+            np.testing.assert_allclose(sparse, exact, atol=1e-4)
+
+    def test_vfe_lower_bound(self):
+        """With fewer inducing points, VFE is a lower bound of the exact log marginal likelihood."""
+        exact = gp_log_likelihood(ExpontentialSquaredKernel, self.X, None, self.y, self.params)
+        self.assertLess(sparse_log_likelihood(ExpontentialSquaredKernel, self.X, self.X[:10], self.y, self.params, 'vfe'), exact)
+
+
+class TestPaddedState(unittest.TestCase):
+    """Tests for the padded training sets used by the kriging believer."""
+
+    def test_matches_add_data(self):
+        """Filling the padded points gives the predictions of a GP extended with `add_data`."""
+        X = jra.uniform(jra.PRNGKey(0), (30, 2))
+        y = jnp.sum((X - 0.3)**2, -1)
+        X_new, y_new = jra.uniform(jra.PRNGKey(1), (2, 2)), jnp.array([0.1, 0.2])
+        X_test = jra.uniform(jra.PRNGKey(2), (50, 2))
+        for sparse in (None, 'fitc'):
+            with self.subTest(sparse=sparse):
+                gp = GaussianProcessJax(ExpontentialSquaredKernel, 2, sparse=sparse, num_inducing=10)
+                gp.fit(jra.PRNGKey(0), X, y, num_restarts=2)
+                state, y_residual = gp.get_padded_state(2)
+                shapes = state.X_train.shape
+                for x, y_x in zip(X_new, y_new):
+                    state, y_residual = gp.set_padded_point(state, y_residual, x, y_x)
+                self.assertEqual(state.X_train.shape, shapes)
+                gp.add_data(X_new, y_new)
+                for padded, extended in zip(gp_predict_marginal(gp.kernel, gp.mean_fn, state, X_test), gp.predict_marginal(X_test)):
+                    np.testing.assert_allclose(padded, extended, rtol=1e-8, atol=1e-10)
+
+
+class TestExpectedImprovement(unittest.TestCase):
+    """Tests for the analytic expected improvement."""
+
+    def test_closed_form(self):
+        """EI is E[max(y - y_best - xi, 0)] when maximizing and E[max(y_best - y - xi, 0)] when minimizing."""
+        mean = np.linspace(-1., 1., 11)[None]
+        sigma = np.linspace(0.1, 1., 11)[None]
+        y_best, xi = 0.2, 0.05
+        for maximize, improvement in ((True, mean - y_best - xi), (False, y_best - mean - xi)):
+            with self.subTest(maximize=maximize):
+                u = improvement / sigma
+                expected = improvement * norm.cdf(u) + sigma * norm.pdf(u)
+                EI = _expected_improvement(jnp.array(mean), jnp.array(sigma**2), y_best, xi=xi, maximize=maximize)
+                np.testing.assert_allclose(EI, expected[0], rtol=1e-6, atol=1e-12)
+                # Monte Carlo estimate of the expected improvement
+                y = mean + sigma * np.random.default_rng(0).normal(size=(200000, 11))
+                sampled = np.maximum(y - y_best - xi if maximize else y_best - y - xi, 0).mean(0)
+                np.testing.assert_allclose(EI, sampled, rtol=2e-2, atol=1e-3)
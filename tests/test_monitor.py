@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Tests for the incremental chain monitoring of `cosmo_ml_tools.plots.monitor` and `cosmo_ml_tools.stats.moments`."""
+
+
+import os
+import unittest
+import tempfile
+
+import numpy as np
+
+from cosmo_ml_tools.plots.monitor import ChainFollower
+from cosmo_ml_tools.stats.moments import RunningMoments
+from cosmo_ml_tools.stats.convergence import gelman_rubin
+
+
+class TestRunningMoments(unittest.TestCase):
+    """Tests for the merged (weighted) moments."""
+
+    def test_matches_numpy(self):
+        """Moments accumulated block by block are the weighted mean and covariance of all the samples."""
+        rng = np.random.default_rng(0)
+        x = rng.normal(size=(1000, 3)) @ rng.normal(size=(3, 3))
+        w = rng.integers(1, 5, size=1000).astype(float)
+        w[100:200] = 0.
+        acc = RunningMoments()
+        for start, stop in ((0, 7), (7, 100), (100, 200), (200, 650), (650, 1000)):
+            acc.update(x[start:stop], w[start:stop])
+        self.assertEqual(acc.weight, w.sum())
+        np.testing.assert_allclose(acc.mean, np.average(x, axis=0, weights=w))
+        np.testing.assert_allclose(acc.cov, np.cov(x.T, aweights=w, ddof=0))
+        np.testing.assert_allclose(acc.var, np.diag(acc.cov))
+
+    def test_unweighted_batches(self):
+        """Moments of several independent sets of samples are accumulated at once along the leading axes."""
+        x = np.random.default_rng(1).normal(size=(4, 500, 2))
+        acc = RunningMoments(covariance=False)
+        acc.update(x[:, :250])
+        acc.update(x[:, 250:])
+        np.testing.assert_allclose(acc.mean, x.mean(1))
+        np.testing.assert_allclose(acc.var, x.var(1))
+        with self.assertRaises(ValueError):
+            acc.cov
+
+
+class TestChainFollower(unittest.TestCase):
+    """Tests for the statistics updated as the chains grow."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.root = os.path.join(tempfile.mkdtemp(), 'run')
+        self.chains = [np.column_stack([rng.integers(1, 4, 300), rng.exponential(size=300), rng.normal(size=(300, 3)) + 0.1 * i])
+                       for i in range(3)]
+        self.text = [('# weight minuslogpost a b c\n' + ''.join(' '.join(f'{v:.10g}' for v in row) + '\n' for row in chain)).encode()
+                     for chain in self.chains]
+
+    def _write(self, i, stop):
+        """Write the first `stop` bytes of chain i"""
+        with open(f'{self.root}.{i + 1}.txt', 'wb') as file:
+            file.write(self.text[i][:stop])
+
+    def _complete_rows(self, i):
+        """The complete rows written to chain i"""
+        with open(f'{self.root}.{i + 1}.txt', 'rb') as file:
+            text = file.read()
+        return np.loadtxt(text[:text.rfind(b'\n') + 1].decode().splitlines(), ndmin=2)
+
+    def test_incremental_matches_batch(self):
+        """After each update, the statistics are those of the complete rows written so far."""
+        follower = ChainFollower(self.root)
+        for fraction in (0.1, 0.37, 0.8, 1.):
+            for i in range(3):
+                # the chains are written at different paces, and may end with a partial row
+                self._write(i, int(fraction * (i + 1) / 3 * len(self.text[i])) if fraction < 1 else len(self.text[i]))
+            follower.update()
+            rows = [self._complete_rows(i) for i in range(3)]
+            all_rows = np.concatenate(rows)
+            self.assertEqual(follower.n_rows, len(all_rows))
+            np.testing.assert_allclose(follower.means, np.average(all_rows[:, 2:], axis=0, weights=all_rows[:, 0]))
+            np.testing.assert_allclose(follower.cov, np.cov(all_rows[:, 2:].T, aweights=all_rows[:, 0], ddof=0))
+            np.testing.assert_allclose(follower.acceptance, [len(r) / r[:, 0].sum() for r in rows])
+            np.testing.assert_allclose(follower.R_minus_one, gelman_rubin([r[:, 2:] for r in rows], [r[:, 0] for r in rows]))
+        self.assertEqual(follower.params, ['a', 'b', 'c'])
+        self.assertEqual(len(follower.history), 4)
+        self.assertEqual(follower.update(), 0)
+
+    def test_new_and_restarted_chains(self):
+        """Chains appearing later are picked up, and a chain that was restarted is read again from the start."""
+        follower = ChainFollower(self.root, params=['b'])
+        self._write(0, len(self.text[0]))
+        follower.update()
+        self._write(1, len(self.text[1]))
+        follower.update()
+        self.assertEqual(follower.n_rows, 600)
+        self._write(0, len(self.text[0]) // 2)
+        follower.update()
+        rows = self._complete_rows(0)
+        self.assertEqual(follower.n_rows, 300 + len(rows))
+        np.testing.assert_allclose(follower._moments[f'{self.root}.1.txt'].mean, np.average(rows[:, 3:4], axis=0, weights=rows[:, 0]))
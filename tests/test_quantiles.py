@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""Tests for the streaming quantiles of `cosmo_ml_tools.stats.quantiles`."""
+
+
+import unittest
+
+import numpy as np
+
+from cosmo_ml_tools.stats.quantiles import StreamingQuantiles, streaming_percentile
+
+
+class TestStreamingQuantiles(unittest.TestCase):
+    """Tests for the streamed percentiles against `np.percentile`."""
+
+    q = [0.1, 2.3, 16, 50, 84, 97.7, 99.9]
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def assertRankClose(self, samples, estimate, tol=5e-4):
+        """The fraction of the samples below each estimated percentile is within tol of q"""
+        cdf = (np.sort(samples, 0)[None] <= estimate[:, None]).mean(1)
+        np.testing.assert_array_less(np.abs(cdf - np.array(self.q)[:, None] / 100), tol)
+
+    def _blocks(self, samples, size=10000):
+        return (samples[start:start + size] for start in range(0, len(samples), size))
+
+    def test_outliers(self):
+        """A single huge outlier does not degrade the percentiles of the bulk of the samples."""
+        samples = np.concatenate([self.rng.normal(1., 0.05, size=(100000, 4)), np.full((1, 4), 1e8)])
+        estimate = streaming_percentile(self._blocks(samples), self.q)
+        self.assertRankClose(samples, estimate)
+        np.testing.assert_allclose(estimate[1:-1], np.percentile(samples, self.q, axis=0)[1:-1], atol=1e-3)
+
+    def test_heavy_tails(self):
+        """The percentiles of Cauchy samples are accurate in rank."""
+        samples = self.rng.standard_cauchy(size=(100000, 4))
+        estimate = streaming_percentile(self._blocks(samples), self.q)
+        self.assertRankClose(samples, estimate)
+        np.testing.assert_allclose(estimate[2:-2], np.percentile(samples, self.q, axis=0)[2:-2], atol=1e-2)
+
+    def test_weights(self):
+        """Integer weights are equivalent to repeated samples."""
+        samples = self.rng.normal(size=(20000, 3))
+        weights = self.rng.integers(1, 5, size=20000)
+        estimate = streaming_percentile([(samples, weights)], self.q)
+        self.assertRankClose(np.repeat(samples, weights, axis=0), estimate)
+
+    def test_non_finite(self):
+        """Non-finite samples are dropped and counted."""
+        samples = self.rng.normal(size=(20000, 3))
+        samples[::100, 0] = np.inf
+        samples[1::100, 1] = np.nan
+        acc = StreamingQuantiles()
+        for block in self._blocks(samples, 1000):
+            acc.update(block)
+        np.testing.assert_array_equal(acc.n_nonfinite, [200, 200, 0])
+        estimate = acc.percentile(self.q)
+        self.assertTrue(np.all(np.isfinite(estimate)))
+        for i in range(3):
+            finite = samples[np.isfinite(samples[:, i]), i]
+            np.testing.assert_allclose(estimate[2:-2, i], np.percentile(finite, self.q[2:-2]), atol=1e-2)
+
+    def test_small_sample(self):
+        """With fewer samples than centroids the percentiles interpolate between the samples, from the minimum to the maximum."""
+        samples = self.rng.normal(size=(50, 2))
+        acc = StreamingQuantiles()
+        acc.update(samples)
+        np.testing.assert_allclose(acc.percentile([0, 100]), [samples.min(0), samples.max(0)])
+        np.testing.assert_allclose(acc.percentile(50), np.median(samples, 0), atol=0.1)